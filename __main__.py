@@ -1,12 +1,15 @@
 from __future__ import annotations
 
 import logging
+import sys
 import tkinter
 from typing import TYPE_CHECKING
 
+from packages import cli
 from packages.application import App
-from packages.constants import LOG_FILE_PATH, DATE_PATTERN
-from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.constants import LOG_FILE_PATH, DATE_PATTERN, DEFAULT_LOG_STORE_PATH, STORAGE_BACKENDS
+from packages.db.database_interface import DbInterface, WorktimeSqliteDbInterface
+from packages.db.log_store import LogStore, WorktimeLogDbInterface
 from packages.db.models import sqlite_engine
 from packages.ui.ui import Window, RowType, UiRow, UiTableConfig, UiTableColumn, TableColumnParams
 
@@ -17,7 +20,6 @@ _log = logging.getLogger("main")
 
 # TODO: Add 'refresh input value=True' option to config
 # TODO: select table columns in settings
-# TODO: add possibility to write >1 day info on time
 # TODO: display error and warnings at start
 # TODO: path to db in settings
 # TODO: read config at the beginning
@@ -47,7 +49,9 @@ MAIN_TABLE_CONFIG = UiTableConfig(
     ],
 )
 UI_CONFIG = {"main_table": MAIN_TABLE_CONFIG}
-APP_CONFIG: Dict[str, Union[int, str]] = {"max_rows": 10000}
+# "skip_weekends": 1 to leave saturdays and sundays out of date ranges
+# "storage": one of 'STORAGE_BACKENDS', the CLI uses the same one
+APP_CONFIG: Dict[str, Union[int, str]] = {"max_rows": 10000, "skip_weekends": 0, "storage": "sqlite"}
 
 file_handler = logging.FileHandler(LOG_FILE_PATH, "a", encoding="utf-8")
 logging.basicConfig(
@@ -57,9 +61,21 @@ logging.basicConfig(
     handlers=[file_handler],
 )
 
+assert APP_CONFIG["storage"] in STORAGE_BACKENDS, f"'storage' config value must be one of {STORAGE_BACKENDS}"
+if len(sys.argv) > 1:
+    sys.exit(cli.main(sys.argv[1:], storage=str(APP_CONFIG["storage"])))
+
 root = tkinter.Tk()
 _log.debug("Start application")
 window = Window(master=root, ui_config=UI_CONFIG, title=APP_NAME, geometry=WINDOW_GEOMETRY)
-app = App(app_config=APP_CONFIG, user_interface=window, db_if=WorktimeSqliteDbInterface(sqlite_engine))
+log_store = LogStore(DEFAULT_LOG_STORE_PATH) if APP_CONFIG["storage"] == "log" else None
+db_if: DbInterface
+if log_store is not None:
+    db_if = WorktimeLogDbInterface(log_store)
+else:
+    db_if = WorktimeSqliteDbInterface(sqlite_engine)
+app = App(app_config=APP_CONFIG, user_interface=window, db_if=db_if)
 root.mainloop()
+if log_store is not None:
+    log_store.close()
 _log.debug("Application closed")
@@ -0,0 +1,54 @@
+"""Per-keystroke cost of the input validation: the prefix automaton against the former regex masks.
+
+Run from the repository root: python -m benchmarks.bench_input_validator"""
+import re
+import timeit
+
+from packages.input_validator import InputValidator
+
+INPUTS = ["04.12.2022 08:00 12:00 13:00 18:00", "01.07.2023-14.07.2023 vacation", "04.12.2022 day off"]
+REPEAT = 2000
+
+
+def regex_masks(full_value: str, ind: str) -> bool:
+    date_mask = r"\d,\d,.,\d,\d,.,\d,\d,\d,\d"
+    masks = [
+        rf"{date_mask}, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d",
+        rf"{date_mask}, ,v,a,c,a,t,i,o,n",
+        rf"{date_mask}, ,o,f,f",
+        rf"{date_mask}, ,d,a,y, ,o,f,f",
+        rf"{date_mask}, ,s,i,c,k",
+        rf"{date_mask}, ,h,o,l,i,d,a,y",
+    ]
+    for mask in masks:
+        pattern = "".join(mask.split(",")[: int(ind) + 1])
+        if re.match(rf"{pattern}$", full_value[: int(ind) + 1]):
+            return True
+    return False
+
+
+def type_with_automaton(validator: InputValidator) -> None:
+    for value in INPUTS:
+        for i in range(len(value)):
+            validator.validate(value[: i + 1], value[i], "1", str(i))
+
+
+def type_with_regex_masks() -> None:
+    for value in INPUTS:
+        for i in range(len(value)):
+            regex_masks(value[: i + 1], str(i))
+
+
+def main() -> None:
+    keystrokes = sum(len(value) for value in INPUTS) * REPEAT
+    validator = InputValidator()
+    build = timeit.timeit(InputValidator, number=100) / 100
+    automaton = timeit.timeit(lambda: type_with_automaton(validator), number=REPEAT)
+    regex = timeit.timeit(type_with_regex_masks, number=REPEAT)
+    print(f"{'automaton build':<28}{build * 1e6:8.2f} us")
+    print(f"{'automaton per keystroke':<28}{automaton / keystrokes * 1e6:8.2f} us")
+    print(f"{'regex masks per keystroke':<28}{regex / keystrokes * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Latency of appending the current time to today's row through App, from the command to the refreshed table: typed
+input against the punch. The table shows the newest rows of a ten year history, eight marks are added per day.
+
+Run from the repository root: python -m benchmarks.bench_punch [calls]"""
+import datetime as dt
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from packages.application import App
+from packages.commands import AddMarks, Command, Punch
+from packages.constants import DATE_STRING_MASK, TIME_STRING_MASK, WorkDay
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime, create_sqlite_engine
+from packages.ui.null_ui import NullUserInterface
+
+DEFAULT_CALLS = 400
+HISTORY_DAYS = 3650
+MARKS_PER_DAY = 8
+FIRST_DATE = dt.date(2010, 1, 1)
+
+
+def _moment(i: int) -> dt.datetime:
+    """Marks of one day an hour apart, a new day after every 'MARKS_PER_DAY' calls"""
+    day = FIRST_DATE + dt.timedelta(days=HISTORY_DAYS + i // MARKS_PER_DAY)
+    return dt.datetime.combine(day, dt.time(8 + i % MARKS_PER_DAY))
+
+
+def _typed(moment: dt.datetime) -> Command:
+    return AddMarks((f"{moment.strftime(DATE_STRING_MASK)} {moment.strftime(TIME_STRING_MASK)}",))
+
+
+def _measure(name: str, calls: int, command: Callable[[dt.datetime], Command]) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_if = WorktimeSqliteDbInterface(create_sqlite_engine(str(Path(tmp_dir) / "worktime.db")))
+        history = [WorkDay(FIRST_DATE + dt.timedelta(days=i), [dt.time(8), dt.time(16)]) for i in range(HISTORY_DAYS)]
+        db_if.upsert([workday.as_db() for workday in history], table=Worktime)
+        app = App(app_config={}, user_interface=NullUserInterface(), db_if=db_if)
+        timings: List[float] = []
+        for i in range(calls):
+            start = time.perf_counter()
+            app.handle_commands([command(_moment(i))])
+            timings.append((time.perf_counter() - start) * 1e3)
+    timings.sort()
+    print(
+        f"{name:<12}{statistics.mean(timings):9.2f}{timings[len(timings) // 2]:9.2f}"
+        f"{timings[-len(timings) // 100]:9.2f}{timings[-1]:9.2f}"
+    )
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CALLS
+    logging.disable(logging.CRITICAL)
+    print(f"{'path':<12}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>9}  ms")
+    _measure("typed input", calls, _typed)
+    _measure("punch", calls, Punch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Team rollup time over a directory of single-user databases, with one process and with the whole pool.
+
+Run from the repository root: python -m benchmarks.bench_rollup [databases] [rows per database]"""
+import datetime as dt
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+
+from packages.db.models import Worktime, init_db
+from packages.db.rollup import rollup_directory
+
+DEFAULT_DATABASES = 200
+DEFAULT_ROWS = 2500
+FIRST_DATE = dt.date(2014, 1, 1)
+
+
+def make_database(db_path: str, rows: int, seed: int) -> None:
+    engine = create_engine(f"sqlite:///{db_path}")
+    init_db(engine)
+    first = FIRST_DATE.toordinal()
+    batch = []
+    for i in range(rows):
+        times = f"08:{(i + seed) % 60:02} 12:00 12:30 {16 + i % 3}:{(i * seed) % 59:02}"
+        batch.append(dict(user_id="default", date=str(first + i), times=times, day_type=""))
+    with engine.begin() as connection:
+        connection.execute(insert(Worktime), batch)
+    engine.dispose()
+
+
+def main() -> None:
+    databases = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DATABASES
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ROWS
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(databases):
+            make_database(str(Path(tmp_dir) / f"employee{i:04}.db"), rows, i)
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            report = rollup_directory(tmp_dir, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>3} workers  {report['databases']} databases  {report['rows']} rows  {elapsed:7.2f} s")
+
+
+if __name__ == "__main__":
+    main()
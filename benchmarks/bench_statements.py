@@ -0,0 +1,62 @@
+"""Per-call latency of single-row lookups and writes of the sqlite backend. Every call uses a key of its own, so the
+read cache never answers and each lookup is a query.
+
+Run from the repository root: python -m benchmarks.bench_statements [calls]"""
+import datetime as dt
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from packages.constants import WorkDay
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime, create_sqlite_engine
+
+DEFAULT_CALLS = 1000
+FIRST_DATE = dt.date(2000, 1, 1)
+
+
+def _row(i: int, minute: int = 0) -> WorkDay:
+    return WorkDay(FIRST_DATE + dt.timedelta(days=i), [dt.time(8, minute), dt.time(16, minute)])
+
+
+def _key(i: int) -> str:
+    return str(FIRST_DATE.toordinal() + i)
+
+
+def _measure(name: str, calls: int, call: Callable[[int], object]) -> None:
+    """Wall time per call, and the mean cpu time, which leaves out the waits for the disk on commit"""
+    timings: List[float] = []
+    cpu_start = time.process_time()
+    for i in range(calls):
+        start = time.perf_counter()
+        call(i)
+        timings.append((time.perf_counter() - start) * 1e6)
+    cpu = (time.process_time() - cpu_start) / calls * 1e6
+    timings.sort()
+    print(
+        f"{name:<24}{statistics.mean(timings):9.0f}{timings[len(timings) // 2]:9.0f}"
+        f"{timings[-len(timings) // 100]:9.0f}{cpu:9.0f}"
+    )
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CALLS
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_if = WorktimeSqliteDbInterface(create_sqlite_engine(str(Path(tmp_dir) / "worktime.db")))
+        db_if.upsert([_row(i).as_db() for i in range(calls * 2)], table=Worktime)
+        print(f"{'operation':<24}{'mean':>9}{'p50':>9}{'p99':>9}{'cpu':>9}  us")
+        _measure("find_in_db", calls, lambda i: db_if.find_in_db(table=Worktime, key=_key(i)))
+        _measure("find_many_in_db", calls, lambda i: db_if.find_many_in_db(table=Worktime, keys=[_key(calls + i)]))
+        _measure("update", calls, lambda i: db_if.update([_row(i, 1).as_db()], table=Worktime))
+        _measure("upsert", calls, lambda i: db_if.upsert([_row(i, 2).as_db()], table=Worktime, replace=True))
+        _measure("delete", calls, lambda i: db_if.delete([_key(i)], table=Worktime))
+        _measure("add", calls, lambda i: db_if.add([_row(i).as_db()], table=Worktime))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Write latency and recovery time of the storage backends. Writes are single-row upserts like a punch in the app,
+recovery is the time to open a store holding years of rows and read the newest page, as the app does on start.
+
+Run from the repository root: python -m benchmarks.bench_storage [writes] [rows]"""
+import datetime as dt
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from packages.constants import WorkDay
+from packages.db.database_interface import DbInterface, WorktimeSqliteDbInterface
+from packages.db.log_store import LogStore, WorktimeLogDbInterface, COMPACT_EVERY
+from packages.db.models import Worktime, create_sqlite_engine
+
+DEFAULT_WRITES = 2000
+DEFAULT_ROWS = 100000
+PAGE_SIZE = 50
+BATCH_SIZE = 5000
+FIRST_DATE = dt.date(1800, 1, 1)
+
+
+def _workday(i: int) -> WorkDay:
+    return WorkDay(FIRST_DATE + dt.timedelta(days=i), [dt.time(8, i % 60), dt.time(16 + i % 3, i % 59)])
+
+
+def _percentile(values: List[float], part: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * part))]
+
+
+def write_latency(name: str, db_if: DbInterface, writes: int) -> None:
+    timings: List[float] = []
+    for i in range(writes):
+        row = _workday(i).as_db()
+        start = time.perf_counter()
+        db_if.upsert([row], table=Worktime)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(
+        f"{name:<36}{statistics.mean(timings):9.3f}{_percentile(timings, 0.5):9.3f}"
+        f"{_percentile(timings, 0.99):9.3f}{timings[-1]:9.3f}"
+    )
+
+
+def recovery_time(name: str, open_db: Callable[[], DbInterface]) -> None:
+    start = time.perf_counter()
+    rows = open_db().read_page(table=Worktime, limit=PAGE_SIZE)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<36}{elapsed * 1000:9.1f} ms  {len(rows)} rows read")
+
+
+def fill(db_if: DbInterface, rows: int) -> None:
+    for batch_start in range(0, rows, BATCH_SIZE):
+        batch = range(batch_start, min(batch_start + BATCH_SIZE, rows))
+        db_if.upsert([_workday(i).as_db() for i in batch], table=Worktime)
+
+
+def main() -> None:
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WRITES
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ROWS
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        print(f"{'single-row upsert':<36}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>9}  ms")
+        write_latency("sqlite, wal", WorktimeSqliteDbInterface(create_sqlite_engine(str(tmp_path / "w.db"))), writes)
+        for fsync_batch in (1, 32):
+            store = LogStore(str(tmp_path / f"log_{fsync_batch}"), fsync_batch=fsync_batch)
+            write_latency(f"log, fsync every {fsync_batch}", WorktimeLogDbInterface(store), writes)
+            store.close()
+
+        print(f"\nopen and read the newest {PAGE_SIZE} of {rows} rows")
+        sqlite_path = str(tmp_path / "recovery.db")
+        fill(WorktimeSqliteDbInterface(create_sqlite_engine(sqlite_path)), rows)
+        recovery_time("sqlite", lambda: WorktimeSqliteDbInterface(create_sqlite_engine(sqlite_path)))
+
+        stores: List[LogStore] = []
+
+        def open_log() -> DbInterface:
+            stores.append(LogStore(str(tmp_path / "recovery")))
+            return WorktimeLogDbInterface(stores[-1])
+
+        fill(open_log(), rows)
+        stores[-1].compact()
+        stores[-1].close()
+        recovery_time("log, snapshot", open_log)
+        # single-row commits up to the next compaction, the longest log an open can meet
+        db_if = WorktimeLogDbInterface(stores[-1])
+        for i in range(rows, rows + COMPACT_EVERY - 1):
+            db_if.upsert([_workday(i).as_db()], table=Worktime)
+        stores[-1].close()
+        recovery_time(f"log, snapshot + {COMPACT_EVERY - 1} records", open_log)
+        stores[-1].close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Main table fill time for a long history: row preparation alone, cold and with the formatted rows cached,
+the diff of a refresh with one changed day, and the whole fill_main_table when a display is available.
+
+Run from the repository root: python -m benchmarks.bench_table_fill [days]"""
+import datetime as dt
+import sys
+import time
+import tkinter
+from typing import List
+
+from packages.application import App
+from packages.constants import WorkDay, DayType
+from packages.ui.ui import Window, UiTableConfig, UiTableColumn, TableColumnParams, TableModel, prepare_table_items
+
+DEFAULT_DAYS = 10000
+COLUMNS = [
+    TableColumnParams(UiTableColumn.TREE, 170, ""),
+    TableColumnParams(UiTableColumn.DATE, 120, "date"),
+    TableColumnParams(UiTableColumn.WORKTIME, 100, "worktime"),
+    TableColumnParams(UiTableColumn.PAUSES, 100, "pauses"),
+    TableColumnParams(UiTableColumn.OVERTIME, 120, "overtime"),
+    TableColumnParams(UiTableColumn.TIME_MARKS, 400, "time marks"),
+    TableColumnParams(UiTableColumn.DAY_TYPE, 90, "day type", "w"),
+]
+
+
+def make_weeks(days: int) -> List[List[WorkDay]]:
+    first = dt.date.today() - dt.timedelta(days=days)
+    workdays = []
+    for i in range(days):
+        if i % 30 == 0:
+            workdays.append(WorkDay(first + dt.timedelta(days=i), [dt.time(8), dt.time(16)], DayType.VACATION))
+        else:
+            times = [dt.time(8), dt.time(12), dt.time(12, 30), dt.time(16 + i % 3, i % 60)]
+            workdays.append(WorkDay(first + dt.timedelta(days=i), times))
+    return App._group_by_weeks(workdays)
+
+
+def main() -> None:
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DAYS
+    weeks_workdays = make_weeks(days)
+    columns = tuple(column.iid.value for column in COLUMNS if column.iid.value != "#0")
+
+    for label in ("prepare items", "prepare items, cached"):
+        start = time.perf_counter()
+        items = prepare_table_items(weeks_workdays, columns, set())
+        print(f"{label:<28}{(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    model = TableModel()
+    model.insert(items)
+    last = weeks_workdays[-1][-1]
+    weeks_workdays[-1][-1] = WorkDay(last.date, [dt.time(7), dt.time(15)])
+    start = time.perf_counter()
+    model.diff(prepare_table_items(weeks_workdays, columns, set()))
+    print(f"{'refresh diff':<28}{(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as e:
+        print(f"Table fill skipped, no display: {e}")
+        return
+    window = Window(root, {"main_table": UiTableConfig("workdays", [], COLUMNS)})
+    for _ in range(2):
+        start = time.perf_counter()
+        window.fill_main_table(weeks_workdays)
+        root.update()
+        print(f"{'fill and redraw':<28}{(time.perf_counter() - start) * 1000:8.1f} ms")
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Integrity scan time of a large team database: rows of many users over the same years, checked with one
+process and with the whole pool.
+
+Run from the repository root: python -m benchmarks.bench_verify [rows]"""
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+
+from packages.db.models import Worktime, init_db
+from packages.db.verify import verify_databases
+
+DEFAULT_ROWS = 1000000
+DAYS_PER_USER = 3650
+BATCH_SIZE = 100000
+FIRST_DATE = dt.date(2014, 1, 1)
+
+
+def make_database(db_path: str, rows: int) -> None:
+    engine = create_engine(f"sqlite:///{db_path}")
+    init_db(engine)
+    first = FIRST_DATE.toordinal()
+    with engine.begin() as connection:
+        for batch_start in range(0, rows, BATCH_SIZE):
+            batch = []
+            for i in range(batch_start, min(batch_start + BATCH_SIZE, rows)):
+                user, day = divmod(i, DAYS_PER_USER)
+                times = f"08:{i % 60:02} 12:00 12:30 {16 + i % 3}:{i % 59:02}"
+                batch.append(dict(user_id=f"user{user}", date=str(first + day), times=times, day_type=""))
+            connection.execute(insert(Worktime), batch)
+    engine.dispose()
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / "worktime.db")
+        make_database(db_path, rows)
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            report = verify_databases([db_path], workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>3} workers  {report['rows']} rows  {elapsed:7.2f} s  {report['issues']} issues")
+
+
+if __name__ == "__main__":
+    main()
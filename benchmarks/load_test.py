@@ -0,0 +1,85 @@
+"""Headless load test of App: replays a stream of submits, edits, deletes and undos through NullUserInterface
+against a temporary sqlite database and reports the latency of each operation kind.
+
+Run from the repository root: python -m benchmarks.load_test [operations] [burst]"""
+import datetime as dt
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+
+from packages.application import App
+from packages.commands import AddMarks, Command, DeleteRows, EditRow, ReplayJournal
+from packages.constants import DATE_STRING_MASK
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.ui.null_ui import NullUserInterface
+
+DEFAULT_OPERATIONS = 2000
+DEFAULT_BURST = 1
+FIRST_DATE = dt.date(2015, 1, 1)
+DAYS = 3000
+
+
+def make_command(rnd: random.Random, written: List[dt.date]) -> Command:
+    """A random operation, deletes only pick dates written before so they never fail"""
+    kind = rnd.random()
+    if 0.85 <= kind < 0.95 and written:
+        position = rnd.randrange(len(written))
+        written[position], written[-1] = written[-1], written[position]
+        return DeleteRows((written.pop(),))
+    if kind >= 0.95:
+        return ReplayJournal()
+    date = FIRST_DATE + dt.timedelta(days=rnd.randrange(DAYS))
+    if date not in written:
+        written.append(date)
+    date_string = date.strftime(DATE_STRING_MASK)
+    if kind < 0.6:
+        return AddMarks((f"{date_string} {rnd.randrange(7, 10):02}:{rnd.randrange(60):02}",))
+    return EditRow((f"{date_string} 08:00 {rnd.randrange(15, 19):02}:{rnd.randrange(60):02}",))
+
+
+def percentile(values: List[float], part: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * part))]
+
+
+def main() -> None:
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OPERATIONS
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BURST
+    # an undo may remove a date a later delete picks, App logs the failed delete and the run goes on
+    logging.disable(logging.CRITICAL)
+    rnd = random.Random(0)
+    timings: Dict[str, List[float]] = {}
+    written: List[dt.date] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ui = NullUserInterface()
+        engine = create_engine(f"sqlite:///{Path(tmp_dir) / 'worktime.db'}")
+        db_if = WorktimeSqliteDbInterface(engine)
+        App(app_config={"max_rows": 1000}, user_interface=ui, db_if=db_if)
+        for _ in range(0, operations, burst):
+            commands = [make_command(rnd, written) for _ in range(burst)]
+            for command in commands:
+                ui.put_command(command)
+            start = time.perf_counter()
+            ui.dispatch_commands()
+            elapsed = (time.perf_counter() - start) * 1000
+            kind = type(commands[0]).__name__ if burst == 1 else f"burst of {burst}"
+            timings.setdefault(kind, []).append(elapsed)
+        engine.dispose()
+
+    print(f"{'operation':<20}{'count':>7}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  ms")
+    for kind, values in sorted(timings.items()):
+        values.sort()
+        print(
+            f"{kind:<20}{len(values):>7}{statistics.mean(values):9.2f}{percentile(values, 0.5):9.2f}"
+            f"{percentile(values, 0.9):9.2f}{percentile(values, 0.99):9.2f}{values[-1]:9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
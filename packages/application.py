@@ -1,132 +1,480 @@
 from __future__ import annotations
 
 import datetime as dt
+import functools
+import heapq
+import itertools
 import logging
-import re
-from typing import Dict, Optional, List, Union, TYPE_CHECKING
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, List, Sequence, Union, TYPE_CHECKING
 
-from packages.constants import WorkDay, DATE_STRING_MASK
+from packages.commands import (
+    Command, AddMarks, EditRow, DeleteRows, DeleteRange, LoadAll, LoadOlder, ReplayJournal, ApplyFilter, Punch
+)
+from packages.constants import WorkDay, DATE_STRING_MASK, TIME_STRING_MASK
 from packages.db.models import Worktime
+from packages.input_validator import InputValidator
+from packages.workday_index import WorkDayIndex, WorkDayFilter
 from packages.utils import utils
 
 if TYPE_CHECKING:
-    from packages.db.database_interface import WorktimeSqliteDbInterface
+    from packages.db.database_interface import DbInterface
     from packages.ui.ui import UserInterface
 
 _log = logging.getLogger("app")
 
 AppConfig = Dict[str, Union[int, str]]
 
+DEFAULT_CACHE_SIZE = 2000
+DEFAULT_PAGE_SIZE = 50
+# rows of a keyset page read at a time when the table is streamed, no cursor stays open between pages
+STREAM_PAGE_SIZE = 256
+
+
+class WorkDayCache:
+    """LRU cache of stored WorkDays keyed by the database date key (ordinal string).
+
+    Keys from 'complete_from' on are known to be cached completely: a miss there means the row is not stored,
+    and the newest rows can be served without a query. App clears it when another process changes the database"""
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self._max_size = max_size
+        self._items: OrderedDict[str, WorkDay] = OrderedDict()
+        self._complete_from: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[WorkDay]:
+        workday = self._items.get(key)
+        if workday is not None:
+            self._items.move_to_end(key)
+        return workday
+
+    def is_known_missing(self, key: str) -> bool:
+        return key not in self._items and self._complete_from is not None and int(key) >= self._complete_from
+
+    def put(self, workday: WorkDay) -> None:
+        key = workday.as_db()["date"]
+        self._items[key] = workday
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_size:
+            evicted, _ = self._items.popitem(last=False)
+            if self._complete_from is not None and int(evicted) >= self._complete_from:
+                self._complete_from = int(evicted) + 1
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._complete_from = None
+
+    def remove(self, key: str) -> None:
+        """Forgets a deleted row, it stays known as missing"""
+        self._items.pop(key, None)
+
+    def invalidate(self, key: str) -> None:
+        """Forgets a row changed behind the cache, the key becomes unknown"""
+        self._items.pop(key, None)
+        if self._complete_from is not None and int(key) >= self._complete_from:
+            self._complete_from = int(key) + 1
+
+    def load(self, workdays: List[WorkDay], limit: Optional[int]) -> None:
+        """Caches the result of a newest-rows read with 'limit': every stored key from the oldest one read on
+        is now cached, or every key at all if fewer rows than 'limit' came"""
+        if limit is None or len(workdays) < limit:
+            complete_from: Optional[int] = 0
+        elif workdays:
+            complete_from = min(workday.date.toordinal() for workday in workdays)
+        else:
+            complete_from = None
+        if complete_from is not None and (self._complete_from is None or complete_from < self._complete_from):
+            self._complete_from = complete_from
+        # oldest first, so evictions while loading hit the oldest keys and only narrow the complete range
+        for workday in sorted(workdays):
+            self.put(workday)
+
+    def newest(self, limit: int) -> Optional[List[WorkDay]]:
+        """The newest 'limit' stored WorkDays, None if the cache can not tell them"""
+        if self._complete_from is None:
+            return None
+        complete_from = self._complete_from
+        keys = [key for key in self._items if int(key) >= complete_from]
+        if len(keys) < limit and complete_from > 0:
+            return None
+        return [self._items[key] for key in heapq.nlargest(limit, keys, key=int)]
+
+    def since(self, key: str) -> Optional[List[WorkDay]]:
+        """Every stored WorkDay from 'key' on, None if the cache can not tell them"""
+        if self._complete_from is None or int(key) < self._complete_from:
+            return None
+        return [workday for item_key, workday in self._items.items() if int(item_key) >= int(key)]
+
 
 class App:
     def __init__(
-            self, *, app_config: AppConfig, user_interface: UserInterface, db_if: WorktimeSqliteDbInterface
+            self, *, app_config: AppConfig, user_interface: UserInterface, db_if: DbInterface
     ) -> None:
         self._app_config = app_config
         self._ui = user_interface
         self._db_if = db_if
-        self._data_buffer: Dict[str, WorkDay] = {}
+        cache_size = self._app_config.get("cache_size", DEFAULT_CACHE_SIZE)
+        assert isinstance(cache_size, int), "'cache_size' config value must be integer"
+        self._data_buffer = WorkDayCache(cache_size)
+        self._input_validator = InputValidator()
+        self._workday_index: Optional[WorkDayIndex] = None
+        # key of the oldest row in the table, None when there is nothing older to page in
+        self._oldest_shown_key: Optional[str] = None
+        # query of the filter the table shows, None for the newest rows
+        self._shown_query: Optional[str] = None
         self._item_to_focus: Optional[str] = None
+        self._external_changes = self._db_if.external_changes()
         self._prepare_ui()
 
     def _prepare_ui(self) -> None:
         self._ui.insert_default_value()
-        self._set_ui_variables_tracing()
+        self._ui.set_command_handler(self.handle_commands)
         self._ui.set_input_validator(self.validate_input)
         self.fill_ui_with_workdays(limit=10)
 
-    def _set_ui_variables_tracing(self) -> None:
-        input_var = self._ui.get_variable("input_value")
-        input_var.trace_variable("w", lambda *x: self.add_to_db(input_var.get()))
-
-        rows_to_delete_var = self._ui.get_variable("rows_to_be_deleted")
-        rows_to_delete_var.trace_variable("w", lambda *x: self.delete_db_rows(rows_to_delete_var.get().split(",")))
-
-        edit_table_row_var = self._ui.get_variable("edited_table_row")
-        edit_table_row_var.trace_variable("w", lambda *x: self.add_to_db(edit_table_row_var.get(), force_update=True))
-
-        fill_table_with_all_data_var = self._ui.get_variable("fill_table_with_all_data")
-        fill_table_with_all_data_var.trace_variable("w", lambda *x: self.fill_ui_with_workdays())
+    def _max_rows(self) -> int:
+        config_limit = self._app_config.get("max_rows", None)
+        assert config_limit is not None, "Please provide 'max_rows' config value with 'app_config'"
+        assert isinstance(config_limit, int), "'max_rows' config value must be integer"
+        return config_limit
 
     def _prepare_data_from_db(self, limit: Optional[int] = None) -> List[List[WorkDay]]:
         if limit is None:
-            config_limit = self._app_config.get("max_rows", None)
-            assert config_limit is not None, "Please provide 'max_rows' config value with 'app_config'"
-            assert isinstance(config_limit, int), "'max_rows' config value must be integer"
-            limit = config_limit
+            limit = self._max_rows()
         try:
-            workdays = sorted(res.as_workday() for res in self._db_if.read(table=Worktime, limit=limit))
-            # group workdays by weeks
-            weeks_workdays: List[List[WorkDay]] = [[]]
-            current_week = workdays[0].week
-            for workday in workdays:
-                if current_week != workday.week:
-                    weeks_workdays.append([])
-                    current_week = workday.week
-                weeks_workdays[-1].append(workday)
-            _log.debug(f"{len(workdays)} rows from database have been prepared")
-            return weeks_workdays
+            cached = self._data_buffer.newest(limit)
+            if cached:
+                # the same whole weeks a database page would give
+                oldest = min(cached).date
+                cached = self._data_buffer.since(str(oldest.toordinal() - oldest.weekday()))
+            if cached is not None:
+                workdays = sorted(cached)
+                _log.debug(f"{len(workdays)} rows have been taken from cache")
+            else:
+                workdays = sorted(res.as_workday() for res in self._db_if.read_page(table=Worktime, limit=limit))
+                self._data_buffer.load(workdays, limit)
+                _log.debug(f"{len(workdays)} rows from database have been prepared")
+            return self._group_by_weeks(workdays)
         except Exception:
             _log.exception("Failed to prepare data from the database")
             return []
 
+    @staticmethod
+    def _group_by_weeks(workdays: List[WorkDay]) -> List[List[WorkDay]]:
+        if not workdays:
+            return []
+        weeks_workdays: List[List[WorkDay]] = [[]]
+        current_week = workdays[0].week
+        for workday in workdays:
+            if current_week != workday.week:
+                weeks_workdays.append([])
+                current_week = workday.week
+            weeks_workdays[-1].append(workday)
+        return weeks_workdays
+
+    def _forget_external_changes(self) -> None:
+        """Drops the cached rows once another process has changed the database, e.g. with a CLI punch"""
+        external_changes = self._db_if.external_changes()
+        if external_changes != self._external_changes:
+            self._external_changes = external_changes
+            self._data_buffer.clear()
+            self._workday_index = None
+            _log.debug("Database changed by another process, cached rows dropped")
+
     def fill_ui_with_workdays(self, limit: Optional[int] = None) -> None:
+        self._forget_external_changes()
         weeks_workdays = self._prepare_data_from_db(limit=limit)
+        self._oldest_shown_key = weeks_workdays[0][0].as_db()["date"] if weeks_workdays else None
+        self._shown_query = None
         try:
             self._ui.fill_main_table(weeks_workdays, focus_item=self._item_to_focus)
             _log.debug("All fetched database rows have been inserted into main table")
         except Exception:
             _log.exception("Failed to fill main table")
 
-    def add_to_db(self, table_value: str, force_update: bool = False) -> None:
-        skip_update = False
+    def _stream_newest_weeks(self, limit: int) -> Iterator[List[WorkDay]]:
+        """Whole weeks of the newest 'limit' stored days, newest week first, the days a database page would give.
+        Rows are read a keyset page at a time, so no more than a page and the week being grouped are kept, and no
+        cursor stays open while the table renders. The key of the oldest shown row follows the weeks as they are
+        taken"""
+        workdays = (row.as_workday() for rows in self._newest_pages() for row in rows)
+        self._oldest_shown_key = None
+        shown = 0
+        for _, week in itertools.groupby(workdays, key=lambda workday: workday.week):
+            week_workdays = list(week)
+            week_workdays.reverse()
+            self._oldest_shown_key = week_workdays[0].as_db()["date"]
+            yield week_workdays
+            shown += len(week_workdays)
+            if shown >= limit:
+                return
+
+    def _newest_pages(self) -> Iterator[List[Worktime]]:
+        before: Optional[str] = None
+        while True:
+            rows = self._db_if.read_page(table=Worktime, before=before, limit=STREAM_PAGE_SIZE)
+            if not rows:
+                return
+            yield rows
+            before = str(rows[-1].date)
+
+    def load_all_workdays(self) -> None:
+        """Streams the newest 'max_rows' stored days into the table, the table takes the weeks as it renders them"""
+        self._shown_query = None
         try:
-            new_workday = WorkDay.from_values(table_value)
-            key = new_workday.as_db()["date"]
-            found_in_db = self._db_if.find_in_db(table=Worktime, key=key)
-            if found_in_db is not None:
-                assert len(found_in_db) == 1, f"CRITICAL: database contains {len(found_in_db)} items for '{key}' key"
-                workday_from_db = found_in_db[0].as_workday()
-                if not force_update:
-                    new_workday = workday_from_db + new_workday
-                    if new_workday == workday_from_db:
-                        skip_update = True
-                else:
-                    _log.warning(f"Database values '{workday_from_db}' will be replaced with '{new_workday}'")
-            if not skip_update:
-                db_row_values = new_workday.as_db()
-                self._db_if.write_to_db([db_row_values], table=Worktime)
-                self._item_to_focus = utils.date_to_str(new_workday.date, DATE_STRING_MASK)
+            self._ui.stream_main_table(self._stream_newest_weeks(self._max_rows()), focus_item=self._item_to_focus)
         except Exception:
-            _log.exception("Failed to add values to database")
-            skip_update = True
-        self._ui.insert_default_value()
-        if not skip_update:
+            _log.exception("Failed to fill main table")
+
+    def load_older_workdays(self) -> None:
+        """Pages the whole weeks older than the shown ones into the top of the table"""
+        if self._oldest_shown_key is None:
+            return
+        page_size = self._app_config.get("page_size", DEFAULT_PAGE_SIZE)
+        assert isinstance(page_size, int), "'page_size' config value must be integer"
+        try:
+            rows = self._db_if.read_page(table=Worktime, before=self._oldest_shown_key, limit=page_size)
+            workdays = sorted(row.as_workday() for row in rows)
+        except Exception:
+            _log.exception("Failed to read older rows from the database")
+            return
+        if not workdays:
+            _log.debug("All database rows are shown")
+            self._oldest_shown_key = None
+            return
+        self._oldest_shown_key = workdays[0].as_db()["date"]
+        try:
+            self._ui.prepend_to_main_table(self._group_by_weeks(workdays))
+            _log.debug(f"{len(workdays)} older rows have been inserted into main table")
+        except Exception:
+            _log.exception("Failed to insert older rows into main table")
+
+    def _get_workday_index(self) -> WorkDayIndex:
+        """Filter index over all stored WorkDays, built on first use after a change"""
+        if self._workday_index is None:
+            workdays = [
+                WorkDay.from_db(date, times, day_type)
+                for rows in self._db_if.iter_rows(table=Worktime)
+                for _, date, times, day_type in rows
+            ]
+            self._workday_index = WorkDayIndex(workdays)
+            _log.debug(f"Filter index has been built over {len(workdays)} rows")
+        return self._workday_index
+
+    def filter_ui_workdays(self, query: str) -> None:
+        """Fills the table with the stored WorkDays matching the filter query, an empty query resets the table"""
+        if not query.strip():
             self.fill_ui_with_workdays(limit=10)
+            return
+        try:
+            workdays = self._get_workday_index().query(WorkDayFilter.from_string(query))
+        except ValueError as e:
+            _log.warning(f"Wrong filter: {e}")
+            return
+        except Exception:
+            _log.exception("Failed to filter workdays")
+            return
+        if not workdays:
+            _log.warning(f"No days match the filter: '{query}'")
+        self._oldest_shown_key = None
+        self._shown_query = query
+        try:
+            self._ui.fill_main_table(self._group_by_weeks(workdays))
+            _log.debug(f"{len(workdays)} days match the filter: '{query}'")
+        except Exception:
+            _log.exception("Failed to fill main table")
+
+    def _find_workdays(self, keys: List[str]) -> Dict[str, WorkDay]:
+        """Stored WorkDays for the keys, the database is asked once for the keys the cache can not tell"""
+        found: Dict[str, WorkDay] = {}
+        unknown: List[str] = []
+        for key in keys:
+            workday = self._data_buffer.get(key)
+            if workday is not None:
+                found[key] = workday
+            elif not self._data_buffer.is_known_missing(key):
+                unknown.append(key)
+        if unknown:
+            for row in self._db_if.find_many_in_db(table=Worktime, keys=unknown):
+                workday = row.as_workday()
+                self._data_buffer.put(workday)
+                found[workday.as_db()["date"]] = workday
+        return found
 
-    def delete_db_rows(self, table_ids: List[str]) -> None:
-        dates = [dt.datetime.strptime(item, DATE_STRING_MASK) for item in table_ids]
+    def _write_workdays(self, new_workdays: List[WorkDay], force_update: bool) -> List[WorkDay]:
+        """Combines new WorkDays with the stored ones, or replaces them if 'force_update' is set, in a single
+        transaction against the rows as stored, so changes of other processes are kept. Returns the changed
+        WorkDays as stored now, none if nothing changed"""
+        row_dicts = [workday.as_db() for workday in new_workdays]
+        written = self._db_if.upsert(row_dicts, table=Worktime, replace=force_update)
+        stored = [WorkDay.from_db(**row_dict) for row_dict in written.values()]
+        if stored:
+            self._workday_index = None
+        for workday in stored:
+            self._data_buffer.put(workday)
+        return stored
+
+    def _write_input_values(self, values: Sequence[str], force_update: bool) -> bool:
+        """Writes the input values in one transaction, several values of one day are combined first,
+        or the last one wins if 'force_update' is set. Returns whether anything has been written"""
+        skip_weekends = bool(self._app_config.get("skip_weekends", 0))
+        new_workdays: Dict[dt.date, WorkDay] = {}
+        for value in values:
+            try:
+                parsed = WorkDay.from_values_many(value, skip_weekends=skip_weekends)
+            except Exception:
+                _log.exception(f"Failed to recognize input values: '{value}'")
+                continue
+            for workday in parsed:
+                known = new_workdays.get(workday.date)
+                new_workdays[workday.date] = workday if known is None or force_update else known + workday
+        try:
+            written = self._write_workdays(list(new_workdays.values()), force_update)
+        except Exception:
+            _log.exception("Failed to add values to database")
+            return False
+        if written:
+            self._item_to_focus = utils.date_to_str(written[-1].date, DATE_STRING_MASK)
+            _log.debug(f"{len(written)} days have been written to database")
+        return bool(written)
+
+    def _delete_rows(self, dates: Sequence[dt.date]) -> bool:
         row_ids = [str(d.toordinal()) for d in dates]
-        self._db_if.delete(row_ids, table=Worktime)
-        self.fill_ui_with_workdays(limit=10)
+        try:
+            self._db_if.delete(row_ids, table=Worktime)
+        except Exception:
+            _log.exception("Failed to delete database rows")
+            return False
+        self._workday_index = None
+        for row_id in row_ids:
+            self._data_buffer.remove(row_id)
         _log.debug(f"Db rows deleted successfully: {row_ids}")
+        return True
 
-    @staticmethod
-    def validate_input(full_value: str, current: str, d_status: str, ind: str) -> bool:
-        if not full_value or d_status == "0":
-            return True
-        date_mask = r"\d,\d,.,\d,\d,.,\d,\d,\d,\d"
-        masks = [
-            rf"{date_mask}, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d, ,\d,\d,:,\d,\d",
-            rf"{date_mask}, ,v,a,c,a,t,i,o,n",
-            rf"{date_mask}, ,o,f,f",
-            rf"{date_mask}, ,d,a,y, ,o,f,f",
-            rf"{date_mask}, ,s,i,c,k",
-            rf"{date_mask}, ,h,o,l,i,d,a,y",
-        ]
-        for mask in masks:
-            pattern = "".join(mask.split(",")[: int(ind) + 1])
-            if re.match(rf"{pattern}$", full_value[: int(ind) + 1]):
-                return True
-        _log.warning(f'Wrong input value: "{current}" in "{full_value}"')
-        return False
+    def _delete_range(self, command: DeleteRange) -> bool:
+        day_types = [day_type.value for day_type in command.day_types] if command.day_types is not None else None
+        try:
+            row_ids = self._db_if.delete_where(
+                table=Worktime,
+                start=str(command.start.toordinal()),
+                end=str(command.end.toordinal()),
+                day_types=day_types,
+            )
+        except Exception:
+            _log.exception("Failed to delete database rows")
+            return False
+        if not row_ids:
+            _log.warning(f"Nothing to delete from {command.start} to {command.end}")
+            return False
+        self._workday_index = None
+        for row_id in row_ids:
+            self._data_buffer.remove(row_id)
+        return True
+
+    def _replay_journal(self, redo: bool) -> bool:
+        action = "redo" if redo else "undo"
+        try:
+            keys = self._db_if.redo(table=Worktime) if redo else self._db_if.undo(table=Worktime)
+        except Exception:
+            _log.exception(f"Failed to {action} the change")
+            return False
+        if keys is None:
+            _log.warning(f"Nothing to {action}")
+            return False
+        self._workday_index = None
+        for key in keys:
+            self._data_buffer.invalidate(key)
+        self._item_to_focus = utils.date_to_str(keys[0], DATE_STRING_MASK)
+        _log.info(f"Change {action} done for: {', '.join(utils.date_to_str(key, DATE_STRING_MASK) for key in keys)}")
+        return True
+
+    def _punch(self, moment: dt.datetime) -> bool:
+        """Appends the minute of 'moment' to its day with one statement: no input to parse and no lookup first"""
+        try:
+            row_dict = self._db_if.punch(
+                str(moment.date().toordinal()), moment.strftime(TIME_STRING_MASK), table=Worktime
+            )
+        except Exception:
+            _log.exception("Failed to punch the time")
+            return False
+        workday = WorkDay.from_db(**row_dict)
+        self._workday_index = None
+        self._data_buffer.put(workday)
+        self._item_to_focus = utils.date_to_str(workday.date, DATE_STRING_MASK)
+        _log.info(f"Punched {moment.strftime(TIME_STRING_MASK)}: {workday}")
+        return True
+
+    def _refresh_weeks(self, days: Sequence[dt.date]) -> None:
+        """Re-renders the weeks of 'days' in place, the rest of the table stays as it is"""
+        mondays = {day.toordinal() - day.weekday() for day in days}
+        keys = [str(monday + offset) for monday in sorted(mondays) for offset in range(7)]
+        try:
+            workdays = sorted(self._find_workdays(keys).values())
+            self._ui.update_main_table_weeks(self._group_by_weeks(workdays), focus_item=self._item_to_focus)
+        except Exception:
+            _log.exception("Failed to refresh main table")
+
+    def handle_commands(self, commands: Sequence[Command]) -> None:
+        """Runs a burst of UI commands, expected coalesced, and refreshes the table once at the end"""
+        self._forget_external_changes()
+        refresh: Optional[Callable[[], None]] = None
+        load_older = False
+        show_newest = functools.partial(self.fill_ui_with_workdays, limit=10)
+        punched: List[dt.date] = []
+        for command in commands:
+            if isinstance(command, (AddMarks, EditRow)):
+                if self._write_input_values(command.values, force_update=isinstance(command, EditRow)):
+                    refresh, load_older = show_newest, False
+                self._ui.insert_default_value()
+            elif isinstance(command, DeleteRows):
+                if self._delete_rows(command.dates):
+                    refresh, load_older = show_newest, False
+            elif isinstance(command, DeleteRange):
+                if self._delete_range(command):
+                    refresh, load_older = show_newest, False
+            elif isinstance(command, ReplayJournal):
+                if self._replay_journal(command.redo):
+                    refresh, load_older = show_newest, False
+            elif isinstance(command, LoadAll):
+                refresh, load_older = self.load_all_workdays, False
+            elif isinstance(command, ApplyFilter):
+                refresh, load_older = functools.partial(self.filter_ui_workdays, command.query), False
+            elif isinstance(command, LoadOlder):
+                load_older = True
+            elif isinstance(command, Punch):
+                if self._punch(command.moment):
+                    punched.append(command.moment.date())
+                    # a refresh already due shows the punched day too, a filter is run again to keep out the days
+                    # of the week it doesn't match
+                    if refresh is None and self._shown_query is not None:
+                        refresh = functools.partial(self.filter_ui_workdays, self._shown_query)
+                    elif refresh is None:
+                        refresh = functools.partial(self._refresh_weeks, punched)
+            else:
+                raise AssertionError(f"Command is not implemented: {command}")
+        if refresh is not None:
+            refresh()
+        if load_older:
+            self.load_older_workdays()
+
+    def add_to_db(self, table_value: str, force_update: bool = False) -> None:
+        """Writes the input of one or, for a date range or list, many days and refreshes the table once"""
+        self.handle_commands([EditRow((table_value,)) if force_update else AddMarks((table_value,))])
+
+    def delete_db_rows(self, dates: Sequence[dt.date]) -> None:
+        self.handle_commands([DeleteRows(tuple(dates))])
+
+    def punch(self, moment: Optional[dt.datetime] = None) -> None:
+        """Appends the current minute, or the one of 'moment', to its day and refreshes only that week"""
+        moment = moment or dt.datetime.now()
+        self.handle_commands([Punch(moment.replace(second=0, microsecond=0))])
+
+    def replay_journal(self, redo: bool = False) -> None:
+        """Undoes the last change, or redoes the last undone one, and refreshes the table"""
+        self.handle_commands([ReplayJournal(redo)])
+
+    def validate_input(self, full_value: str, current: str, d_status: str, ind: str) -> bool:
+        return self._input_validator.validate(full_value, current, d_status, ind)
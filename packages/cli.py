@@ -0,0 +1,241 @@
+import argparse
+import datetime as dt
+import itertools
+import json
+import logging
+import sys
+from contextlib import contextmanager
+from typing import Dict, Generator, List, Optional
+
+from sqlalchemy import Engine
+
+from packages.constants import (
+    DATE_STRING_MASK, DEFAULT_DB_PATH, DEFAULT_LOG_STORE_PATH, DEFAULT_USER_ID, STORAGE_BACKENDS, TIME_STRING_MASK
+)
+from packages import statistics
+from packages.db import export, importer, rollup, sync, verify
+from packages.db.database_interface import DbInterface, WorktimeSqliteDbInterface
+from packages.db.log_store import LogStore, WorktimeLogDbInterface
+from packages.db.models import Worktime, create_sqlite_engine, sqlite_engine
+from packages.workday_index import DAY_TYPE_WORDS
+
+_log = logging.getLogger("cli")
+
+
+def _engine(db_path: Optional[str]) -> Engine:
+    return create_sqlite_engine(db_path) if db_path else sqlite_engine
+
+
+@contextmanager
+def _open_db(args: argparse.Namespace) -> Generator[DbInterface, None, None]:
+    """Interface of the storage backend the app uses, a log store is closed again when the command is done"""
+    if args.storage == "sqlite":
+        yield WorktimeSqliteDbInterface(_engine(args.db), user_id=args.user)
+        return
+    store = LogStore(args.db or DEFAULT_LOG_STORE_PATH)
+    try:
+        yield WorktimeLogDbInterface(store, user_id=args.user)
+    finally:
+        store.close()
+
+
+def _sqlite_only(args: argparse.Namespace) -> bool:
+    if args.storage == "sqlite":
+        return True
+    print(f"{args.command}: works on sqlite databases only, the storage is '{args.storage}'", file=sys.stderr)
+    return False
+
+
+def _export(args: argparse.Namespace) -> int:
+    export_format = export.ExportFormat(args.format)
+    options = dict(derived=args.derived, all_users=args.all_users)
+    with _open_db(args) as db_if:
+        if args.output == "-":
+            count = export.export_worktime(db_if, sys.stdout.buffer, export_format, **options)
+        else:
+            with open(args.output, "wb") as f:
+                count = export.export_worktime(db_if, f, export_format, **options)
+    _log.info(f"{count} rows exported to '{args.output}'")
+    return 0
+
+
+def _import(args: argparse.Namespace) -> int:
+    with _open_db(args) as db_if, open(args.input, "r", encoding="utf-8", newline="") as f:
+        result = importer.import_worktime(
+            db_if,
+            f,
+            export.ExportFormat(args.format),
+            policy=importer.ConflictPolicy(args.policy),
+            keep_users=not args.as_user,
+            workers=args.workers,
+        )
+    _log.info(f"{result.written} of {result.read} rows imported from '{args.input}'")
+    if result.rejected:
+        print(f"import: {len(result.rejected)} rows rejected, see the log for details", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _sync(args: argparse.Namespace) -> int:
+    if not _sqlite_only(args):
+        return 1
+    local = WorktimeSqliteDbInterface(_engine(args.db), user_id=args.user)
+    remote = WorktimeSqliteDbInterface(_engine(args.other_db), user_id=args.user)
+    result = sync.sync_databases(local, remote)
+    print(f"sent: {result.sent}, received: {result.received}, conflicts: {result.conflicts}")
+    return 0
+
+
+def _ordinal_key(value: Optional[str]) -> Optional[str]:
+    return str(dt.datetime.strptime(value, DATE_STRING_MASK).date().toordinal()) if value is not None else None
+
+
+def _purge(args: argparse.Namespace) -> int:
+    if args.start is None and args.end is None and args.day_type is None and not args.everything:
+        print("purge: give '--from', '--to' or '--day-type', or '--everything' to delete all rows", file=sys.stderr)
+        return 1
+    day_types = [DAY_TYPE_WORDS[word].value for word in args.day_type] if args.day_type is not None else None
+    with _open_db(args) as db_if:
+        keys = db_if.delete_where(
+            table=Worktime, start=_ordinal_key(args.start), end=_ordinal_key(args.end), day_types=day_types
+        )
+    print(f"deleted: {len(keys)}")
+    return 0
+
+
+def _punch(args: argparse.Namespace) -> int:
+    now = dt.datetime.now()
+    with _open_db(args) as db_if:
+        row_dict = db_if.punch(str(now.date().toordinal()), now.strftime(TIME_STRING_MASK), table=Worktime)
+    print(f"{now.strftime(DATE_STRING_MASK)} {row_dict['times']} {row_dict['day_type']}".rstrip())
+    return 0
+
+
+STATS_QUANTILES = (0.5, 0.9)
+
+
+def _print_stats(period: str, digests: Dict[str, statistics.TDigest]) -> None:
+    columns = [str(len(digests["arrival"]))]
+    for metric in statistics.TIME_METRICS:
+        columns.extend(statistics.format_minutes(digests[metric].quantile(q)) for q in STATS_QUANTILES)
+    print(f"{period:<10}" + "".join(f"{column:>10}" for column in columns))
+
+
+def _stats(args: argparse.Namespace) -> int:
+    start = statistics.month_index(dt.date(args.year, 1, 1)) if args.year is not None else None
+    end = statistics.month_index(dt.date(args.year, 12, 1)) if args.year is not None else None
+    with _open_db(args) as db_if:
+        months = db_if.month_stats(start=start, end=end, all_users=args.all_users)
+    header = ["days"] + [f"{metric} p{int(q * 100)}" for metric in statistics.TIME_METRICS for q in STATS_QUANTILES]
+    print(f"{'month':<10}" + "".join(f"{column:>10}" for column in header))
+    for month, digests in months.items():
+        first, _ = statistics.month_bounds(month)
+        _print_stats(first.strftime("%m.%Y"), digests)
+    for year, year_months in itertools.groupby(months.items(), key=lambda item: item[0] // 12):
+        _print_stats(str(year), statistics.merge_digests(digests for _, digests in year_months))
+    return 0
+
+
+def _verify(args: argparse.Namespace) -> int:
+    if not args.databases and not _sqlite_only(args):
+        return 1
+    report = verify.verify_databases(args.databases or [args.db or DEFAULT_DB_PATH], workers=args.workers)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report["issues"] else 0
+
+
+def _rollup(args: argparse.Namespace) -> int:
+    report = rollup.rollup_directory(args.directory, pattern=args.pattern, workers=args.workers)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report["errors"] else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="timely", description="Log your daily working time")
+    parser.add_argument(
+        "--db", help="path to a worktime database or log store directory, the default one is used if omitted"
+    )
+    parser.add_argument(
+        "--storage", choices=STORAGE_BACKENDS, default=STORAGE_BACKENDS[0], help="storage backend of '--db'"
+    )
+    parser.add_argument("--user", default=DEFAULT_USER_ID, help="id of the user the command works for")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="stream the worktime table to a file")
+    export_parser.add_argument("output", help="output file path, '-' for stdout")
+    export_parser.add_argument(
+        "--format", choices=[item.value for item in export.ExportFormat], default=export.ExportFormat.CSV.value
+    )
+    export_parser.add_argument("--derived", action="store_true", help="add worktime and overtime columns")
+    export_parser.add_argument("--all-users", action="store_true", help="export rows of every user")
+    export_parser.set_defaults(handler=_export)
+
+    import_parser = subparsers.add_parser("import", help="load a CSV or NDJSON export into the database")
+    import_parser.add_argument("input", help="path to an export file")
+    import_parser.add_argument(
+        "--format", choices=[item.value for item in importer.IMPORT_FORMATS], default=export.ExportFormat.CSV.value
+    )
+    import_parser.add_argument(
+        "--policy",
+        choices=[item.value for item in importer.ConflictPolicy],
+        default=importer.ConflictPolicy.MERGE.value,
+        help="combine imported rows with stored ones or replace them",
+    )
+    import_parser.add_argument("--as-user", action="store_true", help="import every row for '--user'")
+    import_parser.add_argument("--workers", type=int, help="parsing processes, CPU count by default")
+    import_parser.set_defaults(handler=_import)
+
+    sync_parser = subparsers.add_parser("sync", help="exchange rows changed since the last sync with another database")
+    sync_parser.add_argument("other_db", help="path to the other worktime database")
+    sync_parser.set_defaults(handler=_sync)
+
+    purge_parser = subparsers.add_parser("purge", help="delete the user's rows by date range and day type")
+    purge_parser.add_argument("--from", dest="start", metavar="DD.MM.YYYY", help="first day to delete")
+    purge_parser.add_argument("--to", dest="end", metavar="DD.MM.YYYY", help="last day to delete")
+    purge_parser.add_argument(
+        "--day-type", action="append", choices=list(DAY_TYPE_WORDS), help="delete only days of this type, repeatable"
+    )
+    purge_parser.add_argument("--everything", action="store_true", help="delete every row of the user")
+    purge_parser.set_defaults(handler=_purge)
+
+    punch_parser = subparsers.add_parser("punch", help="append the current time to today's time marks")
+    punch_parser.set_defaults(handler=_punch)
+
+    stats_parser = subparsers.add_parser("stats", help="median and 90th percentile of arrival, departure and pauses")
+    stats_parser.add_argument("--year", type=int, help="only months of this year")
+    stats_parser.add_argument("--all-users", action="store_true", help="merge the statistics of every user")
+    stats_parser.set_defaults(handler=_stats)
+
+    verify_parser = subparsers.add_parser("verify", help="check every stored row, print a json report")
+    verify_parser.add_argument("databases", nargs="*", help="database paths, '--db' or the default one if omitted")
+    verify_parser.add_argument("--workers", type=int, help="scanning processes, CPU count by default")
+    verify_parser.set_defaults(handler=_verify)
+
+    rollup_parser = subparsers.add_parser(
+        "rollup", help="week and month totals of every database in a directory, in minutes, as a json team report"
+    )
+    rollup_parser.add_argument("directory", help="directory searched for databases, subdirectories included")
+    rollup_parser.add_argument("--pattern", default=rollup.DATABASE_PATTERN, help="file name pattern of databases")
+    rollup_parser.add_argument("--workers", type=int, help="reading processes, CPU count by default")
+    rollup_parser.set_defaults(handler=_rollup)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None, *, storage: Optional[str] = None) -> int:
+    """Runs a command, on the 'storage' backend the app is configured with unless '--storage' is given"""
+    parser = build_parser()
+    if storage is not None:
+        parser.set_defaults(storage=storage)
+    args = parser.parse_args(argv)
+    try:
+        return int(args.handler(args))
+    except Exception as e:
+        _log.exception(f"'{args.command}' command failed")
+        print(f"{args.command}: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,116 @@
+import datetime as dt
+import logging
+from typing import Iterable, List, Optional, Tuple, Union
+
+from dataclasses import dataclass
+
+from packages.constants import DayType
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AddMarks:
+    """Input values to combine with the stored days"""
+
+    values: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class EditRow:
+    """Input values replacing the stored days"""
+
+    values: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class DeleteRows:
+    dates: Tuple[dt.date, ...]
+
+
+@dataclass(frozen=True)
+class DeleteRange:
+    """Every stored day in [start, end], only of 'day_types' if given"""
+
+    start: dt.date
+    end: dt.date
+    day_types: Optional[Tuple[DayType, ...]] = None
+
+
+@dataclass(frozen=True)
+class LoadAll:
+    pass
+
+
+@dataclass(frozen=True)
+class LoadOlder:
+    pass
+
+
+@dataclass(frozen=True)
+class ReplayJournal:
+    redo: bool = False
+
+
+@dataclass(frozen=True)
+class ApplyFilter:
+    query: str
+
+
+@dataclass(frozen=True)
+class Punch:
+    """The minute of 'moment' appended to the time marks of its day, 'moment' has no seconds"""
+
+    moment: dt.datetime
+
+
+Command = Union[AddMarks, EditRow, DeleteRows, DeleteRange, LoadAll, LoadOlder, ReplayJournal, ApplyFilter, Punch]
+
+
+def coalesce(commands: Iterable[Command]) -> List[Command]:
+    """Merges runs of commands of one kind, so a burst costs one database round trip per run. The order of the
+    runs is kept, undo and redo are never merged"""
+    result: List[Command] = []
+    for command in commands:
+        last = result[-1] if result else None
+        if isinstance(command, AddMarks) and isinstance(last, AddMarks):
+            # values are combined in order, only a value submitted again right after itself changes nothing
+            values = list(last.values)
+            for value in command.values:
+                if value != values[-1]:
+                    values.append(value)
+            result[-1] = AddMarks(tuple(values))
+        elif isinstance(command, EditRow) and isinstance(last, EditRow):
+            result[-1] = EditRow(last.values + command.values)
+        elif isinstance(command, DeleteRows) and isinstance(last, DeleteRows):
+            result[-1] = DeleteRows(last.dates + tuple(date for date in command.dates if date not in last.dates))
+        elif isinstance(command, (LoadAll, LoadOlder)) and type(command) is type(last):
+            continue
+        elif isinstance(command, Punch) and isinstance(last, Punch) and command.moment == last.moment:
+            # a repeated key press within the minute changes nothing
+            continue
+        elif isinstance(command, ApplyFilter) and isinstance(last, ApplyFilter):
+            result[-1] = command
+        else:
+            result.append(command)
+    return result
+
+
+class CommandQueue:
+    """Commands from the UI waiting for App, handed over coalesced"""
+
+    def __init__(self) -> None:
+        self._commands: List[Command] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def put(self, command: Command) -> None:
+        self._commands.append(command)
+
+    def drain(self) -> List[Command]:
+        commands, self._commands = self._commands, []
+        coalesced = coalesce(commands)
+        if len(coalesced) < len(commands):
+            _log.debug(f"{len(commands)} commands have been coalesced into {len(coalesced)}")
+        return coalesced
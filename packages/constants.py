@@ -3,6 +3,7 @@ import logging
 import re
 import sys
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Union, Tuple
 
@@ -19,8 +20,12 @@ assert MAIN_FILE_PATH is not None
 MAIN_DIR = Path(MAIN_FILE_PATH).parent
 
 DEFAULT_DB_PATH = f"{MAIN_DIR}/worktime.db"
+DEFAULT_LOG_STORE_PATH = f"{MAIN_DIR}/worktime_store"
+# "sqlite" for the database file, "log" for the append-only log store
+STORAGE_BACKENDS = ("sqlite", "log")
 CONFIG_FILE_PATH = f"{MAIN_DIR}/config.json"
 LOG_FILE_PATH = f"{MAIN_DIR}/worktime.log"
+DEFAULT_USER_ID = "default"
 DEFAULT_WORKDAY_TIMEDELTA = dt.timedelta(hours=8)
 ANY_DATE = dt.date(2023, 1, 1)
 DATE_STRING_MASK = "%d.%m.%Y"
@@ -28,6 +33,10 @@ TIME_STRING_MASK = "%H:%M"
 DATE_PATTERN = r"\d\d.\d\d.\d\d\d\d"
 ORDINAL_DATE_PATTERN = r"\d{6}"
 TIME_PATTERN = r"\d\d:\d\d"
+# one date, a "first-last" range or a comma separated list of both, e.g. "01.07.2023-14.07.2023,17.07.2023"
+_ANY_DATE_PATTERN = f"(?:{DATE_PATTERN}|{ORDINAL_DATE_PATTERN})"
+DATE_SPEC_PATTERN = rf"^({_ANY_DATE_PATTERN}(?:[-,]{_ANY_DATE_PATTERN})*)(?=\s|$)"
+MAX_DATE_RANGE_DAYS = 366
 NORMAL_WORKDAY_TIMES = [
     dt.datetime.strptime("08:00", TIME_STRING_MASK).time(),
     dt.datetime.strptime("16:00", TIME_STRING_MASK).time(),
@@ -57,6 +66,21 @@ DAY_TYPE_PARAMS = [
 ]
 
 
+@lru_cache(maxsize=4096)
+def _format_time_mark(time_mark: dt.time) -> str:
+    return time_mark.strftime(TIME_STRING_MASK)
+
+
+@lru_cache(maxsize=4096)
+def _format_month(year: int, month: int) -> str:
+    return dt.date(year, month, 1).strftime("%B %Y")
+
+
+@lru_cache(maxsize=4096)
+def _format_timedelta(value: dt.timedelta) -> str:
+    return str(value)
+
+
 # TODO: Learn if class values checking after __init__ is needed
 @dataclass
 class WorkDay:
@@ -78,7 +102,8 @@ class WorkDay:
 
     @classmethod
     def _find_date(cls, input_string: str) -> dt.date:
-        date_values = re.findall(pattern=f"^({DATE_PATTERN}|{ORDINAL_DATE_PATTERN})", string=input_string)
+        # a range or a list of dates is not a single date mark, see from_values_many
+        date_values = re.findall(pattern=rf"^({DATE_PATTERN}|{ORDINAL_DATE_PATTERN})(?=\s|$)", string=input_string)
         if len(date_values) != 1:
             raise ValueError(f"Input string must contain one date mark only: '{input_string}'")
         return cls._recognize_date(value=date_values[0], mask=DATE_STRING_MASK)
@@ -106,6 +131,12 @@ class WorkDay:
             raise AssertionError(f'Day type params not found for "{day_type_values[0]}"')
         raise ValueError(f"Input string must contain one day type only: {day_type_values}")
 
+    @classmethod
+    def from_db(cls, date: str, times: str, day_type: str) -> "WorkDay":
+        """Fast path for rows already validated on write: no regex matching, no consistency checks"""
+        time_marks = [dt.time(int(mark[:2]), int(mark[3:5])) for mark in times.split()]
+        return WorkDay(dt.date.fromordinal(int(date)), time_marks, DayType(day_type or ""))
+
     @classmethod
     def from_values(cls, input_values: Union[List[str], str]) -> "WorkDay":
         string_value = input_values if isinstance(input_values, str) else " ".join(input_values)
@@ -136,6 +167,41 @@ class WorkDay:
                 f"Input must include at least one date and either time mark or day type or both: '{string_value}'"
             )
 
+    @classmethod
+    def _expand_date_spec(cls, date_spec: str, skip_weekends: bool) -> List[dt.date]:
+        dates: Dict[dt.date, None] = {}
+        for item in date_spec.split(","):
+            first, _, last = item.partition("-")
+            first_date = cls._recognize_date(value=first, mask=DATE_STRING_MASK)
+            if not last:
+                # an explicitly listed date is never skipped
+                dates[first_date] = None
+                continue
+            last_date = cls._recognize_date(value=last, mask=DATE_STRING_MASK)
+            days = (last_date - first_date).days + 1
+            if not 0 < days <= MAX_DATE_RANGE_DAYS:
+                raise ValueError(f"Date range must be ascending and at most {MAX_DATE_RANGE_DAYS} days long: '{item}'")
+            for offset in range(days):
+                date_instance = first_date + dt.timedelta(days=offset)
+                if not (skip_weekends and date_instance.weekday() >= 5):
+                    dates[date_instance] = None
+        return list(dates)
+
+    @classmethod
+    def from_values_many(cls, input_values: Union[List[str], str], skip_weekends: bool = False) -> List["WorkDay"]:
+        """Like from_values, but the date mark may be a range "first-last" or a comma separated list of dates"""
+        string_value = input_values if isinstance(input_values, str) else " ".join(input_values)
+        date_specs = re.findall(pattern=DATE_SPEC_PATTERN, string=string_value)
+        if len(date_specs) != 1:
+            raise ValueError(f"Input string must start with a date, a date range or a list of dates: '{string_value}'")
+        rest = string_value[len(date_specs[0]):]
+        dates = cls._expand_date_spec(date_specs[0], skip_weekends)
+        if not dates:
+            return []
+        # the rest of the input is the same for every day, so it is validated once and copied
+        template = cls.from_values(f"{dates[0].strftime(DATE_STRING_MASK)}{rest}")
+        return [WorkDay(date_instance, list(template.times), template.day_type) for date_instance in dates]
+
     def __add__(self, other: "WorkDay") -> "WorkDay":
         assert (
                 self.date == other.date
@@ -178,30 +244,41 @@ class WorkDay:
             raise RuntimeError(f"Unspecified scenario between WorkDays: \n\t{self}\n\t{other}")
         return WorkDay(self.date, times, day_type)
 
-    @property
-    def color(self) -> str:
-        if any([self.worktime < DEFAULT_WORKDAY_TIMEDELTA, self.whole_time == dt.timedelta(seconds=0)]):
+    @staticmethod
+    def _color(whole_time: dt.timedelta, worktime: dt.timedelta, overtime: dt.timedelta) -> str:
+        if any([worktime < DEFAULT_WORKDAY_TIMEDELTA, whole_time == dt.timedelta(seconds=0)]):
             return "red"
-        elif self.overtime > dt.timedelta(0):
+        elif overtime > dt.timedelta(0):
             return "green"
         return "default"
 
+    @property
+    def color(self) -> str:
+        whole_time, _, worktime, overtime = self._time_totals()
+        return self._color(whole_time, worktime, overtime)
+
     def as_dict(self) -> Dict[str, str]:
+        """Formatted table row. Rows are cached by the day's content, a refresh formats changed days only"""
+        return dict(_row_dict(self.date, tuple(self.times), self.day_type))
+
+    def _format_row(self) -> Dict[str, str]:
+        whole_time, pauses, worktime, overtime = self._time_totals()
+        date_string = self.date.strftime(DATE_STRING_MASK)
         data = dict(
             week=self.week,
-            month=self.date.strftime("%B %Y"),
-            date=self.date.strftime(DATE_STRING_MASK),
-            weekday=str(self.date.isocalendar()[2]),
-            worktime=str(self.worktime),
-            pauses=str(self.pauses),
-            overtime=str(self.overtime),
-            whole_time=str(self.whole_time),
-            time_marks=" ".join([time_mark.strftime(TIME_STRING_MASK) for time_mark in self.times]),
-            color=self.color,
+            month=_format_month(self.date.year, self.date.month),
+            date=date_string,
+            weekday=str(self.date.isoweekday()),
+            worktime=_format_timedelta(worktime),
+            pauses=_format_timedelta(pauses),
+            overtime=_format_timedelta(overtime),
+            whole_time=_format_timedelta(whole_time),
+            time_marks=" ".join([_format_time_mark(time_mark) for time_mark in self.times]),
+            color=self._color(whole_time, worktime, overtime),
             day_type=self.day_type.value,
-            iid=self.date.strftime(DATE_STRING_MASK),
+            iid=date_string,
         )
-        if self.worktime + self.pauses + self.overtime != self.whole_time:
+        if worktime + pauses + overtime != whole_time:
             _log.critical(f"Sum (worktime + pauses + overtime) != whole time")
         return data
 
@@ -228,43 +305,57 @@ class WorkDay:
     def __lt__(self, other: "WorkDay") -> bool:
         return self.date < other.date
 
+    def _time_totals(self) -> Tuple[dt.timedelta, dt.timedelta, dt.timedelta, dt.timedelta]:
+        """Whole time, pauses, worktime and overtime computed in one pass over the time marks"""
+        if len(self.times) < 2:
+            zero = dt.timedelta(0)
+            return zero, zero, zero, zero
+        seconds = [mark.hour * 3600 + mark.minute * 60 + mark.second for mark in self.times]
+        whole_time = dt.timedelta(seconds=seconds[-1] - seconds[0])
+        pauses = dt.timedelta(seconds=sum(seconds[i + 1] - seconds[i] for i in range(1, len(seconds) - 1, 2)))
+        worktime = whole_time - pauses
+        if worktime > DEFAULT_WORKDAY_TIMEDELTA:
+            return whole_time, pauses, DEFAULT_WORKDAY_TIMEDELTA, worktime - DEFAULT_WORKDAY_TIMEDELTA
+        return whole_time, pauses, worktime, dt.timedelta(seconds=0)
+
+    def durations(self) -> Dict[str, dt.timedelta]:
+        whole_time, pauses, worktime, overtime = self._time_totals()
+        return dict(worktime=worktime, pauses=pauses, overtime=overtime, whole_time=whole_time)
+
     @property
     def whole_time(self) -> dt.timedelta:
-        if len(self.times) < 2:
-            return dt.timedelta(0)
-        diff = dt.datetime.combine(ANY_DATE, self.times[-1]) - dt.datetime.combine(ANY_DATE, self.times[0])
-        return diff
+        return self._time_totals()[0]
 
     @property
     def pauses(self) -> dt.timedelta:
-        if len(self.times) < 2:
-            return dt.timedelta(0)
-        pauses = dt.timedelta(seconds=0)
-        for i in range(1, len(self.times) - 1, 2):
-            pause = dt.datetime.combine(ANY_DATE, self.times[i + 1]) - dt.datetime.combine(ANY_DATE, self.times[i])
-            pauses += pause
-        return pauses
+        return self._time_totals()[1]
 
     @property
     def worktime(self) -> dt.timedelta:
-        if len(self.times) < 2:
-            return dt.timedelta(0)
-        worktime = self.whole_time - self.pauses
-        return worktime if worktime <= DEFAULT_WORKDAY_TIMEDELTA else DEFAULT_WORKDAY_TIMEDELTA
+        return self._time_totals()[2]
 
     @property
     def overtime(self) -> dt.timedelta:
-        if len(self.times) < 2:
-            return dt.timedelta(0)
-        worktime = self.whole_time - self.pauses
-        if worktime > DEFAULT_WORKDAY_TIMEDELTA:
-            return worktime - DEFAULT_WORKDAY_TIMEDELTA
-        else:
-            return dt.timedelta(seconds=0)
+        return self._time_totals()[3]
 
     @property
     def week(self) -> str:
-        return "week " + str(self.date.isocalendar()[1]) + " " + self.date.strftime("%Y")
+        return f"week {self.date.isocalendar()[1]} {self.date.year}"
+
+
+# formatted rows of about 40 years of days
+ROW_DICT_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=ROW_DICT_CACHE_SIZE)
+def _row_dict(date: dt.date, times: Tuple[dt.time, ...], day_type: DayType) -> Dict[str, str]:
+    return WorkDay(date, list(times), day_type)._format_row()
+
+
+@lru_cache(maxsize=ROW_DICT_CACHE_SIZE)
+def stored_time_totals(times: str) -> Tuple[dt.timedelta, dt.timedelta, dt.timedelta, dt.timedelta]:
+    """Whole time, pauses, worktime and overtime of time marks as the database stores them"""
+    return WorkDay.from_db(str(dt.date.min.toordinal()), times, "")._time_totals()
 
 
 @dataclass(frozen=True)
@@ -283,8 +374,12 @@ class WorkWeek:
         week = self.workdays[0].week
         week_summary: Dict[str, str] = dict(week=week, iid=f"summary_{week}")
 
+        workdays_durations = [workday.durations() for workday in self.workdays]
         for summary_field in self.summary_fields:
-            field_values = [getattr(workday, summary_field) for workday in self.workdays]
+            field_values = [
+                durations[summary_field] if summary_field in durations else getattr(workday, summary_field)
+                for workday, durations in zip(self.workdays, workdays_durations)
+            ]
             field_sum = sum(field_values, start=dt.timedelta(0))
             hours, remainder = divmod(int(field_sum.total_seconds()), 3600)
             minutes, seconds = divmod(remainder, 60)
@@ -1,16 +1,47 @@
+import datetime as dt
+import json
 import logging
+import os
+import sqlite3
+import uuid
+import weakref
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Protocol, List, Callable, Type, Optional, ContextManager, Generator
+from functools import lru_cache, partial
+from typing import (
+    Protocol, List, Dict, Sequence, Tuple, Callable, Type, Optional, ContextManager, Generator, Hashable, Iterator,
+    TypeVar, cast,
+)
 
-from sqlalchemy import update, orm, Engine
+from sqlalchemy import (
+    Column, Connection, Table, and_, bindparam, case, delete, event, func, insert, or_, update, select, orm, Engine,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 import packages.db.models as m
 from packages import constants as c
+from packages import statistics
+from packages.utils.utils import chunked
 
 _log = logging.getLogger(__name__)
 # TODO: Create aliases for complex types
 
+# bound parameters per statement, the lowest SQLITE_MAX_VARIABLE_NUMBER default
+SQLITE_MAX_VARIABLES = 999
+# RETURNING came with SQLite 3.35, builds of older Pythons may ship an older library
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# undo depth per user, older journal transactions are dropped on compaction
+JOURNAL_KEEP_TXNS = 200
+JOURNAL_COMPACT_EVERY = 50
+# version a punch gives a row it adds, the journal stamps a real one in the same transaction. Tells an added row
+# from an updated one, as RETURNING gives values after the change only
+PUNCHED_ROW_VERSION = -1
+# read results kept per engine
+QUERY_CACHE_SIZE = 256
+
+T = TypeVar("T")
+
 
 class DbError(Exception):
     pass
@@ -48,79 +79,904 @@ def session_scope(engine: Engine) -> Generator[Session, None, None]:
 
 
 class DbInterface(Protocol):
-    def read(self, *, table: Type[m.Base], limit: Optional[int] = None) -> List[m.Base]:
+    """Worktime storage as the app, import and export use it, scoped to one user. Change sync needs the sqlite
+    backend"""
+
+    @property
+    def user_id(self) -> str:
+        pass
+
+    def read(self, *, table: Type[m.Worktime], limit: Optional[int] = None) -> List[m.Worktime]:
+        pass
+
+    def read_page(self, *, table: Type[m.Worktime], before: Optional[str] = None, limit: int) -> List[m.Worktime]:
+        pass
+
+    def find_in_db(self, *, table: Type[m.Worktime], key: str) -> Optional[List[m.Worktime]]:
+        pass
+
+    def find_many_in_db(self, *, table: Type[m.Worktime], keys: List[str]) -> List[m.Worktime]:
+        pass
+
+    def existing_keys(self, keys: List[str], *, table: Type[m.Worktime]) -> List[str]:
+        pass
+
+    def add(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        pass
+
+    def update(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        pass
+
+    def delete(self, row_ids: List[str], *, table: Type[m.Worktime]) -> None:
+        pass
+
+    def delete_where(
+            self,
+            *,
+            table: Type[m.Worktime],
+            start: Optional[str] = None,
+            end: Optional[str] = None,
+            day_types: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        pass
+
+    def write_to_db(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        pass
+
+    def upsert(
+            self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime], replace: bool = False
+    ) -> Dict[str, c.RowDictData]:
+        pass
+
+    def punch(self, key: str, mark: str, *, table: Type[m.Worktime]) -> c.RowDictData:
+        pass
+
+    def undo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        pass
+
+    def redo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        pass
+
+    def for_user(self, user_id: str) -> "DbInterface":
+        pass
+
+    def external_changes(self) -> int:
+        pass
+
+    def iter_rows(
+            self, *, table: Type[m.Worktime], all_users: bool = False, batch_size: int = 1000, descending: bool = False
+    ) -> Iterator[List["WorktimeRow"]]:
         pass
 
-    def add(self, row_dicts: List[c.RowDictData], *, table: Type[m.Base]) -> None:
+    def users(self, *, table: Type[m.Worktime]) -> List[str]:
         pass
 
-    def update(self, row_dicts: List[c.RowDictData], *, table: Type[m.Base]) -> None:
+    def team_totals(
+            self, *, table: Type[m.Worktime], start: Optional[str] = None, end: Optional[str] = None
+    ) -> "TeamTotals":
         pass
 
-    def delete(self, row_ids: List[str], *, table: Type[m.Base]) -> None:
+    def month_stats(
+            self, *, start: Optional[int] = None, end: Optional[int] = None, all_users: bool = False
+    ) -> Dict[int, Dict[str, statistics.TDigest]]:
         pass
 
 
+TeamTotals = Dict[str, Dict[str, dt.timedelta]]
+# (user_id, date, times, day_type) as stored in the worktime table
+WorktimeRow = Tuple[str, str, str, str]
+# (key, values before, values after) of one row, None stands for a missing row
+JournalChange = Tuple[str, Optional[c.RowDictData], Optional[c.RowDictData]]
+# values of a changed row, None for a deleted one
+SyncRow = Optional[c.RowDictData]
+
+
+def combine_rows(row_dicts: List[c.RowDictData], *, replace: bool) -> Dict[str, c.RowDictData]:
+    """Rows of an upsert by key, rows of one key are combined through 'WorkDay.__add__' unless 'replace' is set"""
+    pending: Dict[str, c.RowDictData] = {}
+    for row_dict in row_dicts:
+        key = row_dict["date"]
+        if key in pending and not replace:
+            row_dict = (c.WorkDay.from_db(**pending[key]) + c.WorkDay.from_db(**row_dict)).as_db()
+        pending[key] = row_dict
+    return pending
+
+
+def merge_stored_rows(
+        pending: Dict[str, c.RowDictData], stored: Dict[str, c.RowDictData], *, replace: bool
+) -> Dict[str, c.RowDictData]:
+    """Rows an upsert has to write: pending rows combined with the stored ones, or replacing them if 'replace'
+    is set. Rows that would not change are left out"""
+    written = dict(pending)
+    for key, stored_row in stored.items():
+        if replace:
+            merged = c.WorkDay.from_db(**pending[key])
+        else:
+            merged = c.WorkDay.from_db(**stored_row) + c.WorkDay.from_db(**pending[key])
+        if merged == c.WorkDay.from_db(**stored_row):
+            del written[key]
+        else:
+            written[key] = merged.as_db()
+    return written
+
+
+class QueryCache:
+    """Read results keyed by the query shape and stamped with the write generation they were read at. Every write
+    through an interface of the engine bumps the generation, so a result is served only until the next write and
+    reads between writes cost no query. Commits of other processes bump it too, from the next
+    'check_external_writes': a connection of the cache's own sees them change 'PRAGMA data_version', and the replica
+    clock tells them from the writes made here"""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, *, engine: Optional[Engine] = None) -> None:
+        self._max_size = max_size
+        self._items: OrderedDict[Hashable, Tuple[int, object]] = OrderedDict()
+        self.generation = 0
+        # bumped only by commits of other processes
+        self.external_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._connect: Optional[Callable[[], sqlite3.Connection]] = None
+        if engine is not None and engine.url.database not in (None, "", ":memory:"):
+            # connect arguments, not the engine, which the cache must not keep alive
+            args, kwargs = engine.dialect.create_connect_args(engine.url)
+            self._connect = partial(sqlite3.connect, *args, **kwargs)
+        self._watch: Optional[sqlite3.Connection] = None
+        self._watch_pid: Optional[int] = None
+        self._data_version: Optional[int] = None
+        self._clock: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def invalidate(self) -> None:
+        self.generation += 1
+
+    def close(self) -> None:
+        """Closes the connection watching the file, the next check opens it again"""
+        if self._watch is not None and self._watch_pid == os.getpid():
+            self._watch.close()
+        self._watch = None
+
+    def _read_clock(self) -> Optional[int]:
+        assert self._watch is not None
+        try:
+            rows = self._watch.execute("SELECT clock FROM replica").fetchall()
+        except sqlite3.Error:
+            return None
+        return int(rows[0][0]) if rows else None
+
+    def check_external_writes(self) -> None:
+        """Bumps the generations if another process has committed since the last check, costs a pragma"""
+        if self._connect is None:
+            return
+        if self._watch is None or self._watch_pid != os.getpid():
+            # a forked process can't share the connection of its parent
+            self._watch, self._watch_pid = self._connect(), os.getpid()
+            self._data_version = int(self._watch.execute("PRAGMA data_version").fetchall()[0][0])
+            self._clock = self._read_clock()
+            return
+        data_version = int(self._watch.execute("PRAGMA data_version").fetchall()[0][0])
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        clock = self._read_clock()
+        if clock != self._clock:
+            self._clock = clock
+            self.generation += 1
+            self.external_generation += 1
+
+    def stamped(self, clock: int) -> None:
+        """Notes the clock value a committed write made here has taken. A previous value other than the last one known
+        means another process has written in between"""
+        if self._watch is None:
+            return
+        if self._clock is None or clock - 1 != self._clock:
+            self.generation += 1
+            self.external_generation += 1
+        self._clock = clock
+
+    def get_or_read(self, key: Hashable, read: Callable[[], T]) -> T:
+        item = self._items.get(key)
+        if item is not None and item[0] == self.generation:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return cast(T, item[1])
+        self.misses += 1
+        generation = self.generation
+        value = read()
+        self._items[key] = (generation, value)
+        self._items.move_to_end(key)
+        if len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+        return value
+
+
+# one cache per engine, so interfaces of every user on it see each other's writes
+_query_caches: "weakref.WeakKeyDictionary[Engine, QueryCache]" = weakref.WeakKeyDictionary()
+
+
+def query_cache(engine: Engine) -> QueryCache:
+    cache = _query_caches.get(engine)
+    if cache is None:
+        cache = _query_caches[engine] = QueryCache(engine=engine)
+        close = cache.close
+        event.listen(engine, "engine_disposed", lambda _: close())
+    return cache
+
+
+class WorktimeStatements:
+    """Core statements of the hot path with bound parameters, built once per table. SQLAlchemy compiles each of them
+    once and finds the compiled form by identity afterwards. Parameter names differ from the column names, as
+    update and insert keep those for their own values"""
+
+    def __init__(self, table: Type[m.Worktime]) -> None:
+        self.key_column: Column[str] = table.__mapper__.primary_key[-1]
+        worktime = cast(Table, table.__table__)
+        key = worktime.c[self.key_column.name]
+        of_user = worktime.c.user_id == bindparam("user")
+        of_keys = key.in_(bindparam("keys", expanding=True))
+
+        rows = select(worktime.c.user_id, key, worktime.c.times, worktime.c.day_type, worktime.c.version)
+        self.find = rows.where(of_user, key == bindparam("key"))
+        self.find_many = rows.where(of_user, of_keys)
+        self.stored_rows = select(key, worktime.c.times, worktime.c.day_type).where(of_user, of_keys)
+        self.month_rows = select(key, worktime.c.times, worktime.c.day_type).where(
+            of_user, key >= bindparam("first"), key <= bindparam("last")
+        )
+        self.update_row = (
+            update(worktime)
+            .where(of_user, key == bindparam("key"))
+            .values(times=bindparam("new_times"), day_type=bindparam("new_day_type"))
+        )
+        self.add_rows = insert(worktime)
+        self.delete_row = delete(worktime).where(of_user, key == bindparam("key"))
+        self.delete_rows = delete(worktime).where(of_user, of_keys)
+        upsert = sqlite_insert(worktime)
+        self.write_rows = upsert.on_conflict_do_update(
+            index_elements=[worktime.c.user_id, key],
+            set_={"times": upsert.excluded.times, "day_type": upsert.excluded.day_type},
+        )
+        self.stamp_version = update(worktime).where(of_user, of_keys).values(version=bindparam("new_version"))
+        # appends a mark to a normal day whose marks all come before it, or adds the day. Anything else returns no
+        # row and is left to 'upsert'
+        punch = sqlite_insert(worktime).values(
+            {
+                worktime.c.user_id: bindparam("user"),
+                key: bindparam("key"),
+                worktime.c.times: bindparam("mark"),
+                worktime.c.day_type: "",
+                worktime.c.version: PUNCHED_ROW_VERSION,
+            }
+        )
+        self.punch = punch.on_conflict_do_update(
+            index_elements=[worktime.c.user_id, key],
+            set_={
+                "times": case(
+                    (worktime.c.times == "", punch.excluded.times),
+                    else_=worktime.c.times + " " + punch.excluded.times,
+                )
+            },
+            where=and_(
+                func.coalesce(worktime.c.day_type, "") == "",
+                or_(worktime.c.times == "", func.substr(worktime.c.times, -5) < punch.excluded.times),
+            ),
+        ).returning(worktime.c.times, worktime.c.version)
+
+        tombstone = cast(Table, m.WorktimeTombstone.__table__)
+        self.delete_tombstones = delete(tombstone).where(
+            tombstone.c.user_id == bindparam("user"), tombstone.c.date.in_(bindparam("keys", expanding=True))
+        )
+        tombstone_upsert = sqlite_insert(tombstone)
+        self.write_tombstones = tombstone_upsert.on_conflict_do_update(
+            index_elements=[tombstone.c.user_id, tombstone.c.date], set_={"version": tombstone_upsert.excluded.version}
+        )
+        replica = cast(Table, m.Replica.__table__)
+        self.bump_clock = update(replica).values(clock=replica.c.clock + 1)
+        self.next_clock = self.bump_clock.returning(replica.c.clock)
+        self.read_clock = select(replica.c.clock)
+        self.add_replica = insert(replica)
+
+        journal = cast(Table, m.Journal.__table__)
+        cursor = cast(Table, m.JournalCursor.__table__)
+        self.cursor = select(cursor.c.txn).where(cursor.c.user_id == bindparam("user"))
+        cursor_upsert = sqlite_insert(cursor)
+        self.move_cursor = cursor_upsert.on_conflict_do_update(
+            index_elements=[cursor.c.user_id], set_={"txn": cursor_upsert.excluded.txn}
+        )
+        self.add_journal = insert(journal)
+        of_journal_user = journal.c.user_id == bindparam("user")
+        self.drop_redo = delete(journal).where(of_journal_user, journal.c.txn >= bindparam("txn"))
+        self.drop_old = delete(journal).where(of_journal_user, journal.c.txn <= bindparam("txn"))
+
+        stats = cast(Table, m.WorktimeStats.__table__)
+        self.delete_month_stats = delete(stats).where(
+            stats.c.user_id == bindparam("user"), stats.c.month == bindparam("new_month")
+        )
+        self.add_stats = insert(stats)
+
+
+@lru_cache(maxsize=None)
+def worktime_statements(table: Type[m.Worktime]) -> WorktimeStatements:
+    return WorktimeStatements(table)
+
+
 class WorktimeSqliteDbInterface:
-    def __init__(self, engine: Engine) -> None:
+    """Worktime table access. Every read and write is scoped to the 'user_id' the interface was created for.
+    A 'read_only' interface neither creates nor migrates tables, so it streams files of any layout"""
+
+    def __init__(self, engine: Engine, user_id: str = c.DEFAULT_USER_ID, *, read_only: bool = False) -> None:
         self._engine: Engine = engine
+        # writes read the rows they change under the write lock, so concurrent processes can't interleave
+        self._write_engine: Engine = engine.execution_options(**{m.BEGIN_IMMEDIATE_OPTION: True})
+        self._user_id = user_id
         self._session_scope: Callable[[Engine], ContextManager[orm.Session]] = session_scope
+        self._query_cache = query_cache(engine)
+        # clock value of the write in progress
+        self._stamped_clock: Optional[int] = None
+        self._read_only = read_only
+        if not read_only:
+            m.init_db(engine)
+
+    @property
+    def user_id(self) -> str:
+        return self._user_id
+
+    @contextmanager
+    def _write_scope(self) -> Generator[Session, None, None]:
+        """Session of a write that changes rows, cached reads are stale once it ends. The clock value the write has
+        taken goes to the cache after the commit only, a rolled back write leaves the clock as it was"""
+        try:
+            with self._session_scope(self._write_engine) as s:
+                yield s
+            if self._stamped_clock is not None:
+                self._query_cache.stamped(self._stamped_clock)
+        finally:
+            self._stamped_clock = None
+            self._query_cache.invalidate()
+
+    def _cached(self, table: Type[m.Worktime], query: Tuple[Hashable, ...], read: Callable[[], T]) -> T:
+        return self._query_cache.get_or_read((table.__tablename__, self._user_id, *query), read)
+
+    @staticmethod
+    def _key_column(table: Type[m.Worktime]) -> Column[str]:
+        """The date part of the composite (user_id, date) primary key"""
+        return worktime_statements(table).key_column
 
     def read(self, *, table: Type[m.Worktime], limit: Optional[int] = None) -> List[m.Worktime]:
+        def query() -> List[m.Worktime]:
+            with self._session_scope(self._engine) as s:
+                query = s.query(table).where(table.user_id == self._user_id)
+                return query.order_by(self._key_column(table).desc()).limit(limit).all()
+
         try:
-            query: orm.Query = orm.Query([table]).order_by(table.__mapper__.primary_key[0].desc()).limit(limit)
+            return list(self._cached(table, ("read", limit), query))
+        except Exception as e:
+            _log.exception("Failed to read from database")
+            raise DbReadError from e
+
+    def read_page(
+            self, *, table: Type[m.Worktime], before: Optional[str] = None, limit: int
+    ) -> List[m.Worktime]:
+        """Keyset page: the newest 'limit' rows with keys below 'before', newest first. The page is extended to the
+        first day of its oldest week, so consecutive pages never split a week. Only the newest page, the one every
+        refresh reads again, is cached. Older pages are read once while paging through the history"""
+        key_column = self._key_column(table)
+
+        def query() -> List[m.Worktime]:
             with self._session_scope(self._engine) as s:
-                return query.with_session(s).all()
+                query = s.query(table).where(table.user_id == self._user_id)
+                if before is not None:
+                    query = query.where(key_column < before)
+                rows = query.order_by(key_column.desc()).limit(limit).all()
+                if not rows:
+                    return rows
+                oldest_key = str(rows[-1].date)
+                oldest = dt.date.fromordinal(int(oldest_key))
+                week_start = str(oldest.toordinal() - oldest.weekday())
+                rest_of_week = query.where(key_column >= week_start, key_column < oldest_key)
+                rows.extend(rest_of_week.order_by(key_column.desc()).all())
+                return rows
+
+        try:
+            return list(self._cached(table, ("read_page", limit), query)) if before is None else query()
         except Exception as e:
             _log.exception("Failed to read from database")
             raise DbReadError from e
 
     def find_in_db(self, *, table: Type[m.Worktime], key: str) -> Optional[List[m.Worktime]]:
+        def query() -> List[m.Worktime]:
+            with self._engine.connect() as connection:
+                rows = connection.execute(worktime_statements(table).find, dict(user=self._user_id, key=key))
+                return [table(**row._asdict()) for row in rows]
+
         try:
-            with self._session_scope(self._engine) as s:
-                found = s.query(table).where(table.__mapper__.primary_key[0] == key).all()
-                return found if found else None
+            found = self._cached(table, ("find", key), query)
+            return list(found) if found else None
         except Exception as e:
             _log.exception("Failed to read from database")
             raise DbReadError from e
 
-    def add(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+    def find_many_in_db(self, *, table: Type[m.Worktime], keys: List[str]) -> List[m.Worktime]:
+        def query() -> List[m.Worktime]:
+            statements = worktime_statements(table)
+            with self._engine.connect() as connection:
+                found: List[m.Worktime] = []
+                for keys_chunk in chunked(keys, SQLITE_MAX_VARIABLES - 1):
+                    rows = connection.execute(statements.find_many, dict(user=self._user_id, keys=keys_chunk))
+                    found.extend(table(**row._asdict()) for row in rows)
+                return found
+
+        try:
+            return list(self._cached(table, ("find_many", tuple(keys)), query))
+        except Exception as e:
+            _log.exception("Failed to read from database")
+            raise DbReadError from e
+
+    def _stored_rows(
+            self, connection: Connection, table: Type[m.Worktime], keys: List[str]
+    ) -> Dict[str, c.RowDictData]:
+        statements = worktime_statements(table)
+        key_name = statements.key_column.name
+        stored: Dict[str, c.RowDictData] = {}
+        for keys_chunk in chunked(keys, SQLITE_MAX_VARIABLES - 1):
+            for key, times, day_type in connection.execute(
+                    statements.stored_rows, dict(user=self._user_id, keys=keys_chunk)
+            ):
+                stored[key] = {key_name: key, "times": times, "day_type": day_type or ""}
+        return stored
+
+    def _journal(self, connection: Connection, table: Type[m.Worktime], changes: Sequence[JournalChange]) -> None:
+        """Appends changes as a new journal transaction. Undone transactions can not be redone after that"""
+        if not changes:
+            return
+        statements = worktime_statements(table)
+        self._stamp_version(connection, table, changes)
+        txn = self._cursor_position(connection, table) + 1
+        connection.execute(statements.drop_redo, dict(user=self._user_id, txn=txn))
+        connection.execute(
+            statements.add_journal,
+            [
+                dict(
+                    user_id=self._user_id,
+                    txn=txn,
+                    date=key,
+                    before=json.dumps(before) if before is not None else None,
+                    after=json.dumps(after) if after is not None else None,
+                )
+                for key, before, after in changes
+            ],
+        )
+        self._refresh_stats(connection, table, [key for key, _, _ in changes])
+        self._move_journal_cursor(connection, table, txn)
+        if txn % JOURNAL_COMPACT_EVERY == 0:
+            self._compact_journal(connection, table, txn)
+
+    @staticmethod
+    def _next_version(connection: Connection, table: Type[m.Worktime]) -> int:
+        statements = worktime_statements(table)
+        if SQLITE_RETURNING:
+            clock = connection.execute(statements.next_clock).scalar()
+        else:
+            # the write transaction holds the lock already, no other writer can bump the clock in between
+            connection.execute(statements.bump_clock)
+            clock = connection.execute(statements.read_clock).scalar()
+        if clock is None:
+            clock = 1
+            connection.execute(statements.add_replica, dict(replica_id=uuid.uuid4().hex, clock=clock))
+        return int(clock)
+
+    def _stamp_version(
+            self, connection: Connection, table: Type[m.Worktime], changes: Sequence[JournalChange]
+    ) -> None:
+        """Marks changed rows with a new clock value, deleted ones leave a tombstone"""
+        statements = worktime_statements(table)
+        version = self._next_version(connection, table)
+        self._stamped_clock = version
+        written = [key for key, _, after in changes if after is not None]
+        deleted = [key for key, _, after in changes if after is None]
+        for keys in chunked(written, SQLITE_MAX_VARIABLES - 2):
+            connection.execute(statements.stamp_version, dict(user=self._user_id, keys=keys, new_version=version))
+            connection.execute(statements.delete_tombstones, dict(user=self._user_id, keys=keys))
+        if deleted:
+            connection.execute(
+                statements.write_tombstones,
+                [dict(user_id=self._user_id, date=key, version=version) for key in deleted],
+            )
+
+    def _refresh_stats(self, connection: Connection, table: Type[m.Worktime], keys: Sequence[str]) -> None:
+        """Sketches the months of the changed keys again from their rows. A sketch can't remove a value, so an edit
+        rebuilds its month instead, which costs a month of rows at most and never the history"""
+        statements = worktime_statements(table)
+        for month in sorted({statistics.month_index(dt.date.fromordinal(int(key))) for key in keys}):
+            first, last = statistics.month_bounds(month)
+            rows = connection.execute(
+                statements.month_rows,
+                dict(user=self._user_id, first=str(first.toordinal()), last=str(last.toordinal())),
+            )
+            digests = statistics.build_digests(
+                c.WorkDay.from_values([key, times, day_type or ""]) for key, times, day_type in rows
+            )
+            connection.execute(statements.delete_month_stats, dict(user=self._user_id, new_month=month))
+            if any(digests.values()):
+                connection.execute(
+                    statements.add_stats,
+                    [
+                        dict(user_id=self._user_id, month=month, metric=metric, digest=digest.to_json())
+                        for metric, digest in digests.items()
+                    ],
+                )
+
+    def month_stats(
+            self, *, start: Optional[int] = None, end: Optional[int] = None, all_users: bool = False
+    ) -> Dict[int, Dict[str, statistics.TDigest]]:
+        """Time metric sketches per 'statistics.month_index' in [start, end], merged over users if 'all_users'"""
+        stats = m.WorktimeStats
+        stmt = select(stats.month, stats.metric, stats.digest)
+        if not all_users:
+            stmt = stmt.where(stats.user_id == self._user_id)
+        if start is not None:
+            stmt = stmt.where(stats.month >= start)
+        if end is not None:
+            stmt = stmt.where(stats.month <= end)
+        result: Dict[int, Dict[str, statistics.TDigest]] = {}
         try:
             with self._session_scope(self._engine) as s:
-                s.add_all([table(**row_dict) for row_dict in row_dicts])
+                for month, metric, digest in s.execute(stmt.order_by(stats.month)):
+                    month_digests = result.setdefault(month, {})
+                    if metric in month_digests:
+                        month_digests[metric].merge(statistics.TDigest.from_json(digest))
+                    else:
+                        month_digests[metric] = statistics.TDigest.from_json(digest)
+        except Exception as e:
+            _log.exception("Failed to read statistics from database")
+            raise DbReadError from e
+        return result
+
+    def _cursor_position(self, connection: Connection, table: Type[m.Worktime]) -> int:
+        txn = connection.execute(worktime_statements(table).cursor, dict(user=self._user_id)).scalar()
+        return int(txn) if txn is not None else 0
+
+    def _move_journal_cursor(self, connection: Connection, table: Type[m.Worktime], txn: int) -> None:
+        connection.execute(worktime_statements(table).move_cursor, dict(user_id=self._user_id, txn=txn))
+
+    def _compact_journal(self, connection: Connection, table: Type[m.Worktime], txn: int) -> None:
+        stmt = worktime_statements(table).drop_old
+        removed = connection.execute(stmt, dict(user=self._user_id, txn=txn - JOURNAL_KEEP_TXNS)).rowcount
+        _log.debug(f"Journal compacted, {removed} entries older than {JOURNAL_KEEP_TXNS} transactions removed")
+
+    def add(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        try:
+            statements = worktime_statements(table)
+            key_name = statements.key_column.name
+            with self._write_scope() as s:
+                connection = s.connection()
+                connection.execute(
+                    statements.add_rows, [dict(row_dict, user_id=self._user_id) for row_dict in row_dicts]
+                )
+                self._journal(
+                    connection, table, [(row_dict[key_name], None, dict(row_dict)) for row_dict in row_dicts]
+                )
         except Exception as e:
             _log.exception("Failed to add to database")
             raise DbInsertError from e
 
     def update(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
         try:
-            pk_name = table.__mapper__.primary_key[0].name
-            with self._session_scope(self._engine) as s:
-                for row_dict in row_dicts:
-                    stmt = update(table).where(table.__dict__[pk_name] == row_dict.pop(pk_name)).values(**row_dict)
-                    s.execute(stmt)
+            statements = worktime_statements(table)
+            key_name = statements.key_column.name
+            with self._write_scope() as s:
+                connection = s.connection()
+                stored = self._stored_rows(connection, table, [row_dict[key_name] for row_dict in row_dicts])
+                updated = {row_dict[key_name]: row_dict for row_dict in row_dicts}
+                changes = [(key, before, {**before, **updated[key]}) for key, before in stored.items()]
+                if changes:
+                    connection.execute(
+                        statements.update_row,
+                        [
+                            dict(user=self._user_id, key=key, new_times=after["times"], new_day_type=after["day_type"])
+                            for key, _, after in changes
+                        ],
+                    )
+                self._journal(connection, table, changes)
         except Exception as e:
             _log.exception("Failed to update database rows")
             raise DbInsertError from e
 
     def delete(self, row_ids: List[str], *, table: Type[m.Worktime]) -> None:
         try:
-            pk_name = table.__mapper__.primary_key[0].name
-            with self._session_scope(self._engine) as s:
-                result = s.query(table).filter(m.Worktime.__dict__[pk_name].in_(row_ids)).delete()
+            statements = worktime_statements(table)
+            with self._write_scope() as s:
+                connection = s.connection()
+                stored = self._stored_rows(connection, table, row_ids)
+                result = 0
+                for keys_chunk in chunked(row_ids, SQLITE_MAX_VARIABLES - 1):
+                    result += connection.execute(
+                        statements.delete_rows, dict(user=self._user_id, keys=keys_chunk)
+                    ).rowcount
+                self._journal(connection, table, [(key, before, None) for key, before in stored.items()])
             assert result == len(row_ids)
         except Exception as e:
             _log.exception("Failed to delete database rows")
             raise DbRowDeleteError from e
 
+    def delete_where(
+            self,
+            *,
+            table: Type[m.Worktime],
+            start: Optional[str] = None,
+            end: Optional[str] = None,
+            day_types: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """Deletes the user's rows with keys in the [start, end] ordinal range and, if given, one of 'day_types'
+        ('' for a normal day) with a single statement. The rows go to one journal transaction, so one undo brings
+        them back. Returns the deleted keys"""
+        key_column = self._key_column(table)
+        conditions = [table.user_id == self._user_id]
+        if start is not None:
+            conditions.append(key_column >= start)
+        if end is not None:
+            conditions.append(key_column <= end)
+        if day_types is not None:
+            conditions.append(func.coalesce(table.day_type, "").in_(day_types))
+        try:
+            with self._write_scope() as s:
+                stored: Dict[str, c.RowDictData] = {}
+                stmt = select(key_column, table.times, table.day_type).where(*conditions)
+                for key, times, day_type in s.execute(stmt):
+                    stored[key] = {key_column.name: key, "times": times, "day_type": day_type or ""}
+                if stored:
+                    s.execute(delete(table).where(*conditions).execution_options(synchronize_session=False))
+                    self._journal(s.connection(), table, [(key, before, None) for key, before in stored.items()])
+        except Exception as e:
+            _log.exception("Failed to delete database rows")
+            raise DbRowDeleteError from e
+        _log.debug(f"{len(stored)} rows deleted, range: [{start}, {end}], day types: {day_types}")
+        return list(stored)
+
     def write_to_db(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
-        pk_name = table.__mapper__.primary_key[0].name
-        for row_dict in row_dicts:
-            found = self.find_in_db(table=table, key=row_dict[pk_name])
-            if found:
-                self.update([row_dict], table=table)
+        """Adds rows or replaces the stored ones in one transaction, never a separate check and write"""
+        self.upsert(row_dicts, table=table, replace=True)
+
+    def upsert(
+            self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime], replace: bool = False
+    ) -> Dict[str, c.RowDictData]:
+        """Writes rows in a single transaction. A row whose key is already stored is combined with the stored one
+        through 'WorkDay.__add__', or replaces it if 'replace' is set. Returns the written rows as stored now, by key"""
+        try:
+            with self._write_scope() as s:
+                written = self._upsert_rows(s.connection(), table, row_dicts, replace=replace)
+        except Exception as e:
+            _log.exception("Failed to upsert database rows")
+            raise DbInsertError from e
+        return written
+
+    def _upsert_rows(
+            self, connection: Connection, table: Type[m.Worktime], row_dicts: List[c.RowDictData], *, replace: bool
+    ) -> Dict[str, c.RowDictData]:
+        """Body of 'upsert' in the caller's transaction. Returns the written rows by key"""
+        pending = combine_rows(row_dicts, replace=replace)
+        stored = self._stored_rows(connection, table, list(pending))
+        pending = merge_stored_rows(pending, stored, replace=replace)
+        if pending:
+            self._write_rows(connection, table, list(pending.values()))
+            self._journal(connection, table, [(key, stored.get(key), row_dict) for key, row_dict in pending.items()])
+        return pending
+
+    def punch(self, key: str, mark: str, *, table: Type[m.Worktime]) -> c.RowDictData:
+        """Appends the 'HH:MM' time 'mark' to the row of 'key', or adds the row, with a single upsert that returns
+        the new values, so nothing is read first. A mark that doesn't follow the marks of a normal day is combined
+        like 'upsert' does, in the same transaction, as is every mark where SQLite has no RETURNING. Returns the
+        stored row"""
+        statements = worktime_statements(table)
+        key_name = statements.key_column.name
+        try:
+            with self._write_scope() as s:
+                connection = s.connection()
+                punched = None
+                if SQLITE_RETURNING:
+                    punched = connection.execute(
+                        statements.punch, dict(user=self._user_id, key=key, mark=mark)
+                    ).first()
+                if punched is None:
+                    new_row = {key_name: key, "times": mark, "day_type": ""}
+                    written = self._upsert_rows(connection, table, [new_row], replace=False)
+                    return written.get(key) or self._stored_rows(connection, table, [key])[key]
+                times, version = punched
+                after = {key_name: key, "times": times, "day_type": ""}
+                before = None if version == PUNCHED_ROW_VERSION else dict(after, times=times[:-len(mark)].rstrip())
+                self._journal(connection, table, [(key, before, after)])
+                return after
+        except Exception as e:
+            _log.exception("Failed to punch the time")
+            raise DbInsertError from e
+
+    def _write_rows(self, connection: Connection, table: Type[m.Worktime], row_dicts: List[c.RowDictData]) -> None:
+        connection.execute(
+            worktime_statements(table).write_rows, [dict(row_dict, user_id=self._user_id) for row_dict in row_dicts]
+        )
+
+    def _replay_journal(self, table: Type[m.Worktime], undo: bool) -> Optional[List[str]]:
+        statements = worktime_statements(table)
+        journal = m.Journal
+        with self._write_scope() as s:
+            connection = s.connection()
+            position = self._cursor_position(connection, table)
+            if undo:
+                txn: Optional[int] = position
+                target = s.scalar(
+                    select(func.max(journal.txn)).where(journal.user_id == self._user_id, journal.txn < position)
+                ) or 0
+            else:
+                txn = s.scalar(
+                    select(func.min(journal.txn)).where(journal.user_id == self._user_id, journal.txn > position)
+                )
+                target = txn or 0
+            entries = s.execute(
+                select(journal.date, journal.before, journal.after)
+                .where(journal.user_id == self._user_id, journal.txn == txn)
+                .order_by(journal.seq.desc() if undo else journal.seq)
+            ).all()
+            if not entries:
+                return None
+            changes: List[JournalChange] = []
+            for key, before, after in entries:
+                values = before if undo else after
+                if values is None:
+                    connection.execute(statements.delete_row, dict(user=self._user_id, key=key))
+                    changes.append((key, None, None))
+                else:
+                    row_dict = json.loads(values)
+                    self._write_rows(connection, table, [row_dict])
+                    changes.append((key, None, row_dict))
+            self._stamp_version(connection, table, changes)
+            self._refresh_stats(connection, table, [key for key, _, _ in changes])
+            self._move_journal_cursor(connection, table, target)
+        keys = [key for key, _, _ in entries]
+        _log.debug(f"Journal transaction {txn} {'undone' if undo else 'redone'}, rows: {keys}")
+        return keys
+
+    def undo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        """Reverts the last journal transaction of the user. Returns the affected keys, None if nothing to undo"""
+        try:
+            return self._replay_journal(table, undo=True)
+        except Exception as e:
+            _log.exception("Failed to undo the last change")
+            raise DbInsertError from e
+
+    def redo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        """Reapplies the last undone journal transaction. Returns the affected keys, None if nothing to redo"""
+        try:
+            return self._replay_journal(table, undo=False)
+        except Exception as e:
+            _log.exception("Failed to redo the last undone change")
+            raise DbInsertError from e
+
+    def existing_keys(self, keys: List[str], *, table: Type[m.Worktime]) -> List[str]:
+        def query() -> List[str]:
+            with self._engine.connect() as connection:
+                return list(self._stored_rows(connection, table, keys))
+
+        try:
+            return list(self._cached(table, ("existing_keys", tuple(keys)), query))
+        except Exception as e:
+            _log.exception("Failed to read from database")
+            raise DbReadError from e
+
+    def replica_id(self) -> str:
+        """Id of the database file, created on first use"""
+        with self._session_scope(self._write_engine) as s:
+            replica = s.scalars(select(m.Replica)).first()
+            if replica is None:
+                replica = m.Replica(replica_id=uuid.uuid4().hex, clock=0)
+                s.add(replica)
+            return str(replica.replica_id)
+
+    def clock(self) -> int:
+        with self._session_scope(self._engine) as s:
+            return int(s.scalar(select(m.Replica.clock)) or 0)
+
+    def sync_point(self, peer_id: str) -> int:
+        """Own clock value at the end of the last sync with 'peer_id', -1 if never synced"""
+        with self._session_scope(self._engine) as s:
+            version = s.scalar(select(m.SyncPeer.version).where(m.SyncPeer.peer_id == peer_id))
+            return int(version) if version is not None else -1
+
+    def set_sync_point(self, peer_id: str, version: int) -> None:
+        with self._session_scope(self._write_engine) as s:
+            stmt = sqlite_insert(m.SyncPeer).values(peer_id=peer_id, version=version)
+            s.execute(stmt.on_conflict_do_update(index_elements=[m.SyncPeer.peer_id], set_={"version": version}))
+
+    def changes_since(self, version: int, *, table: Type[m.Worktime]) -> Dict[Tuple[str, str], SyncRow]:
+        """Rows and tombstones of every user changed after the 'version' clock value, found through
+        the version indexes, so the cost follows the number of changes rather than the table size"""
+        key_column = self._key_column(table)
+        changes: Dict[Tuple[str, str], Tuple[int, Optional[c.RowDictData]]] = {}
+        try:
+            with self._session_scope(self._engine) as s:
+                rows = s.execute(
+                    select(table.user_id, key_column, table.times, table.day_type, table.version).where(
+                        table.version > version
+                    )
+                )
+                for user_id, key, times, day_type, row_version in rows:
+                    row_dict = {key_column.name: key, "times": times, "day_type": day_type or ""}
+                    changes[(user_id, key)] = (row_version, row_dict)
+                tombstone = m.WorktimeTombstone
+                deleted = s.execute(
+                    select(tombstone.user_id, tombstone.date, tombstone.version).where(tombstone.version > version)
+                )
+                for user_id, key, tombstone_version in deleted:
+                    if (user_id, key) not in changes or changes[(user_id, key)][0] < tombstone_version:
+                        changes[(user_id, key)] = (tombstone_version, None)
+        except Exception as e:
+            _log.exception("Failed to read changes from database")
+            raise DbReadError from e
+        return {key: row_dict for key, (_, row_dict) in changes.items()}
+
+    def external_changes(self) -> int:
+        """A count that grows when other processes commit to the database, so rows read before may be stale. Checks
+        for new commits, which cached reads see from then on, App calls it once per operation"""
+        self._query_cache.check_external_writes()
+        return self._query_cache.external_generation
+
+    def for_user(self, user_id: str) -> "WorktimeSqliteDbInterface":
+        """An interface to the same database scoped to another user"""
+        return WorktimeSqliteDbInterface(self._engine, user_id=user_id)
+
+    def iter_rows(
+            self, *, table: Type[m.Worktime], all_users: bool = False, batch_size: int = 1000, descending: bool = False
+    ) -> Iterator[List[WorktimeRow]]:
+        """Streams rows in primary key order, or the reverse of it, through a server-side cursor, one batch
+        at a time"""
+        try:
+            if self._read_only:
+                stmt = m.stored_worktime_rows(self._engine)
             else:
-                self.add([row_dict], table=table)
+                stmt = select(table.user_id, self._key_column(table), table.times, table.day_type)
+            user_column, key_column = stmt.selected_columns.user_id, stmt.selected_columns.date
+            order = (user_column.desc(), key_column.desc()) if descending else (user_column, key_column)
+            stmt = stmt.order_by(*order)
+            if not all_users:
+                stmt = stmt.where(user_column == self._user_id)
+            with self._engine.connect() as connection:
+                result = connection.execution_options(yield_per=batch_size).execute(stmt)
+                for partition in result.partitions():
+                    yield [(user_id, date, times, day_type or "") for user_id, date, times, day_type in partition]
+        except Exception as e:
+            _log.exception("Failed to stream rows from database")
+            raise DbReadError from e
+
+    def users(self, *, table: Type[m.Worktime]) -> List[str]:
+        try:
+            with self._session_scope(self._engine) as s:
+                return list(s.scalars(select(table.user_id).distinct().order_by(table.user_id)))
+        except Exception as e:
+            _log.exception("Failed to read users from database")
+            raise DbReadError from e
+
+    def team_totals(
+            self, *, table: Type[m.Worktime], start: Optional[str] = None, end: Optional[str] = None
+    ) -> TeamTotals:
+        """Sums WorkWeek summary fields per user over the [start, end] ordinal date range in a single table scan"""
+        key_column = self._key_column(table)
+        stmt = select(table.user_id, key_column, table.times, table.day_type)
+        if start is not None:
+            stmt = stmt.where(key_column >= start)
+        if end is not None:
+            stmt = stmt.where(key_column <= end)
+        summary_fields = c.WorkWeek.summary_fields
+        totals: TeamTotals = {}
+        try:
+            with self._session_scope(self._engine) as s:
+                for user_id, date, times, day_type in s.execute(stmt):
+                    workday = c.WorkDay.from_values([date, times, day_type or ""])
+                    user_totals = totals.setdefault(user_id, {name: dt.timedelta(0) for name in summary_fields})
+                    for name in summary_fields:
+                        user_totals[name] += getattr(workday, name)
+        except Exception as e:
+            _log.exception("Failed to aggregate team totals")
+            raise DbReadError from e
+        return totals
 
 
 if __name__ == "__main__":
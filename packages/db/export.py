@@ -0,0 +1,150 @@
+import csv
+import datetime as dt
+import io
+import json
+import logging
+import struct
+import time
+from enum import Enum
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from packages.constants import WorkDay, DayType, stored_time_totals
+from packages.db.database_interface import DbInterface, WorktimeRow
+from packages.db.models import Worktime, WORKTIME_DATA_COLUMNS
+
+_log = logging.getLogger(__name__)
+
+COLUMNS = WORKTIME_DATA_COLUMNS
+DERIVED_COLUMNS = ("worktime", "overtime")
+DAY_TYPE_CODES = {day_type.value: code for code, day_type in enumerate(DayType)}
+
+BINARY_MAGIC = b"WTB1"
+BINARY_FLAG_DERIVED = 0x01
+BINARY_USER_ID_SIZE = 32
+BINARY_MAX_TIME_MARKS = 12
+# magic, flags, record size
+BINARY_HEADER = struct.Struct("<4sBH")
+# user_id, date ordinal, day type code, time marks count, time marks as minutes since midnight
+BINARY_RECORD = struct.Struct(f"<{BINARY_USER_ID_SIZE}sIBB{BINARY_MAX_TIME_MARKS}H")
+# worktime and overtime in minutes
+BINARY_DERIVED = struct.Struct("<HH")
+
+
+def _minutes(value: dt.timedelta) -> int:
+    return int(value.total_seconds()) // 60
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportFormat(Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    BINARY = "bin"
+
+
+def _derived_values(rows: List[WorktimeRow]) -> List[Tuple[dt.timedelta, dt.timedelta]]:
+    """WorkDay 'worktime' and 'overtime' for a batch of rows"""
+    values = []
+    for _, _, times, _ in rows:
+        _, _, worktime, overtime = stored_time_totals(times)
+        values.append((worktime, overtime))
+    return values
+
+
+def _write_csv(batches: Iterator[List[WorktimeRow]], stream: BinaryIO, derived: bool) -> int:
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    writer = csv.writer(text_stream)
+    writer.writerow(COLUMNS + DERIVED_COLUMNS if derived else COLUMNS)
+    count = 0
+    for rows in batches:
+        if derived:
+            writer.writerows(row + tuple(map(str, values)) for row, values in zip(rows, _derived_values(rows)))
+        else:
+            writer.writerows(rows)
+        count += len(rows)
+    text_stream.flush()
+    text_stream.detach()
+    return count
+
+
+def _write_ndjson(batches: Iterator[List[WorktimeRow]], stream: BinaryIO, derived: bool) -> int:
+    """Each line has the 'Worktime.as_json' shape, derived values go to a sibling 'derived' key"""
+    table_name = Worktime.__tablename__
+    count = 0
+    for rows in batches:
+        lines = []
+        derived_values = _derived_values(rows) if derived else []
+        for i, row in enumerate(rows):
+            record: Dict[str, object] = {"table": {table_name: dict(zip(COLUMNS, row))}}
+            if derived:
+                record["derived"] = {"worktime": str(derived_values[i][0]), "overtime": str(derived_values[i][1])}
+            lines.append(json.dumps(record))
+        lines.append("")
+        stream.write("\n".join(lines).encode("utf-8"))
+        count += len(rows)
+    return count
+
+
+def _write_binary(batches: Iterator[List[WorktimeRow]], stream: BinaryIO, derived: bool) -> int:
+    record_size = BINARY_RECORD.size + (BINARY_DERIVED.size if derived else 0)
+    stream.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_FLAG_DERIVED if derived else 0, record_size))
+    count = 0
+    for rows in batches:
+        chunk = bytearray()
+        derived_values = _derived_values(rows) if derived else []
+        for i, (user_id, date, times, day_type) in enumerate(rows):
+            marks = [int(mark[:2]) * 60 + int(mark[3:5]) for mark in times.split()]
+            if len(marks) > BINARY_MAX_TIME_MARKS:
+                raise ExportError(f"Binary record supports up to {BINARY_MAX_TIME_MARKS} time marks: {date} {times}")
+            encoded_user_id = user_id.encode("utf-8")
+            if len(encoded_user_id) > BINARY_USER_ID_SIZE:
+                raise ExportError(f"Binary record supports user ids up to {BINARY_USER_ID_SIZE} bytes: {user_id}")
+            padding = [0] * (BINARY_MAX_TIME_MARKS - len(marks))
+            chunk += BINARY_RECORD.pack(
+                encoded_user_id, int(date), DAY_TYPE_CODES[day_type], len(marks), *marks, *padding
+            )
+            if derived:
+                chunk += BINARY_DERIVED.pack(_minutes(derived_values[i][0]), _minutes(derived_values[i][1]))
+        stream.write(chunk)
+        count += len(rows)
+    return count
+
+
+_WRITERS = {ExportFormat.CSV: _write_csv, ExportFormat.NDJSON: _write_ndjson, ExportFormat.BINARY: _write_binary}
+
+
+def export_worktime(
+        db_if: DbInterface,
+        stream: BinaryIO,
+        export_format: ExportFormat,
+        *,
+        derived: bool = False,
+        all_users: bool = False,
+        batch_size: int = 5000,
+) -> int:
+    """Streams the worktime table into 'stream' batch by batch, so memory use does not grow with the history"""
+    started = time.perf_counter()
+    batches = db_if.iter_rows(table=Worktime, all_users=all_users, batch_size=batch_size)
+    count = _WRITERS[export_format](batches, stream, derived)
+    _log.debug(f"{count} rows exported as {export_format.value} in {time.perf_counter() - started:.3f}s")
+    return count
+
+
+def read_binary(stream: BinaryIO) -> Iterator[Tuple[WorkDay, str]]:
+    """Yields (WorkDay, user_id) pairs from a binary export"""
+    magic, _flags, record_size = BINARY_HEADER.unpack(stream.read(BINARY_HEADER.size))
+    if magic != BINARY_MAGIC:
+        raise ExportError(f"Not a worktime binary export: {magic!r}")
+    day_types = list(DayType)
+    while True:
+        record = stream.read(record_size)
+        if not record:
+            return
+        if len(record) != record_size:
+            raise ExportError("Truncated binary export")
+        user_id, date, day_type_code, marks_count, *marks = BINARY_RECORD.unpack_from(record)
+        times = [dt.time(*divmod(mark, 60)) for mark in marks[:marks_count]]
+        workday = WorkDay(dt.date.fromordinal(date), times, day_types[day_type_code])
+        yield workday, user_id.rstrip(b"\0").decode("utf-8")
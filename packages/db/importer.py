@@ -0,0 +1,155 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import Enum
+from typing import Deque, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from dataclasses import dataclass, field
+
+from packages.constants import WorkDay, RowDictData
+from packages.db.database_interface import DbInterface
+from packages.db.export import ExportFormat
+from packages.db.models import Worktime
+
+_log = logging.getLogger(__name__)
+
+IMPORT_FORMATS = (ExportFormat.CSV, ExportFormat.NDJSON)
+MAX_LOGGED_REJECTS = 20
+# (user_id, row dict) pairs of valid lines and messages for rejected ones
+ParsedChunk = Tuple[List[Tuple[str, RowDictData]], List[str]]
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+class ConflictPolicy(Enum):
+    MERGE = "merge"
+    REPLACE = "replace"
+
+
+@dataclass
+class ImportResult:
+    read: int = 0
+    written: int = 0
+    rejected: List[str] = field(default_factory=list)
+
+
+def _parse_record(import_format: ExportFormat, columns: Tuple[str, ...], line: str) -> Dict[str, str]:
+    if import_format == ExportFormat.CSV:
+        return dict(zip(columns, next(csv.reader([line]))))
+    record: Dict[str, str] = json.loads(line)["table"][Worktime.__tablename__]
+    return record
+
+
+def parse_chunk(
+        import_format: ExportFormat, columns: Tuple[str, ...], first_line: int, lines: List[str]
+) -> ParsedChunk:
+    """Validates lines through 'WorkDay.from_values'"""
+    rows: List[Tuple[str, RowDictData]] = []
+    rejected: List[str] = []
+    for line_number, line in enumerate(lines, start=first_line):
+        try:
+            record = _parse_record(import_format, columns, line)
+            workday = WorkDay.from_values([record["date"], record["times"], record.get("day_type") or ""])
+            rows.append((record.get("user_id") or "", workday.as_db()))
+        except Exception as e:
+            rejected.append(f"line {line_number}: {type(e).__name__}: {e}")
+    return rows, rejected
+
+
+def _read_chunks(stream: TextIO, first_line: int, chunk_size: int) -> Iterator[Tuple[int, List[str]]]:
+    lines: List[str] = []
+    for line_number, line in enumerate(stream, start=first_line):
+        if not line.strip():
+            continue
+        if not lines:
+            chunk_start = line_number
+        lines.append(line.rstrip("\r\n"))
+        if len(lines) == chunk_size:
+            yield chunk_start, lines
+            lines = []
+    if lines:
+        yield chunk_start, lines
+
+
+class _Writer:
+    """The only place that writes, so the parsing workers never contend for the database lock"""
+
+    def __init__(self, db_if: DbInterface, policy: ConflictPolicy, keep_users: bool) -> None:
+        self._interfaces = {db_if.user_id: db_if}
+        self._default_user_id = db_if.user_id
+        self._replace = policy == ConflictPolicy.REPLACE
+        self._keep_users = keep_users
+
+    def write(self, rows: List[Tuple[str, RowDictData]]) -> int:
+        users_rows: Dict[str, List[RowDictData]] = {}
+        for user_id, row_dict in rows:
+            user_id = user_id if self._keep_users and user_id else self._default_user_id
+            users_rows.setdefault(user_id, []).append(row_dict)
+        written = 0
+        for user_id, row_dicts in users_rows.items():
+            if user_id not in self._interfaces:
+                self._interfaces[user_id] = self._interfaces[self._default_user_id].for_user(user_id)
+            written += len(self._interfaces[user_id].upsert(row_dicts, table=Worktime, replace=self._replace))
+        return written
+
+
+def import_worktime(
+        db_if: DbInterface,
+        stream: TextIO,
+        import_format: ExportFormat,
+        *,
+        policy: ConflictPolicy = ConflictPolicy.MERGE,
+        keep_users: bool = True,
+        workers: Optional[int] = None,
+        chunk_size: int = 5000,
+) -> ImportResult:
+    """Loads a CSV or NDJSON export. Chunks are validated by a process pool while the calling process writes
+    finished chunks in order, one batched upsert per chunk and user"""
+    if import_format not in IMPORT_FORMATS:
+        raise ImportFormatError(f"Import is not supported for '{import_format.value}' format")
+    started = time.perf_counter()
+    columns: Tuple[str, ...] = ()
+    first_line = 1
+    if import_format == ExportFormat.CSV:
+        columns = tuple(next(csv.reader([stream.readline()]), []))
+        if not {"date", "times"}.issubset(columns):
+            raise ImportFormatError(f"CSV header must include 'date' and 'times' columns: {columns}")
+        first_line = 2
+    workers = workers or os.cpu_count() or 1
+    writer = _Writer(db_if, policy, keep_users)
+    result = ImportResult()
+
+    def consume(parsed: ParsedChunk) -> None:
+        rows, rejected = parsed
+        result.read += len(rows) + len(rejected)
+        result.written += writer.write(rows)
+        result.rejected.extend(rejected)
+
+    chunks = _read_chunks(stream, first_line, chunk_size)
+    if workers == 1:
+        for chunk_start, lines in chunks:
+            consume(parse_chunk(import_format, columns, chunk_start, lines))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # a bounded window of chunks in flight keeps memory flat for inputs of any size
+            in_flight: Deque[Future[ParsedChunk]] = deque()
+            for chunk_start, lines in chunks:
+                in_flight.append(pool.submit(parse_chunk, import_format, columns, chunk_start, lines))
+                if len(in_flight) >= 2 * workers:
+                    consume(in_flight.popleft().result())
+            while in_flight:
+                consume(in_flight.popleft().result())
+
+    for message in result.rejected[:MAX_LOGGED_REJECTS]:
+        _log.error(f"Rejected on import: {message}")
+    _log.debug(
+        f"Import finished in {time.perf_counter() - started:.3f}s: {result.read} read, "
+        f"{result.written} written, {len(result.rejected)} rejected"
+    )
+    return result
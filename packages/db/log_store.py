@@ -0,0 +1,540 @@
+import bisect
+import datetime as dt
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Sequence, Iterator, Type, Tuple, Union
+
+import packages.db.models as m
+from packages import constants as c
+from packages import statistics
+from packages.db.database_interface import (
+    DbInsertError,
+    DbReadError,
+    DbRowDeleteError,
+    DbSessionError,
+    JournalChange,
+    TeamTotals,
+    WorktimeRow,
+    JOURNAL_KEEP_TXNS,
+    combine_rows,
+    merge_stored_rows,
+)
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+_log = logging.getLogger(__name__)
+
+LOG_FILE_NAME = "log.jsonl"
+SNAPSHOT_FILE_NAME = "snapshot.json"
+LOCK_FILE_NAME = "lock"
+# commits written between fsyncs. Every commit reaches the OS at once, so a crash of the process loses none of them,
+# a power loss at most the unsynced ones
+FSYNC_BATCH = 32
+# log records after which the log is folded into a new snapshot, bounds the replay on open
+COMPACT_EVERY = 10000
+
+# [times, day_type] of a stored row, as json gives it
+StoredValues = List[str]
+# json value of a log record
+LogRecord = Dict[str, Union[int, str]]
+# time metric sketches by 'statistics.month_index'
+MonthDigests = Dict[int, Dict[str, statistics.TDigest]]
+
+
+class LogStoreLockedError(DbSessionError):
+    pass
+
+
+def _fsync_dir(path: Path) -> None:
+    """Makes a rename in the directory durable, where directories can be opened at all"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LogStore:
+    """Worktime rows of every user in a directory: an append-only log of committed changes, one json record per
+    line, and a snapshot of the state the log starts from. The rows and a sorted date index per user are held in
+    memory, so reads never touch the files and a write is one append.
+
+    Opening replays the log over the snapshot, a record torn by a crash at the end of the log is dropped. Every
+    'compact_every' records the state is written to a new snapshot and the log starts over. One process at a time
+    may open a store, it holds an advisory lock on the directory until it closes the store"""
+
+    def __init__(self, path: str, *, fsync_batch: int = FSYNC_BATCH, compact_every: int = COMPACT_EVERY) -> None:
+        self._dir = Path(path)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._lock_file = self._lock()
+        self._log_path = self._dir / LOG_FILE_NAME
+        self._snapshot_path = self._dir / SNAPSHOT_FILE_NAME
+        self._fsync_batch = max(fsync_batch, 1)
+        self._compact_every = compact_every
+        self._rows: Dict[str, Dict[str, StoredValues]] = {}
+        # sorted keys of '_rows' per user, ordinal date strings of one length sort like the dates
+        self._keys: Dict[str, List[str]] = {}
+        # journal transactions per user as json text of their changes, decoded by undo and redo only, and the number
+        # of them applied. Undo moves the cursor back, redo forward
+        self._journals: Dict[str, List[str]] = {}
+        self._cursors: Dict[str, int] = {}
+        # month sketches per user, sketched on the first read of a user's statistics and kept up to date by commits
+        self._stats: Dict[str, MonthDigests] = {}
+        self._seq = 0
+        self._log_records = 0
+        self._unsynced = 0
+        self._recover()
+        self._log_file = open(self._log_path, "a", encoding="utf-8")
+
+    @property
+    def path(self) -> str:
+        return str(self._dir)
+
+    def _lock(self) -> IO[bytes]:
+        """Takes the lock of the directory, so a second process fails to open the store instead of appending
+        to the log at the same time"""
+        lock_file = open(self._dir / LOCK_FILE_NAME, "a+b")
+        try:
+            if sys.platform == "win32":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            raise LogStoreLockedError(f"Log store '{self._dir}' is open in another process") from e
+        return lock_file
+
+    def _recover(self) -> None:
+        if self._snapshot_path.exists():
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self._seq = int(snapshot["seq"])
+            for user_id, rows in snapshot["rows"].items():
+                self._rows[user_id] = rows
+                self._keys[user_id] = sorted(rows)
+            for user_id, journal in snapshot["journals"].items():
+                self._journals[user_id] = journal["txns"]
+                self._cursors[user_id] = int(journal["cursor"])
+        if not self._log_path.exists():
+            return
+        valid_size = 0
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                # records of a log that was folded into the snapshot, but not yet truncated, when the process stopped
+                if record["seq"] <= self._seq:
+                    continue
+                self._seq = record["seq"]
+                self._log_records += 1
+                self._apply(record)
+        if valid_size < self._log_path.stat().st_size:
+            _log.warning(f"Log '{self._log_path}' ends with a torn record, cut at {valid_size} bytes")
+            with open(self._log_path, "r+b") as f:
+                f.truncate(valid_size)
+        _log.debug(f"Log store '{self._dir}' opened, {self._log_records} log records replayed")
+
+    def _apply(self, record: LogRecord) -> None:
+        user_id = str(record["user_id"])
+        if record["op"] == "write":
+            changes = str(record["changes"])
+            self._apply_write(user_id, json.loads(changes), changes)
+        else:
+            self._apply_replay(user_id, undo=record["op"] == "undo")
+
+    def _put(self, user_id: str, key: str, row_dict: Optional[c.RowDictData]) -> None:
+        rows = self._rows.setdefault(user_id, {})
+        keys = self._keys.setdefault(user_id, [])
+        if row_dict is None:
+            if rows.pop(key, None) is not None:
+                del keys[bisect.bisect_left(keys, key)]
+            return
+        if key not in rows:
+            bisect.insort(keys, key)
+        rows[key] = [row_dict["times"], row_dict.get("day_type") or ""]
+
+    def _apply_write(self, user_id: str, changes: Sequence[JournalChange], changes_json: str) -> None:
+        for key, _, after in changes:
+            self._put(user_id, key, after)
+        journal = self._journals.setdefault(user_id, [])
+        del journal[self._cursors.get(user_id, 0):]
+        journal.append(changes_json)
+        if len(journal) > JOURNAL_KEEP_TXNS:
+            del journal[0]
+        self._cursors[user_id] = len(journal)
+
+    def _apply_replay(self, user_id: str, undo: bool) -> Optional[List[str]]:
+        journal = self._journals.get(user_id, [])
+        cursor = self._cursors.get(user_id, 0)
+        if undo and cursor > 0:
+            changes = [(key, after, before) for key, before, after in reversed(json.loads(journal[cursor - 1]))]
+            self._cursors[user_id] = cursor - 1
+        elif not undo and cursor < len(journal):
+            changes = json.loads(journal[cursor])
+            self._cursors[user_id] = cursor + 1
+        else:
+            return None
+        for key, _, row_dict in changes:
+            self._put(user_id, key, row_dict)
+        return [key for key, _, _ in changes]
+
+    def _refresh_stats(self, user_id: str, keys: Sequence[str]) -> None:
+        """Sketches the months of the changed keys again from their rows, if the user's months are sketched. A sketch
+        can't remove a value, so an edit rebuilds its month instead, which costs a month of rows at most"""
+        stats = self._stats.get(user_id)
+        if stats is None:
+            return
+        user_keys = self.keys(user_id)
+        rows = self.rows(user_id)
+        for month in {statistics.month_index(dt.date.fromordinal(int(key))) for key in keys}:
+            first, last = statistics.month_bounds(month)
+            start = bisect.bisect_left(user_keys, str(first.toordinal()))
+            end = bisect.bisect_right(user_keys, str(last.toordinal()))
+            digests = statistics.build_digests(c.WorkDay.from_db(key, *rows[key]) for key in user_keys[start:end])
+            if any(digests.values()):
+                stats[month] = digests
+            else:
+                stats.pop(month, None)
+
+    def _append(self, record: LogRecord) -> None:
+        self._seq += 1
+        record["seq"] = self._seq
+        offset = self._log_file.tell()
+        try:
+            self._log_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._log_file.flush()
+        except OSError:
+            # a record must not be followed by a torn one, recovery would stop there
+            self._log_file.truncate(offset)
+            self._seq -= 1
+            raise
+        self._unsynced += 1
+        if self._unsynced >= self._fsync_batch:
+            self.sync()
+
+    def _committed(self) -> None:
+        self._log_records += 1
+        if self._log_records >= self._compact_every:
+            self.compact()
+
+    def write(self, user_id: str, changes: List[JournalChange]) -> None:
+        """Commits changes of a user's rows as one journal transaction"""
+        if not changes:
+            return
+        changes_json = json.dumps(changes, separators=(",", ":"))
+        self._append(dict(user_id=user_id, op="write", changes=changes_json))
+        self._apply_write(user_id, changes, changes_json)
+        self._refresh_stats(user_id, [key for key, _, _ in changes])
+        self._committed()
+
+    def replay(self, user_id: str, undo: bool) -> Optional[List[str]]:
+        """Undoes the last journal transaction of a user or redoes the last undone one. Returns the affected keys,
+        None if there is nothing to replay"""
+        cursor = self._cursors.get(user_id, 0)
+        if (undo and cursor == 0) or (not undo and cursor == len(self._journals.get(user_id, []))):
+            return None
+        self._append(dict(user_id=user_id, op="undo" if undo else "redo"))
+        keys = self._apply_replay(user_id, undo)
+        self._refresh_stats(user_id, keys or [])
+        self._committed()
+        return keys
+
+    def rows(self, user_id: str) -> Dict[str, StoredValues]:
+        return self._rows.get(user_id, {})
+
+    def keys(self, user_id: str) -> List[str]:
+        """Sorted keys of a user's rows"""
+        return self._keys.get(user_id, [])
+
+    def users(self) -> List[str]:
+        return sorted(user_id for user_id, rows in self._rows.items() if rows)
+
+    def month_digests(self, user_id: str) -> MonthDigests:
+        """Month sketches of a user's rows, sketched from all of them on the first call only"""
+        stats = self._stats.get(user_id)
+        if stats is None:
+            stats = self._stats[user_id] = {}
+            self._refresh_stats(user_id, self.keys(user_id))
+        return stats
+
+    def sync(self) -> None:
+        """Makes every commit durable"""
+        if self._unsynced:
+            os.fsync(self._log_file.fileno())
+            self._unsynced = 0
+
+    def compact(self) -> None:
+        """Writes the state to a new snapshot and empties the log. The snapshot replaces the old one by a rename,
+        so a crash leaves either the old snapshot with the whole log, or the new one"""
+        self.sync()
+        snapshot = dict(
+            seq=self._seq,
+            rows=self._rows,
+            journals={
+                user_id: dict(txns=journal, cursor=self._cursors.get(user_id, 0))
+                for user_id, journal in self._journals.items()
+            },
+        )
+        temp_path = self._snapshot_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._snapshot_path)
+        _fsync_dir(self._dir)
+        self._log_file.seek(0)
+        self._log_file.truncate()
+        os.fsync(self._log_file.fileno())
+        _log.debug(f"Log store '{self._dir}' compacted, {self._log_records} log records folded into the snapshot")
+        self._log_records = 0
+
+    def close(self) -> None:
+        if self._log_file.closed:
+            return
+        self.sync()
+        self._log_file.close()
+        self._lock_file.close()
+
+
+class WorktimeLogDbInterface:
+    """Worktime table access on a 'LogStore', interchangeable with 'WorktimeSqliteDbInterface' for the app, import
+    and export. Every read and write is scoped to the 'user_id' the interface was created for"""
+
+    def __init__(self, store: LogStore, user_id: str = c.DEFAULT_USER_ID) -> None:
+        self._store = store
+        self._user_id = user_id
+
+    @property
+    def user_id(self) -> str:
+        return self._user_id
+
+    def _row(self, table: Type[m.Worktime], key: str, user_id: Optional[str] = None) -> m.Worktime:
+        times, day_type = self._store.rows(user_id or self._user_id)[key]
+        return table(user_id=user_id or self._user_id, date=key, times=times, day_type=day_type)
+
+    def _row_dict(self, key: str) -> c.RowDictData:
+        times, day_type = self._store.rows(self._user_id)[key]
+        return {"date": key, "times": times, "day_type": day_type}
+
+    def read(self, *, table: Type[m.Worktime], limit: Optional[int] = None) -> List[m.Worktime]:
+        keys = self._store.keys(self._user_id)
+        oldest = 0 if limit is None else max(len(keys) - limit, 0)
+        return [self._row(table, key) for key in reversed(keys[oldest:])]
+
+    def read_page(
+            self, *, table: Type[m.Worktime], before: Optional[str] = None, limit: int
+    ) -> List[m.Worktime]:
+        """Keyset page: the newest 'limit' rows with keys below 'before', newest first. The page is extended to the
+        first day of its oldest week, so consecutive pages never split a week"""
+        keys = self._store.keys(self._user_id)
+        end = bisect.bisect_left(keys, before) if before is not None else len(keys)
+        start = max(end - limit, 0)
+        if start == end:
+            return []
+        oldest = dt.date.fromordinal(int(keys[start]))
+        start = bisect.bisect_left(keys, str(oldest.toordinal() - oldest.weekday()), 0, start)
+        return [self._row(table, key) for key in reversed(keys[start:end])]
+
+    def find_in_db(self, *, table: Type[m.Worktime], key: str) -> Optional[List[m.Worktime]]:
+        return [self._row(table, key)] if key in self._store.rows(self._user_id) else None
+
+    def find_many_in_db(self, *, table: Type[m.Worktime], keys: List[str]) -> List[m.Worktime]:
+        rows = self._store.rows(self._user_id)
+        return [self._row(table, key) for key in dict.fromkeys(keys) if key in rows]
+
+    def existing_keys(self, keys: List[str], *, table: Type[m.Worktime]) -> List[str]:
+        rows = self._store.rows(self._user_id)
+        return [key for key in dict.fromkeys(keys) if key in rows]
+
+    def add(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        keys = [row_dict["date"] for row_dict in row_dicts]
+        existing = self.existing_keys(keys, table=table)
+        try:
+            if existing or len(set(keys)) != len(keys):
+                raise ValueError(f"Rows are stored already: {existing or keys}")
+            self._store.write(self._user_id, [(row_dict["date"], None, dict(row_dict)) for row_dict in row_dicts])
+        except Exception as e:
+            _log.exception("Failed to add to database")
+            raise DbInsertError from e
+
+    def update(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        rows = self._store.rows(self._user_id)
+        changes: List[JournalChange] = []
+        for row_dict in row_dicts:
+            key = row_dict["date"]
+            if key in rows:
+                before = self._row_dict(key)
+                changes.append((key, before, {**before, **row_dict}))
+        try:
+            self._store.write(self._user_id, changes)
+        except Exception as e:
+            _log.exception("Failed to update database rows")
+            raise DbInsertError from e
+
+    def delete(self, row_ids: List[str], *, table: Type[m.Worktime]) -> None:
+        try:
+            missing = set(row_ids) - set(self.existing_keys(row_ids, table=table))
+            if missing:
+                raise KeyError(f"Rows are not stored: {sorted(missing)}")
+            self._store.write(self._user_id, [(key, self._row_dict(key), None) for key in dict.fromkeys(row_ids)])
+        except Exception as e:
+            _log.exception("Failed to delete database rows")
+            raise DbRowDeleteError from e
+
+    def delete_where(
+            self,
+            *,
+            table: Type[m.Worktime],
+            start: Optional[str] = None,
+            end: Optional[str] = None,
+            day_types: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """Deletes the user's rows with keys in the [start, end] ordinal range and, if given, one of 'day_types'
+        ('' for a normal day). The rows go to one journal transaction, so one undo brings them back. Returns the
+        deleted keys"""
+        keys = self._store.keys(self._user_id)
+        first = bisect.bisect_left(keys, start) if start is not None else 0
+        last = bisect.bisect_right(keys, end) if end is not None else len(keys)
+        rows = self._store.rows(self._user_id)
+        deleted = [key for key in keys[first:last] if day_types is None or rows[key][1] in day_types]
+        try:
+            self._store.write(self._user_id, [(key, self._row_dict(key), None) for key in deleted])
+        except Exception as e:
+            _log.exception("Failed to delete database rows")
+            raise DbRowDeleteError from e
+        _log.debug(f"{len(deleted)} rows deleted, range: [{start}, {end}], day types: {day_types}")
+        return deleted
+
+    def write_to_db(self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime]) -> None:
+        self.upsert(row_dicts, table=table, replace=True)
+
+    def upsert(
+            self, row_dicts: List[c.RowDictData], *, table: Type[m.Worktime], replace: bool = False
+    ) -> Dict[str, c.RowDictData]:
+        """Writes rows as one journal transaction. A row whose key is already stored is combined with the stored one
+        through 'WorkDay.__add__', or replaces it if 'replace' is set. Returns the written rows as stored now, by key"""
+        pending = combine_rows(row_dicts, replace=replace)
+        stored = {key: self._row_dict(key) for key in self.existing_keys(list(pending), table=table)}
+        pending = merge_stored_rows(pending, stored, replace=replace)
+        try:
+            self._store.write(self._user_id, [(key, stored.get(key), row_dict) for key, row_dict in pending.items()])
+        except Exception as e:
+            _log.exception("Failed to upsert database rows")
+            raise DbInsertError from e
+        return pending
+
+    def punch(self, key: str, mark: str, *, table: Type[m.Worktime]) -> c.RowDictData:
+        """Appends the 'HH:MM' time 'mark' to the row of 'key', or adds the row, as one journal transaction. A mark
+        that doesn't follow the marks of a normal day is combined like 'upsert' does. Returns the stored row"""
+        stored = self._store.rows(self._user_id).get(key)
+        if stored is not None and (stored[1] or stored[0][-len(mark):] >= mark):
+            self.upsert([{"date": key, "times": mark, "day_type": ""}], table=table)
+            return self._row_dict(key)
+        before = self._row_dict(key) if stored is not None else None
+        after = {"date": key, "times": f"{stored[0]} {mark}".lstrip() if stored is not None else mark, "day_type": ""}
+        try:
+            self._store.write(self._user_id, [(key, before, after)])
+        except Exception as e:
+            _log.exception("Failed to punch the time")
+            raise DbInsertError from e
+        return after
+
+    def undo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        """Reverts the last journal transaction of the user. Returns the affected keys, None if nothing to undo"""
+        try:
+            return self._store.replay(self._user_id, undo=True)
+        except Exception as e:
+            _log.exception("Failed to undo the last change")
+            raise DbInsertError from e
+
+    def redo(self, *, table: Type[m.Worktime]) -> Optional[List[str]]:
+        """Reapplies the last undone journal transaction. Returns the affected keys, None if nothing to redo"""
+        try:
+            return self._store.replay(self._user_id, undo=False)
+        except Exception as e:
+            _log.exception("Failed to redo the last undone change")
+            raise DbInsertError from e
+
+    def external_changes(self) -> int:
+        """Always 0, a store is written by the process that opened it only"""
+        return 0
+
+    def for_user(self, user_id: str) -> "WorktimeLogDbInterface":
+        """An interface to the same store scoped to another user"""
+        return WorktimeLogDbInterface(self._store, user_id=user_id)
+
+    def iter_rows(
+            self, *, table: Type[m.Worktime], all_users: bool = False, batch_size: int = 1000, descending: bool = False
+    ) -> Iterator[List[WorktimeRow]]:
+        """Rows in (user_id, date) order, or the reverse of it, one batch at a time. The keys are taken at the start,
+        rows deleted meanwhile are skipped"""
+        user_ids = self._store.users() if all_users else [self._user_id]
+        keys = [(user_id, key) for user_id in user_ids for key in self._store.keys(user_id)]
+        if descending:
+            keys.reverse()
+        for batch_start in range(0, len(keys), batch_size):
+            batch: List[WorktimeRow] = []
+            for user_id, key in keys[batch_start : batch_start + batch_size]:
+                values = self._store.rows(user_id).get(key)
+                if values is not None:
+                    batch.append((user_id, key, values[0], values[1]))
+            if batch:
+                yield batch
+
+    def users(self, *, table: Type[m.Worktime]) -> List[str]:
+        return self._store.users()
+
+    def _user_rows(
+            self, user_id: str, start: Optional[str], end: Optional[str]
+    ) -> Iterator[Tuple[str, str, str]]:
+        keys = self._store.keys(user_id)
+        rows = self._store.rows(user_id)
+        first = bisect.bisect_left(keys, start) if start is not None else 0
+        last = bisect.bisect_right(keys, end) if end is not None else len(keys)
+        for key in keys[first:last]:
+            times, day_type = rows[key]
+            yield key, times, day_type
+
+    def team_totals(
+            self, *, table: Type[m.Worktime], start: Optional[str] = None, end: Optional[str] = None
+    ) -> TeamTotals:
+        """Sums WorkWeek summary fields per user over the [start, end] ordinal date range"""
+        summary_fields = c.WorkWeek.summary_fields
+        totals: TeamTotals = {}
+        try:
+            for user_id in self._store.users():
+                for date, times, day_type in self._user_rows(user_id, start, end):
+                    workday = c.WorkDay.from_values([date, times, day_type])
+                    user_totals = totals.setdefault(user_id, {name: dt.timedelta(0) for name in summary_fields})
+                    for name in summary_fields:
+                        user_totals[name] += getattr(workday, name)
+        except Exception as e:
+            _log.exception("Failed to aggregate team totals")
+            raise DbReadError from e
+        return totals
+
+    def month_stats(
+            self, *, start: Optional[int] = None, end: Optional[int] = None, all_users: bool = False
+    ) -> Dict[int, Dict[str, statistics.TDigest]]:
+        """Time metric sketches per 'statistics.month_index' in [start, end], merged over users if 'all_users'.
+        Copies of the sketches the store keeps per month"""
+        result: MonthDigests = {}
+        for user_id in self._store.users() if all_users else [self._user_id]:
+            for month, digests in self._store.month_digests(user_id).items():
+                if (start is None or month >= start) and (end is None or month <= end):
+                    result[month] = statistics.merge_digests([result.get(month, {}), digests])
+        return dict(sorted(result.items()))
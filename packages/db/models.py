@@ -1,14 +1,31 @@
+import datetime as dt
+import itertools
 import json
 import logging
+import random
+import sqlite3
+import time
 
-from sqlalchemy import Column, Text, create_engine
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, Connection, Integer, Select, Text, Index, Engine, column, create_engine, event, insert, inspect, literal,
+    select, table, text,
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import ConnectionPoolEntry
 from sqlalchemy.orm import DeclarativeBase
 
-from packages.constants import WorkDay, DEFAULT_DB_PATH
+from packages import statistics
+from packages.constants import WorkDay, DEFAULT_DB_PATH, DEFAULT_USER_ID
 
 _log = logging.getLogger(__name__)
 
 
+# columns holding worktime data, bookkeeping columns like 'version' are left out of serialized rows
+WORKTIME_DATA_COLUMNS = ("user_id", "date", "times", "day_type")
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -16,22 +33,222 @@ class Base(DeclarativeBase):
 # TODO: Learn about adding methods to the class. Like date to ordinal, response to str
 class Worktime(Base):
     __tablename__ = "worktime"
+    # rows are clustered by the composite (user_id, date) key, so per-user reads never touch another user's pages
+    __table_args__ = (
+        Index("ix_worktime_date_user", "date", "user_id", "times", "day_type"),
+        Index("ix_worktime_version", "version"),
+        {"sqlite_with_rowid": False},
+    )
+    user_id = Column(Text(64), primary_key=True, nullable=False, default=DEFAULT_USER_ID)
     date = Column(Text(8), primary_key=True, nullable=False)
     times = Column(Text(200), nullable=False)
     day_type = Column(Text(15), nullable=True)
+    # 'Replica.clock' value of the last change, lets sync find rows changed since a point
+    version = Column(Integer, nullable=False, default=0, server_default="0")
 
     def as_workday(self) -> WorkDay:
-        values = [getattr(self, c.name) for c in self.__table__.columns]
+        values = [getattr(self, name) for name in ("date", "times", "day_type")]
         return WorkDay.from_values(values)
 
     def as_json(self) -> str:
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data = {name: getattr(self, name) for name in WORKTIME_DATA_COLUMNS}
         return json.dumps({"table": {self.__tablename__: data}})
 
 
+class Journal(Base):
+    """Append-only log of worktime changes. 'before' and 'after' hold 'WorkDay.as_db()' values as json,
+    None stands for a missing row. Entries of one user action share the 'txn' number"""
+
+    __tablename__ = "journal"
+    __table_args__ = (Index("ix_journal_user_txn", "user_id", "txn"),)
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Text(64), nullable=False)
+    txn = Column(Integer, nullable=False)
+    date = Column(Text(8), nullable=False)
+    before = Column(Text, nullable=True)
+    after = Column(Text, nullable=True)
+
+
+class JournalCursor(Base):
+    """'txn' of the last applied journal transaction per user. Undo moves it back, redo forward"""
+
+    __tablename__ = "journal_cursor"
+    user_id = Column(Text(64), primary_key=True, nullable=False)
+    txn = Column(Integer, nullable=False)
+
+
+class WorktimeTombstone(Base):
+    """Deleted worktime keys with the 'Replica.clock' value of the deletion, so sync can pass deletes on"""
+
+    __tablename__ = "worktime_tombstone"
+    __table_args__ = (Index("ix_worktime_tombstone_version", "version"),)
+    user_id = Column(Text(64), primary_key=True, nullable=False)
+    date = Column(Text(8), primary_key=True, nullable=False)
+    version = Column(Integer, nullable=False)
+
+
+class Replica(Base):
+    """The only row identifies the database file for sync and holds its change counter"""
+
+    __tablename__ = "replica"
+    replica_id = Column(Text(32), primary_key=True, nullable=False)
+    clock = Column(Integer, nullable=False)
+
+
+class SyncPeer(Base):
+    """Own 'Replica.clock' value at the end of the last sync with a peer database"""
+
+    __tablename__ = "sync_peer"
+    peer_id = Column(Text(32), primary_key=True, nullable=False)
+    version = Column(Integer, nullable=False)
+
+
+class WorktimeStats(Base):
+    """Quantile sketches ('packages.statistics.TDigest' as json) of a user's month, one per time metric.
+    Kept up to date by every write, so periods and users are summarized by merging instead of a table scan"""
+
+    __tablename__ = "worktime_stats"
+    user_id = Column(Text(64), primary_key=True, nullable=False)
+    # 'packages.statistics.month_index' of the month
+    month = Column(Integer, primary_key=True, nullable=False)
+    metric = Column(Text(16), primary_key=True, nullable=False)
+    digest = Column(Text, nullable=False)
+
+
+def _migrate_single_user_table(engine: Engine) -> None:
+    """Moves rows of a pre-'user_id' worktime table to the default user"""
+    columns = [column["name"] for column in inspect(engine).get_columns(Worktime.__tablename__)]
+    if "user_id" in columns:
+        return
+    _log.warning(f"Migrating '{Worktime.__tablename__}' table to per-user layout, user: '{DEFAULT_USER_ID}'")
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE worktime RENAME TO worktime_single_user"))
+        Worktime.__table__.create(connection)  # type: ignore[attr-defined]
+        connection.execute(
+            text(
+                "INSERT INTO worktime (user_id, date, times, day_type) "
+                "SELECT :user_id, date, times, day_type FROM worktime_single_user"
+            ),
+            {"user_id": DEFAULT_USER_ID},
+        )
+        connection.execute(text("DROP TABLE worktime_single_user"))
+
+
+def stored_worktime_rows(engine: Engine) -> "Select[Tuple[str, str, str, Optional[str]]]":
+    """(user_id, date, times, day_type) of every row in the layout the file has, rows of a pre-'user_id' table are
+    the default user's. Reads a database without migrating it"""
+    columns = [column["name"] for column in inspect(engine).get_columns(Worktime.__tablename__)]
+    if "user_id" in columns:
+        return select(Worktime.user_id, Worktime.date, Worktime.times, Worktime.day_type)
+    single_user = table(Worktime.__tablename__, column("date", Text), column("times", Text), column("day_type", Text))
+    return select(
+        literal(DEFAULT_USER_ID, Text).label("user_id"),
+        single_user.c.date,
+        single_user.c.times,
+        single_user.c.day_type,
+    )
+
+
+def _add_version_column(engine: Engine) -> None:
+    columns = [column["name"] for column in inspect(engine).get_columns(Worktime.__tablename__)]
+    if "version" in columns:
+        return
+    _log.warning(f"Adding change 'version' column to '{Worktime.__tablename__}' table")
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE worktime ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        connection.execute(text("CREATE INDEX ix_worktime_version ON worktime (version)"))
+
+
+def _build_stats(engine: Engine) -> None:
+    """Sketches the months of a database that was written before 'worktime_stats' existed"""
+    _log.warning(f"Building '{WorktimeStats.__tablename__}' table from the stored rows")
+    stats: List[Dict[str, object]] = []
+    with engine.begin() as connection:
+        rows = connection.execute(
+            select(Worktime.user_id, Worktime.date, Worktime.times, Worktime.day_type).order_by(
+                Worktime.user_id, Worktime.date
+            )
+        )
+        month_rows = itertools.groupby(
+            rows, key=lambda row: (row[0], statistics.month_index(dt.date.fromordinal(int(row[1]))))
+        )
+        for (user_id, month), group in month_rows:
+            workdays = [WorkDay.from_values([date, times, day_type or ""]) for _, date, times, day_type in group]
+            for metric, digest in statistics.build_digests(workdays).items():
+                stats.append(dict(user_id=user_id, month=month, metric=metric, digest=digest.to_json()))
+        if stats:
+            connection.execute(insert(WorktimeStats), stats)
+
+
+def init_db(engine: Engine) -> None:
+    """Creates missing tables and brings an existing database to the current layout"""
+    has_worktime = inspect(engine).has_table(Worktime.__tablename__)
+    build_stats = has_worktime and not inspect(engine).has_table(WorktimeStats.__tablename__)
+    if has_worktime:
+        _migrate_single_user_table(engine)
+        _add_version_column(engine)
+    Base.metadata.create_all(engine)
+    if build_stats:
+        _build_stats(engine)
+
+
+# milliseconds a connection waits for a locked database file before the statement fails
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+# connection execution option, transactions of such connections take the write lock at BEGIN
+BEGIN_IMMEDIATE_OPTION = "sqlite_begin_immediate"
+# attempts to take the write lock after the busy timeout ran out, and the first backoff in seconds
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+
+def _begin_transaction(connection: Connection) -> None:
+    """A write transaction takes the lock before it reads anything, so when the lock can't be had the BEGIN alone
+    is retried, with exponential backoff and jitter, and no stale read can leak into the write"""
+    if not connection.get_execution_options().get(BEGIN_IMMEDIATE_OPTION, False):
+        connection.exec_driver_sql("BEGIN")
+        return
+    for attempt in range(1, LOCK_RETRIES + 1):
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        except OperationalError as e:
+            if attempt == LOCK_RETRIES or "locked" not in str(e):
+                raise
+            delay = LOCK_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            _log.warning(f"Database is locked, write attempt {attempt} is retried in {delay:.2f} s")
+            time.sleep(delay)
+
+
+def enable_concurrent_access(engine: Engine, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> None:
+    """Prepares an engine for several processes sharing one database file. The WAL journal lets readers go on
+    while another process writes, a busy timeout makes a locked file wait instead of fail, and transactions are
+    begun by the engine instead of the driver, so write sessions can take the lock up front"""
+    if event.contains(engine, "begin", _begin_transaction):
+        return
+
+    def on_connect(dbapi_connection: sqlite3.Connection, connection_record: ConnectionPoolEntry) -> None:
+        # the driver must not open transactions on its own, BEGIN comes from '_begin_transaction'
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        dbapi_connection.execute("PRAGMA journal_mode = WAL")
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "begin", _begin_transaction)
+
+
+def create_sqlite_engine(db_path: str, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> Engine:
+    engine = create_engine(f"sqlite:///{db_path}")
+    enable_concurrent_access(engine, busy_timeout_ms)
+    return engine
+
+
+def create_read_only_engine(db_path: str) -> Engine:
+    """Engine that can't change the file, or create it if it's missing"""
+    return create_engine(f"sqlite:///file:{db_path}?mode=ro&uri=true")
+
+
 # TODO: add sqlalchemy echo to the settings window
-sqlite_engine = create_engine(f"sqlite:///{DEFAULT_DB_PATH}")  # , echo=True)
-Base.metadata.create_all(sqlite_engine)
+sqlite_engine = create_sqlite_engine(DEFAULT_DB_PATH)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import datetime as dt
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, TypeVar
+
+from dataclasses import dataclass, field
+
+from packages import statistics
+from packages.constants import DEFAULT_USER_ID, WorkDay, WorkWeek
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime, create_read_only_engine
+
+_log = logging.getLogger(__name__)
+
+DATABASE_PATTERN = "*.db"
+ROLLUP_BATCH_SIZE = 10000
+DURATIONS_CACHE_SIZE = 65536
+# days, then seconds of each of 'WorkWeek.summary_fields'
+Totals = List[int]
+# (member, period) -> totals. A week is keyed by the ordinal of its monday, a month by 'statistics.month_index'
+PeriodTotals = Dict[Tuple[str, int], Totals]
+
+K = TypeVar("K", bound=Hashable)
+
+
+@lru_cache(maxsize=DURATIONS_CACHE_SIZE)
+def _durations(times: str, day_type: str) -> Tuple[int, ...]:
+    """Seconds of the summary fields of a day, cached by its stored values"""
+    durations = WorkDay.from_db(str(dt.date.min.toordinal()), times, day_type).durations()
+    return tuple(int(durations[name].total_seconds()) for name in WorkWeek.summary_fields)
+
+
+def _add(period_totals: Dict[K, Totals], key: K, totals: Sequence[int]) -> None:
+    stored = period_totals.get(key)
+    if stored is None:
+        period_totals[key] = list(totals)
+        return
+    for i, value in enumerate(totals):
+        stored[i] += value
+
+
+def _week_label(monday: int) -> str:
+    year, week, _ = dt.date.fromordinal(monday).isocalendar()
+    return f"{year}-W{week:02}"
+
+
+def _month_label(month: int) -> str:
+    first, _ = statistics.month_bounds(month)
+    return f"{first:%Y-%m}"
+
+
+def _as_fields(totals: Totals) -> Dict[str, int]:
+    """Day count and the summary fields in minutes"""
+    minutes = {name: seconds // 60 for name, seconds in zip(WorkWeek.summary_fields, totals[1:])}
+    return dict(days=totals[0], **minutes)
+
+
+@dataclass
+class TeamRollup:
+    databases: int = 0
+    rows: int = 0
+    weeks: PeriodTotals = field(default_factory=dict)
+    months: PeriodTotals = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def merge(self, other: "TeamRollup") -> None:
+        self.databases += other.databases
+        self.rows += other.rows
+        for key, totals in other.weeks.items():
+            _add(self.weeks, key, totals)
+        for key, totals in other.months.items():
+            _add(self.months, key, totals)
+        self.errors.update(other.errors)
+
+    def as_dict(self) -> Dict[str, object]:
+        members: Dict[str, Dict[str, Dict[str, Dict[str, int]]]] = {}
+        team: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for name, period_totals, label in (("weeks", self.weeks, _week_label), ("months", self.months, _month_label)):
+            team_totals: PeriodTotals = {}
+            for (member, period), totals in sorted(period_totals.items()):
+                members.setdefault(member, {}).setdefault(name, {})[label(period)] = _as_fields(totals)
+                _add(team_totals, ("", period), totals)
+            team[name] = {label(period): _as_fields(totals) for (_, period), totals in sorted(team_totals.items())}
+        return dict(
+            databases=self.databases,
+            rows=self.rows,
+            errors=dict(sorted(self.errors.items())),
+            team=team,
+            members=members,
+        )
+
+
+def rollup_database(db_path: str, name: str) -> TeamRollup:
+    """Week and month totals of every user of a database, the default user's rows counted for 'name'"""
+    rollup = TeamRollup(databases=1)
+    # totals by (member, week, month), a week that spans two months has a part in each. Rows are added up once,
+    # weeks and months are then folded from the far fewer parts
+    parts: Dict[Tuple[str, int, int], Totals] = {}
+    engine = create_read_only_engine(db_path)
+    try:
+        db_if = WorktimeSqliteDbInterface(engine, read_only=True)
+        for batch in db_if.iter_rows(table=Worktime, all_users=True, batch_size=ROLLUP_BATCH_SIZE):
+            rollup.rows += len(batch)
+            for user_id, date, times, day_type in batch:
+                member = name if user_id == DEFAULT_USER_ID else user_id
+                ordinal = int(date)
+                month = statistics.month_index(dt.date.fromordinal(ordinal))
+                _add(parts, (member, ordinal - (ordinal + 6) % 7, month), (1, *_durations(times, day_type)))
+        for (member, monday, month), totals in parts.items():
+            _add(rollup.weeks, (member, monday), totals)
+            _add(rollup.months, (member, month), totals)
+    except Exception as e:
+        _log.exception(f"Failed to roll up '{db_path}'")
+        error: BaseException = e
+        while error.__cause__ is not None:
+            error = error.__cause__
+        rollup = TeamRollup(databases=1, errors={db_path: f"{type(error).__name__}: {error}"})
+    finally:
+        engine.dispose()
+    return rollup
+
+
+def rollup_directory(
+        directory: str, *, pattern: str = DATABASE_PATTERN, workers: Optional[int] = None
+) -> Dict[str, object]:
+    """Merges the totals of every database under 'directory' into one team report with a process pool, one task
+    per file. Returns a json-serializable report, durations are in minutes"""
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    root = Path(directory)
+    paths = sorted(path for path in root.rglob(pattern) if path.is_file())
+    db_paths = [str(path) for path in paths]
+    names = [path.relative_to(root).with_suffix("").as_posix() for path in paths]
+    rollup = TeamRollup()
+    if workers == 1:
+        for db_path, name in zip(db_paths, names):
+            rollup.merge(rollup_database(db_path, name))
+    else:
+        chunk_size = max(len(db_paths) // (workers * 4), 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(rollup_database, db_paths, names, chunksize=chunk_size):
+                rollup.merge(result)
+    seconds = time.perf_counter() - started
+    _log.debug(f"Rolled up {rollup.rows} rows of {rollup.databases} databases in {seconds:.3f}s")
+    return dict(rollup.as_dict(), seconds=round(seconds, 3))
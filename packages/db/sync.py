@@ -0,0 +1,89 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dataclasses import dataclass
+
+from packages.constants import WorkDay, DayType, RowDictData
+from packages.db.database_interface import WorktimeSqliteDbInterface, SyncRow
+from packages.db.models import Worktime
+
+_log = logging.getLogger(__name__)
+
+# the winner of a conflict between day types, most important first. A normal day never beats a typed one
+SYNC_DAY_TYPE_PRIORITY = (DayType.SICK, DayType.VACATION, DayType.HOLIDAY, DayType.DAY_OFF, DayType.NORMAL)
+
+SyncChanges = Dict[Tuple[str, str], SyncRow]
+
+
+@dataclass
+class SyncResult:
+    sent: int = 0
+    received: int = 0
+    conflicts: int = 0
+
+
+def resolve_conflict(local: SyncRow, remote: SyncRow) -> SyncRow:
+    """Deterministic merge of a key changed on both sides: the result does not depend on the sync direction"""
+    if local is None or remote is None:
+        # an edit wins over a delete, so no entered data gets lost
+        return local if remote is None else remote
+    local_workday, remote_workday = WorkDay.from_db(**local), WorkDay.from_db(**remote)
+    if local_workday.day_type == remote_workday.day_type == DayType.NORMAL:
+        return (local_workday + remote_workday).as_db()
+    if local_workday.day_type == remote_workday.day_type:
+        return local if local_workday.times <= remote_workday.times else remote
+    priority = SYNC_DAY_TYPE_PRIORITY.index
+    return local if priority(local_workday.day_type) < priority(remote_workday.day_type) else remote
+
+
+def _apply(db_if: WorktimeSqliteDbInterface, changes: SyncChanges) -> None:
+    users: Dict[str, Tuple[List[RowDictData], List[str]]] = {}
+    for (user_id, key), row_dict in changes.items():
+        written, deleted = users.setdefault(user_id, ([], []))
+        if row_dict is None:
+            deleted.append(key)
+        else:
+            written.append(row_dict)
+    for user_id, (written, deleted) in users.items():
+        user_if = db_if.for_user(user_id)
+        if written:
+            user_if.upsert(written, table=Worktime, replace=True)
+        existing = user_if.existing_keys(deleted, table=Worktime) if deleted else []
+        if existing:
+            user_if.delete(existing, table=Worktime)
+
+
+def sync_databases(local: WorktimeSqliteDbInterface, remote: WorktimeSqliteDbInterface) -> SyncResult:
+    """Exchanges rows changed on either side since the previous sync of the two databases"""
+    local_id, remote_id = local.replica_id(), remote.replica_id()
+    local_changes = local.changes_since(local.sync_point(remote_id), table=Worktime)
+    remote_changes = remote.changes_since(remote.sync_point(local_id), table=Worktime)
+
+    to_local: SyncChanges = {}
+    to_remote: SyncChanges = {}
+    result = SyncResult()
+    for key in local_changes.keys() | remote_changes.keys():
+        if key not in remote_changes:
+            to_remote[key] = local_changes[key]
+            continue
+        if key not in local_changes:
+            to_local[key] = remote_changes[key]
+            continue
+        local_row, remote_row = local_changes[key], remote_changes[key]
+        if local_row == remote_row:
+            continue
+        result.conflicts += 1
+        merged: Optional[RowDictData] = resolve_conflict(local_row, remote_row)
+        if merged != local_row:
+            to_local[key] = merged
+        if merged != remote_row:
+            to_remote[key] = merged
+
+    _apply(local, to_local)
+    _apply(remote, to_remote)
+    # the applied rows got new versions on each side, moving the sync points past them avoids echoing them back
+    local.set_sync_point(remote_id, local.clock())
+    remote.set_sync_point(local_id, remote.clock())
+    result.sent, result.received = len(to_remote), len(to_local)
+    _log.info(f"Sync done: {result.sent} rows sent, {result.received} received, {result.conflicts} conflicts")
+    return result
@@ -0,0 +1,185 @@
+import datetime as dt
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dataclasses import dataclass, field
+from sqlalchemy import func, inspect, select
+
+from packages.constants import DAY_TYPE_PARAMS, DayType, TIME_STRING_MASK
+from packages.db.models import Worktime, create_read_only_engine, stored_worktime_rows
+from packages.utils.utils import time_to_str
+
+_log = logging.getLogger(__name__)
+
+# issues kept per database with their rows, the rest are only counted
+MAX_ISSUE_SAMPLES = 100
+MIN_CHUNK_ROWS = 50000
+TIMES_CACHE_SIZE = 65536
+SCAN_BATCH_SIZE = 10000
+# (rows scanned, issue counts by kind, issue samples)
+ScanResult = Tuple[int, Dict[str, int], List["Issue"]]
+# [start, end) date ordinals, None for no bound
+ScanRange = Tuple[Optional[int], Optional[int]]
+
+# time marks of the day types that have predefined ones, as stored
+_DAY_TYPE_TIMES = {params.name.value: time_to_str(params.times, TIME_STRING_MASK) for params in DAY_TYPE_PARAMS}
+_MIN_ORDINAL = dt.date(1900, 1, 1).toordinal()
+_MAX_ORDINAL = dt.date(2200, 1, 1).toordinal()
+# space separated HH:MM marks, as 'WorkDay.as_db' stores them
+_TIMES_PATTERN = re.compile(r"(?:[01]\d|2[0-3]):[0-5]\d(?: (?:[01]\d|2[0-3]):[0-5]\d)*|")
+
+
+@dataclass(frozen=True)
+class Issue:
+    user_id: str
+    date: str
+    kind: str
+    detail: str
+
+
+@dataclass
+class DatabaseReport:
+    path: str
+    rows: int = 0
+    issues: Dict[str, int] = field(default_factory=dict)
+    samples: List[Issue] = field(default_factory=list)
+
+    def add(self, result: ScanResult) -> None:
+        rows, issues, samples = result
+        self.rows += rows
+        for kind, count in issues.items():
+            self.issues[kind] = self.issues.get(kind, 0) + count
+        self.samples.extend(samples[: MAX_ISSUE_SAMPLES - len(self.samples)])
+
+    def as_dict(self) -> Dict[str, object]:
+        return dict(
+            path=self.path,
+            rows=self.rows,
+            issues=dict(sorted(self.issues.items())),
+            samples=[sample.__dict__ for sample in self.samples],
+        )
+
+
+def _is_date_key(date: str) -> bool:
+    return date.isdigit() and _MIN_ORDINAL <= int(date) < _MAX_ORDINAL
+
+
+def check_row(date: str, times: str, day_type: Optional[str]) -> List[Tuple[str, str]]:
+    """Problems of a stored row as (kind, detail) pairs"""
+    problems: List[Tuple[str, str]] = []
+    if not _is_date_key(date):
+        problems.append(("bad_date", date))
+    problems.extend(_check_times(times, day_type or ""))
+    return problems
+
+
+@lru_cache(maxsize=TIMES_CACHE_SIZE)
+def _check_times(times: str, day_type: str) -> Tuple[Tuple[str, str], ...]:
+    """Checks of the time marks and day type, on the strings as stored"""
+    marks = times.split()
+    if _TIMES_PATTERN.fullmatch(times) is None:
+        return (("bad_time_mark", times),)
+    if any(marks[i] >= marks[i + 1] for i in range(len(marks) - 1)):
+        return (("unsorted_time_marks", times),)
+    if day_type not in _DAY_TYPE_TIMES:
+        return (("unknown_day_type", day_type),)
+    if day_type == DayType.NORMAL.value:
+        if not marks:
+            return (("no_time_marks", times),)
+        if len(marks) % 2:
+            return (("odd_time_marks", times),)
+    elif times != _DAY_TYPE_TIMES[day_type]:
+        return (("day_type_time_marks", f"{day_type}: {times}"),)
+    return ()
+
+
+def scan_range(db_path: str, start: Optional[int], end: Optional[int]) -> ScanResult:
+    """Checks rows with date ordinals in [start, end), read through the covering date index"""
+    rows = 0
+    issues: Dict[str, int] = {}
+    samples: List[Issue] = []
+    engine = create_read_only_engine(db_path)
+    try:
+        stmt = stored_worktime_rows(engine)
+        if start is not None:
+            stmt = stmt.where(stmt.selected_columns.date >= str(start))
+        if end is not None:
+            stmt = stmt.where(stmt.selected_columns.date < str(end))
+        with engine.connect() as connection:
+            result = connection.execution_options(yield_per=SCAN_BATCH_SIZE).execute(stmt)
+            for partition in result.partitions():
+                rows += len(partition)
+                for user_id, date, times, day_type in partition:
+                    if not _check_times(times, day_type or "") and _is_date_key(date):
+                        continue
+                    for kind, detail in check_row(date, times, day_type):
+                        issues[kind] = issues.get(kind, 0) + 1
+                        if len(samples) < MAX_ISSUE_SAMPLES:
+                            samples.append(Issue(user_id, date, kind, detail))
+    finally:
+        engine.dispose()
+    return rows, issues, samples
+
+
+def _chunks(db_path: str, workers: int) -> Tuple[List[ScanRange], Optional[str]]:
+    """Ordinal ranges covering every row, a few per worker so that a slow chunk doesn't keep the others idle.
+    Returns an error message instead for a database that can't be read"""
+    engine = create_read_only_engine(db_path)
+    try:
+        if not inspect(engine).has_table(Worktime.__tablename__):
+            return [], f"no '{Worktime.__tablename__}' table"
+        with engine.connect() as connection:
+            count, first, last = connection.execute(
+                select(func.count(), func.min(Worktime.date), func.max(Worktime.date))
+            ).one()
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+    finally:
+        engine.dispose()
+    if not count:
+        return [], None
+    if not (str(first).isdigit() and str(last).isdigit()) or len(str(first)) != len(str(last)):
+        # keys are compared as strings, ordinal bounds only split keys of one length correctly
+        return [(None, None)], None
+    chunks = max(workers * 4, count // MIN_CHUNK_ROWS, 1)
+    low, high = int(first), int(last) + 1
+    step = max((high - low) // chunks + 1, 1)
+    bounds: List[Optional[int]] = [None, *range(low + step, high, step), None]
+    return list(zip(bounds, bounds[1:])), None
+
+
+def verify_databases(db_paths: Sequence[str], *, workers: Optional[int] = None) -> Dict[str, object]:
+    """Checks every row of the databases with a process pool, returns a json-serializable report"""
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    reports = {db_path: DatabaseReport(db_path) for db_path in db_paths}
+    tasks: List[Tuple[str, Optional[int], Optional[int]]] = []
+    for db_path in db_paths:
+        chunks, error = _chunks(db_path, workers)
+        if error is not None:
+            reports[db_path].issues["unreadable"] = 1
+            reports[db_path].samples.append(Issue("", "", "unreadable", error))
+        tasks.extend((db_path, start, end) for start, end in chunks)
+    if workers == 1:
+        for db_path, start, end in tasks:
+            reports[db_path].add(scan_range(db_path, start, end))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(db_path, pool.submit(scan_range, db_path, start, end)) for db_path, start, end in tasks]
+            for db_path, future in futures:
+                reports[db_path].add(future.result())
+    rows = sum(report.rows for report in reports.values())
+    issues = sum(sum(report.issues.values()) for report in reports.values())
+    seconds = time.perf_counter() - started
+    _log.debug(f"Verified {rows} rows of {len(db_paths)} databases in {seconds:.3f}s, {issues} issues")
+    return dict(
+        rows=rows,
+        issues=issues,
+        seconds=round(seconds, 3),
+        databases=[report.as_dict() for report in reports.values()],
+    )
@@ -0,0 +1,104 @@
+import logging
+import string
+from typing import Dict, List, Sequence
+
+from packages.constants import DayType
+
+_log = logging.getLogger(__name__)
+
+DIGITS = string.digits
+DATE_SHAPE = ["d", "d", ".", "d", "d", ".", "d", "d", "d", "d"]
+TIME_SHAPE = ["d", "d", ":", "d", "d"]
+MAX_TIME_MARKS = 5
+
+Transitions = Dict[str, int]
+
+
+class InputValidator:
+    """Prefix automaton of the input grammar, built once:
+
+    <date>[-<date>][,<date>[-<date>]]... followed by up to MAX_TIME_MARKS " HH:MM" marks or " <day type>".
+
+    Every state can still be completed to a full input, so a value is a valid prefix if the automaton does not
+    get stuck on it. The states of the last validated value are kept, so typing at the end of the input costs
+    one transition per keystroke"""
+
+    def __init__(self, day_types: Sequence[DayType] = tuple(DayType)) -> None:
+        self._transitions: List[Transitions] = [{}]
+        self._build([day_type.value for day_type in day_types if day_type.value])
+        self._value = ""
+        self._path = [0]
+
+    def _new_state(self) -> int:
+        self._transitions.append({})
+        return len(self._transitions) - 1
+
+    def _add_chain(self, state: int, shape: Sequence[str]) -> int:
+        """Adds the states of a fixed shape ("d" is any digit) after 'state', returns the last one"""
+        for item in shape:
+            next_state = self._new_state()
+            for char in DIGITS if item == "d" else item:
+                self._transitions[state][char] = next_state
+            state = next_state
+        return state
+
+    def _add_word(self, state: int, word: str) -> None:
+        """Adds a word as a trie branch, so day types sharing a beginning share its states"""
+        for char in word:
+            next_state = self._transitions[state].get(char)
+            if next_state is None:
+                next_state = self._new_state()
+                self._transitions[state][char] = next_state
+            state = next_state
+
+    def _build(self, day_type_words: List[str]) -> None:
+        date_start = 0
+        date_end = self._add_chain(date_start, DATE_SHAPE)
+        range_end = self._add_chain(self._add_chain(date_end, "-"), DATE_SHAPE)
+        for state in (date_end, range_end):
+            self._transitions[state][","] = date_start
+        after_date = self._new_state()
+        for state in (date_end, range_end):
+            self._transitions[state][" "] = after_date
+
+        state = after_date
+        for i in range(MAX_TIME_MARKS):
+            state = self._add_chain(state, TIME_SHAPE)
+            if i < MAX_TIME_MARKS - 1:
+                state = self._add_chain(state, " ")
+        for word in day_type_words:
+            self._add_word(after_date, word)
+
+    def is_valid_prefix(self, value: str) -> bool:
+        common = 0
+        if value.startswith(self._value):
+            common = len(self._value)
+        else:
+            for common, (old_char, new_char) in enumerate(zip(self._value, value)):
+                if old_char != new_char:
+                    break
+            else:
+                common = min(len(self._value), len(value))
+        del self._path[common + 1:]
+
+        transitions = self._transitions
+        path = self._path
+        state = path[-1]
+        for char in value[common:]:
+            next_state = transitions[state].get(char)
+            if next_state is None:
+                self._value = value[: len(path) - 1]
+                return False
+            state = next_state
+            path.append(state)
+        self._value = value
+        return True
+
+    def validate(self, full_value: str, current: str, d_status: str, ind: str) -> bool:
+        """Entry validation command: only the value up to the changed position is checked"""
+        if not full_value or d_status == "0":
+            return True
+        if self.is_valid_prefix(full_value[: int(ind) + 1]):
+            return True
+        _log.warning(f'Wrong input value: "{current}" in "{full_value}"')
+        return False
@@ -0,0 +1,169 @@
+import datetime as dt
+import json
+import logging
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from packages.constants import WorkDay, DayType
+
+_log = logging.getLogger(__name__)
+
+# sketched values of a normal workday, in minutes: first and last time mark and the pauses in between
+TIME_METRICS = ("arrival", "departure", "pauses")
+DEFAULT_COMPRESSION = 100
+# values buffered before they are merged into the centroids
+BUFFER_SIZE = 500
+
+# (mean, weight)
+Centroid = Tuple[float, float]
+
+
+class TDigest:
+    """Merging t-digest (Dunning, Ertl) of a stream of values: a sorted list of centroids, small near the tails
+    and larger in the middle, so extreme quantiles stay accurate with O(compression) memory. Digests of
+    disjoint streams merge into the digest of the whole stream, which is how months roll up into years and
+    users into a team"""
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION) -> None:
+        self.compression = compression
+        self._centroids: List[Centroid] = []
+        self._buffer: List[Centroid] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self) -> int:
+        return int(self.count)
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= BUFFER_SIZE:
+            self._compress()
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """Adds the values of another digest to this one, returns self"""
+        other._compress()
+        self._buffer.extend(other._centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _scale(self, q: float) -> float:
+        """k1 scale function, a centroid may span at most one unit of it"""
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self) -> None:
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        centroids: List[Centroid] = []
+        mean, weight = points[0]
+        seen = 0.0
+        k_low = self._scale(0.0)
+        for point_mean, point_weight in points[1:]:
+            if self._scale((seen + weight + point_weight) / self.count) - k_low <= 1:
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+                continue
+            centroids.append((mean, weight))
+            seen += weight
+            k_low = self._scale(seen / self.count)
+            mean, weight = point_mean, point_weight
+        centroids.append((mean, weight))
+        self._centroids = centroids
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated value at quantile 'q' in [0, 1], None for an empty digest"""
+        self._compress()
+        if not self._centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        target = q * self.count
+        # centroid means are placed at the middle of their weight, the extremes at the ends of the range
+        previous_position, previous_mean = 0.0, self.min
+        position = 0.0
+        for mean, weight in self._centroids:
+            center = position + weight / 2
+            if target < center:
+                if center == previous_position:
+                    return mean
+                part = (target - previous_position) / (center - previous_position)
+                return previous_mean + part * (mean - previous_mean)
+            previous_position, previous_mean = center, mean
+            position += weight
+        if self.count == previous_position:
+            return self.max
+        part = (target - previous_position) / (self.count - previous_position)
+        return previous_mean + part * (self.max - previous_mean)
+
+    def to_json(self) -> str:
+        self._compress()
+        return json.dumps(dict(compression=self.compression, min=self.min, max=self.max, centroids=self._centroids))
+
+    @classmethod
+    def from_json(cls, value: str) -> "TDigest":
+        data = json.loads(value)
+        digest = TDigest(int(data["compression"]))
+        digest._centroids = [(float(mean), float(weight)) for mean, weight in data["centroids"]]
+        digest.count = sum(weight for _, weight in digest._centroids)
+        digest.min, digest.max = float(data["min"]), float(data["max"])
+        return digest
+
+
+def month_index(date: dt.date) -> int:
+    """Months counted from year 0, so periods are integer ranges"""
+    return date.year * 12 + date.month - 1
+
+
+def month_bounds(index: int) -> Tuple[dt.date, dt.date]:
+    first = dt.date(index // 12, index % 12 + 1, 1)
+    return first, (first + dt.timedelta(days=31)).replace(day=1) - dt.timedelta(days=1)
+
+
+def _minutes(value: dt.time) -> float:
+    return value.hour * 60 + value.minute + value.second / 60
+
+
+def time_metrics(workday: WorkDay) -> Optional[Dict[str, float]]:
+    """Sketched values of a day, None for days without own time marks like vacations"""
+    if workday.day_type != DayType.NORMAL or len(workday.times) < 2:
+        return None
+    return dict(
+        arrival=_minutes(workday.times[0]),
+        departure=_minutes(workday.times[-1]),
+        pauses=workday.pauses.total_seconds() / 60,
+    )
+
+
+def build_digests(workdays: Iterable[WorkDay]) -> Dict[str, TDigest]:
+    digests = {metric: TDigest() for metric in TIME_METRICS}
+    for workday in workdays:
+        metrics = time_metrics(workday)
+        if metrics is not None:
+            for metric, value in metrics.items():
+                digests[metric].add(value)
+    return digests
+
+
+def merge_digests(digests: Iterable[Dict[str, TDigest]]) -> Dict[str, TDigest]:
+    merged = {metric: TDigest() for metric in TIME_METRICS}
+    for period_digests in digests:
+        for metric, digest in period_digests.items():
+            merged[metric].merge(digest)
+    return merged
+
+
+def format_minutes(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    minutes = int(round(value))
+    return f"{minutes // 60:02}:{minutes % 60:02}"
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from packages.commands import CommandQueue
+from packages.ui.ui import DEFAULT_INPUT_VALUE, TableDiff, TableModel, UserInterface, prepare_table_items
+
+if TYPE_CHECKING:
+    import tkinter as tk
+    from tkinter import ttk
+    from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set
+    from packages.commands import Command
+    from packages.constants import WorkDay
+
+_log = logging.getLogger("ui")
+
+TABLE_COLUMNS = ("date", "worktime", "pauses", "overtime", "time_marks", "day_type")
+
+
+class NullUserInterface(UserInterface):
+    """In-memory UI for headless runs: records the calls App makes and keeps the main table contents the way
+    the Treeview would hold them. Commands are queued with put_command and handed to App by dispatch_commands"""
+
+    def __init__(self, columns: Sequence[str] = TABLE_COLUMNS) -> None:
+        self.calls: List[str] = []
+        self.input_value: Optional[str] = None
+        self.focused: Optional[str] = None
+        self._columns = tuple(columns)
+        self.table = TableModel()
+        # changes of the last refresh of a shown table
+        self.last_diff: Optional[TableDiff] = None
+        self._commands = CommandQueue()
+        self._command_handler: Optional[Callable[[List[Command]], None]] = None
+        self._input_validator: Optional[Callable[[str, str, str, str], bool]] = None
+
+    def fill_main_table(
+            self, weeks_workdays: List[List[WorkDay]], *, focus_item: Optional[str] = None, clear_table: bool = True
+    ) -> None:
+        self.calls.append("fill_main_table")
+        if clear_table:
+            self.last_diff = self.table.diff(prepare_table_items(weeks_workdays, self._columns, set()))
+            self.table.apply(self.last_diff)
+        else:
+            self.table.insert(prepare_table_items(weeks_workdays, self._columns, self.table.parents()))
+        self._focus(focus_item)
+
+    def stream_main_table(self, newest_weeks: Iterator[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        self.calls.append("stream_main_table")
+        self.table.clear()
+        known_parents: Set[str] = set()
+        for week_workdays in newest_weeks:
+            self.table.insert(prepare_table_items([week_workdays], self._columns, known_parents, parents_index=0))
+        self._focus(focus_item)
+
+    def prepend_to_main_table(self, weeks_workdays: List[List[WorkDay]]) -> None:
+        self.calls.append("prepend_to_main_table")
+        items = prepare_table_items(list(reversed(weeks_workdays)), self._columns, self.table.parents(), parents_index=0)
+        self.table.insert(items)
+
+    def update_main_table_weeks(self, weeks_workdays: List[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        self.calls.append("update_main_table_weeks")
+        self.last_diff = self.table.patch(prepare_table_items(weeks_workdays, self._columns, self.table.parents()))
+        self.table.apply(self.last_diff)
+        self._focus(focus_item)
+
+    def set_table_focus(self, table: ttk.Treeview, focus_item: Optional[str] = None) -> None:
+        self.calls.append("set_table_focus")
+        self._focus(focus_item)
+
+    def get_variable(self, name: str) -> tk.Variable:
+        raise AssertionError(f"Variable is not implemented: {name}")
+
+    def set_command_handler(self, handler: Callable[[List[Command]], None]) -> None:
+        self._command_handler = handler
+
+    def set_input_validator(self, validator_func: Callable[[str, str, str, str], bool]) -> None:
+        self._input_validator = validator_func
+
+    def insert_default_value(self, value: Optional[str] = DEFAULT_INPUT_VALUE) -> None:
+        self.calls.append("insert_default_value")
+        self.input_value = value
+
+    @staticmethod
+    def clear_table(table: ttk.Treeview) -> None:
+        """No Treeview to clear"""
+
+    def put_command(self, command: Command) -> None:
+        self._commands.put(command)
+
+    def dispatch_commands(self) -> None:
+        """Hands the queued commands to App, what Window does once Tk gets idle"""
+        assert self._command_handler is not None, "App has not set a command handler"
+        self._command_handler(self._commands.drain())
+
+    def type_input(self, value: str) -> bool:
+        """Validates the value keystroke by keystroke like the input entry, it is kept if every key is accepted"""
+        assert self._input_validator is not None, "App has not set an input validator"
+        for i in range(len(value)):
+            if not self._input_validator(value[: i + 1], value[i], "1", str(i)):
+                return False
+        self.input_value = value
+        return True
+
+    def data_rows(self) -> List[str]:
+        return self.table.data_rows()
+
+    def row_values(self, iid: str) -> Dict[str, str]:
+        return dict(zip(self._columns, self.table.items[iid][4]))
+
+    def _focus(self, focus_item: Optional[str]) -> None:
+        if focus_item is not None and focus_item not in self.table.items:
+            _log.warning(f"Focusing on a non-existing table item: {focus_item}")
+            focus_item = None
+        if focus_item is None:
+            rows = self.data_rows()
+            focus_item = rows[-1] if rows else None
+        self.focused = focus_item
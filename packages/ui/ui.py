@@ -1,32 +1,54 @@
 from __future__ import annotations
 
+import itertools
 import json
 import logging
 import re
 import tkinter as tk
-from datetime import date
+from collections.abc import Generator
+from datetime import date, datetime, timedelta
 from enum import Enum
 from tkinter import messagebox, scrolledtext, ttk
-from typing import TYPE_CHECKING, Protocol
+from typing import TYPE_CHECKING, Protocol, Set, Tuple, Union
 
 from dataclasses import dataclass, field
 
+from packages.commands import (
+    Command, CommandQueue, AddMarks, EditRow, DeleteRows, DeleteRange, LoadAll, LoadOlder, ReplayJournal, ApplyFilter,
+    Punch,
+)
 from packages.constants import CONFIG_FILE_PATH, DATE_STRING_MASK, DATE_PATTERN, WorkWeek
 from packages.utils import logging_utils
 
 if TYPE_CHECKING:
-    from typing import Dict, List, Optional, Callable, Sequence, Literal
+    from typing import Dict, Iterator, List, Optional, Callable, Sequence, Literal
     from packages.constants import WorkDay
 
 _log = logging.getLogger("ui")
 
 DEFAULT_INPUT_VALUE = str(date.today().strftime(DATE_STRING_MASK))
 
+# parent, index, iid, text, values, tags
+TableItem = Tuple[str, Union[int, str], str, str, Tuple[str, ...], str]
+
+# weeks rendered per event loop turn when the main table is filled
+TABLE_FILL_CHUNK_WEEKS = 40
+# new items a refresh inserts at once, about a fill chunk, more of them are rendered by a progressive fill
+TABLE_DIFF_MAX_INSERTS = TABLE_FILL_CHUNK_WEEKS * 8
+
+TABLE_INSERT_PROC_NAME = "timely_insert_table_items"
+TABLE_INSERT_PROC = f"""
+proc {TABLE_INSERT_PROC_NAME} {{table items}} {{
+    foreach {{parent index iid text values tags}} $items {{
+        $table insert $parent $index -id $iid -text $text -values $values -tags $tags -open 1
+    }}
+}}
+"""
+
 
 # TODO: enable/disable log window in settings
 # TODO: settings: change font size
 # TODO: edit exist entries
-# TODO: undo support
 # TODO: Save settings in json file
 # TODO: edit does not work
 # TODO: deleting does not work (row data only)
@@ -84,6 +106,147 @@ class UiTableConfig:
     column_params: List[TableColumnParams] = field(default_factory=list)
 
 
+def prepare_table_items(
+        weeks_workdays: List[List[WorkDay]],
+        columns: Sequence[str],
+        known_parents: Set[str],
+        parents_index: Union[int, Literal["end"]] = "end",
+) -> List[TableItem]:
+    """Month, week, data and summary table items of the weeks in insertion order. Parents missing from
+    'known_parents' are created at 'parents_index' of their own parent, 'known_parents' gets updated"""
+    items: List[TableItem] = []
+    for week_workdays in weeks_workdays:
+        work_week = WorkWeek(week_workdays)
+        week = ""
+        for workday in work_week.workdays:
+            row = workday.as_dict()
+            month, week = row["month"], row["week"]
+            if month not in known_parents:
+                known_parents.add(month)
+                items.append(("", parents_index, month, month, (), ""))
+            if week not in known_parents:
+                known_parents.add(week)
+                items.append((month, parents_index, week, week, (), ""))
+            values = tuple("-" if row.get(column) is None else row[column] for column in columns)
+            items.append((week, "end", row["iid"], "", values, row["color"] or "default"))
+        summary = work_week.summary
+        values = tuple("-" if summary.get(column) is None else summary[column] for column in columns)
+        items.append((week, "end", summary["iid"], "", values, "default"))
+    return items
+
+
+@dataclass
+class TableDiff:
+    """Changes turning the displayed table into a new one: items to delete (their descendants go with them), to
+    insert at the end of their parent, to update in place, and parents whose children must be put in a new order"""
+
+    deleted: List[str] = field(default_factory=list)
+    inserted: List[TableItem] = field(default_factory=list)
+    updated: List[TableItem] = field(default_factory=list)
+    reordered: Dict[str, List[str]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.deleted) + len(self.inserted) + len(self.updated) + len(self.reordered)
+
+
+class TableModel:
+    """Items of the main table and the order of the children of each parent, as the Treeview holds them"""
+
+    def __init__(self) -> None:
+        self.items: Dict[str, TableItem] = {}
+        self.children: Dict[str, List[str]] = {"": []}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.children = {"": []}
+
+    def parents(self) -> Set[str]:
+        return {iid for iid in self.children if iid}
+
+    def insert(self, items: List[TableItem]) -> None:
+        for item in items:
+            parent, index, iid, _, values, _ = item
+            siblings = self.children[parent]
+            siblings.insert(index if isinstance(index, int) else len(siblings), iid)
+            self.items[iid] = item
+            if not values:
+                self.children[iid] = []
+
+    def _delete(self, iid: str) -> None:
+        for child in self.children.pop(iid, []):
+            self._delete(child)
+        del self.items[iid]
+
+    def diff(self, items: List[TableItem]) -> TableDiff:
+        """Changes to show 'items', given in display order like 'prepare_table_items' makes them"""
+        table_diff = TableDiff()
+        target = {item[2]: item for item in items}
+        deleted = {iid for iid in self.items if iid not in target or target[iid][0] != self.items[iid][0]}
+        table_diff.deleted = [iid for iid in deleted if self.items[iid][0] not in deleted]
+        target_children: Dict[str, List[str]] = {"": []}
+        for item in items:
+            parent, _, iid, text, values, tags = item
+            target_children.setdefault(parent, []).append(iid)
+            if iid in deleted or iid not in self.items:
+                table_diff.inserted.append(item)
+            elif self.items[iid][3:] != (text, values, tags):
+                table_diff.updated.append(item)
+        inserted = {item[2] for item in table_diff.inserted}
+        for parent, children in target_children.items():
+            kept = [iid for iid in self.children.get(parent, []) if iid not in deleted] if parent not in deleted else []
+            if kept + [iid for iid in children if iid in inserted] != children:
+                table_diff.reordered[parent] = children
+        return table_diff
+
+    def patch(self, items: List[TableItem]) -> TableDiff:
+        """Changes to show 'items' of whole weeks, as 'prepare_table_items' makes them with the shown parents known,
+        in place of what those weeks show. The rest of the table is left alone, rows a week shows besides the given
+        ones are kept in front of them"""
+        table_diff = TableDiff()
+        target_children: Dict[str, List[str]] = {}
+        for item in items:
+            parent, _, iid, text, values, tags = item
+            if values:
+                target_children.setdefault(parent, []).append(iid)
+            if iid not in self.items:
+                table_diff.inserted.append(item)
+            elif self.items[iid][3:] != (text, values, tags):
+                table_diff.updated.append(item)
+        inserted = {item[2] for item in table_diff.inserted}
+        for week, children in target_children.items():
+            shown = self.children.get(week, [])
+            target = [iid for iid in shown if iid not in children] + children
+            if shown + [iid for iid in children if iid in inserted] != target:
+                table_diff.reordered[week] = target
+        return table_diff
+
+    def apply(self, table_diff: TableDiff) -> None:
+        for iid in table_diff.deleted:
+            self.children[self.items[iid][0]].remove(iid)
+            self._delete(iid)
+        self.insert([(item[0], "end", *item[2:]) for item in table_diff.inserted])
+        for item in table_diff.updated:
+            self.items[item[2]] = item
+        for parent, children in table_diff.reordered.items():
+            self.children[parent] = list(children)
+
+    def data_rows(self) -> List[str]:
+        """Data row ids in display order"""
+        rows: List[str] = []
+        stack = list(reversed(self.children[""]))
+        while stack:
+            iid = stack.pop()
+            children = self.children.get(iid)
+            if children:
+                stack.extend(reversed(children))
+            elif self.items[iid][4] and not iid.startswith("summary_"):
+                rows.append(iid)
+        return rows
+
+
 class UserInterface(Protocol):
     """A base class not for instantiation"""
 
@@ -92,12 +255,24 @@ class UserInterface(Protocol):
     ) -> None:
         """to override"""
 
+    def stream_main_table(self, newest_weeks: Iterator[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        """to override"""
+
+    def prepend_to_main_table(self, weeks_workdays: List[List[WorkDay]]) -> None:
+        """to override"""
+
+    def update_main_table_weeks(self, weeks_workdays: List[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        """to override"""
+
     def set_table_focus(self, table: ttk.Treeview, focus_item: Optional[str] = None) -> None:
         """to override"""
 
     def get_variable(self, name: str) -> tk.Variable:
         """to override"""
 
+    def set_command_handler(self, handler: Callable[[List[Command]], None]) -> None:
+        """to override"""
+
     def set_input_validator(self, validator_func: Callable[[str, str, str, str], bool]) -> None:
         """to override"""
 
@@ -115,6 +290,18 @@ class Window(UserInterface):
     def __init__(self, master: tk.Tk, ui_config: Dict[str, UiTableConfig], **kwargs: str) -> None:
         self.master: tk.Tk = master
         self._default_input_value: Optional[str] = None
+        self._older_rows_requested_at: Optional[str] = None
+        self._table_fill_generation = 0
+        self._table_fill_job: Optional[str] = None
+        # weeks of the fill in progress, a generator is closed when the fill is cancelled
+        self._table_fill_weeks: Optional[Iterator[List[WorkDay]]] = None
+        # week updates waiting for the fill in progress to end
+        self._pending_week_updates: List[Tuple[List[List[WorkDay]], Optional[str]]] = []
+        # what the main table shows, refreshes are diffed against it
+        self._table_model = TableModel()
+        self._commands = CommandQueue()
+        self._commands_dispatch_job: Optional[str] = None
+        self._command_handler: Optional[Callable[[List[Command]], None]] = None
         self._set_window_name_and_geometry(master, **kwargs)
         self._ui_config = ui_config
         self._init_ui()
@@ -123,15 +310,26 @@ class Window(UserInterface):
     @staticmethod
     def _init_variables() -> List[tk.Variable]:
         _log.debug("Initialize variables for external use")
-        variables = [
-            tk.StringVar(name="input_value"),
-            tk.StringVar(name="rows_to_be_deleted"),
-            tk.StringVar(name="edited_table_row"),
-            tk.BooleanVar(name="fill_table_with_all_data", value=False),
-            tk.StringVar(name="change_settings"),
-        ]
+        variables: List[tk.Variable] = [tk.StringVar(name="change_settings")]
         return variables
 
+    def set_command_handler(self, handler: Callable[[List[Command]], None]) -> None:
+        self._command_handler = handler
+
+    def _put_command(self, command: Command) -> None:
+        """Queues a command for App, a burst of commands is handed over when Tk gets idle"""
+        self._commands.put(command)
+        if self._commands_dispatch_job is None:
+            self._commands_dispatch_job = self.master.after_idle(self._dispatch_commands)
+
+    def _dispatch_commands(self) -> None:
+        self._commands_dispatch_job = None
+        commands = self._commands.drain()
+        if self._command_handler is None:
+            _log.warning(f"No command handler, commands are dropped: {commands}")
+            return
+        self._command_handler(commands)
+
     def get_variable(self, name: str) -> tk.Variable:
         for var in self._variables:
             if str(var) == name:
@@ -149,59 +347,178 @@ class Window(UserInterface):
         master.minsize(int(x), int(y))
 
     # TODO: focus on fresh added line
-    # TODO: split the function and parametrize 'parents'
     def fill_main_table(
             self, weeks_workdays: List[List[WorkDay]], *, focus_item: Optional[str] = None, clear_table: bool = True
     ) -> None:
+        """Renders the weeks newest first, in chunks scheduled on the Tk event loop, so the window stays responsive
+        and the newest rows can be focused at once. A new fill aborts what is left of the previous one"""
         table = self._main_table
+        self._cancel_table_fill()
         if clear_table:
+            self._older_rows_requested_at = None
+            if len(self._table_model) and self._refresh_table(weeks_workdays, focus_item):
+                return
             self.clear_table(table)
-        for week_workdays in weeks_workdays:
-            work_week = WorkWeek(week_workdays)
-            week_data = []
-            for workday in work_week.workdays:
-                workday_data = workday.as_dict()
-                iid = workday_data.get("iid", None)
-                if iid is None:
-                    raise AssertionError("Workday data must include 'iid' key")
-                week_data.append(workday_data)
-
-            self._insert_to_table(table=self._main_table, parents=["month", "week"], sorted_rows=week_data)
-            self._insert_to_table(table=self._main_table, parents=["week"], sorted_rows=[work_week.summary])
+            self._table_model.clear()
+        known_parents = set() if clear_table else self._get_table_parents(table)
+        self._start_table_fill(reversed(weeks_workdays), len(weeks_workdays), known_parents, focus_item)
+
+    def stream_main_table(self, newest_weeks: Iterator[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        """Renders weeks as the iterator gives them, newest first, a chunk per event loop turn. Besides the table
+        only the chunk being rendered is held, so the number of weeks is not known in advance"""
+        self._cancel_table_fill()
+        self._older_rows_requested_at = None
+        self.clear_table(self._main_table)
+        self._table_model.clear()
+        self._start_table_fill(newest_weeks, None, set(), focus_item)
+
+    def _start_table_fill(
+            self,
+            newest_first: Iterator[List[WorkDay]],
+            weeks: Optional[int],
+            known_parents: Set[str],
+            focus_item: Optional[str],
+    ) -> None:
+        self._table_fill_generation += 1
+        self._table_fill_weeks = newest_first
+        self._fill_progress.configure(maximum=max(weeks or 1, 1), value=0)
+        self._fill_table_chunk(self._table_fill_generation, newest_first, weeks, 0, known_parents, focus_item, True)
+
+    def _refresh_table(self, weeks_workdays: List[List[WorkDay]], focus_item: Optional[str]) -> bool:
+        """Re-renders only the changed items of the shown table. Returns False, and changes nothing, when so many
+        items are new that a progressive fill keeps the window more responsive"""
+        table = self._main_table
+        items = prepare_table_items(weeks_workdays, self._main_table_columns, set())
+        table_diff = self._table_model.diff(items)
+        if len(table_diff.inserted) > TABLE_DIFF_MAX_INSERTS:
+            return False
+        self._table_fill_generation += 1
+        self._apply_table_diff(table, table_diff)
+        _log.debug(f"Table refreshed, {len(table_diff.updated)} items updated, {len(table_diff.inserted)} inserted")
+        self._fill_progress.configure(maximum=1, value=1)
+        self.set_table_focus(table, focus_item)
+        return True
 
+    def update_main_table_weeks(self, weeks_workdays: List[List[WorkDay]], *, focus_item: Optional[str] = None) -> None:
+        """Re-renders the given whole weeks in place, the rest of the table is left alone. During a fill the weeks
+        wait for it to end, its later chunks would insert the items again otherwise"""
+        if self._table_fill_job is not None:
+            self._pending_week_updates.append((weeks_workdays, focus_item))
+            return
+        table = self._main_table
+        items = prepare_table_items(weeks_workdays, self._main_table_columns, self._table_model.parents())
+        self._apply_table_diff(table, self._table_model.patch(items))
         self.set_table_focus(table, focus_item)
 
-    @staticmethod
-    def _insert_to_table(
-            table: ttk.Treeview, *, parents: Sequence[str] = ("",), sorted_rows: List[Dict[str, str]]
+    def _apply_table_diff(self, table: ttk.Treeview, table_diff: TableDiff) -> None:
+        if table_diff.deleted:
+            table.delete(*table_diff.deleted)
+        self._tk_insert_items(table, [(item[0], "end", *item[2:]) for item in table_diff.inserted])
+        for _, _, iid, text, values, tags in table_diff.updated:
+            table.item(iid, text=text, values=values, tags=tags)
+        for parent, children in table_diff.reordered.items():
+            table.set_children(parent, *children)
+        self._table_model.apply(table_diff)
+
+    def _fill_table_chunk(
+            self,
+            generation: int,
+            newest_first: Iterator[List[WorkDay]],
+            weeks: Optional[int],
+            done: int,
+            known_parents: Set[str],
+            focus_item: Optional[str],
+            focus_pending: bool,
     ) -> None:
-        for row in sorted_rows:
-            for i, parent in enumerate(parents):
-                parent_key = row[parents[i - 1]] if i else ""
-                if not table.exists(row[parent]):
-                    table.insert(parent_key, tk.END, iid=row[parent], text=row[parent], open=True)
-            values = []
-            for column in table.config("columns")[-1]:
-                if row.get(column, None) is None:
-                    values.append("-")
-                else:
-                    values.append(row[column])
-            table.insert(
-                row[parents[-1]],
-                tk.END,
-                iid=row.get("iid") or values[0],
-                values=values,
-                open=True,
-                tags=row.get("color") or "default",
+        if generation != self._table_fill_generation:
+            # a newer fill has started
+            return
+        table = self._main_table
+        try:
+            chunk = list(itertools.islice(newest_first, TABLE_FILL_CHUNK_WEEKS))
+        except Exception:
+            _log.exception("Failed to take weeks for the main table")
+            chunk = []
+        # older weeks come later, so new parents go above the rendered ones
+        self._insert_items(table, prepare_table_items(chunk, self._main_table_columns, known_parents, parents_index=0))
+        done += len(chunk)
+        # a stream of unknown length keeps the bar a chunk ahead until it ends
+        self._fill_progress.configure(maximum=weeks or done + TABLE_FILL_CHUNK_WEEKS, value=done)
+        if focus_pending and (focus_item is None or table.exists(focus_item)):
+            self.set_table_focus(table, focus_item)
+            focus_pending = False
+        if len(chunk) == TABLE_FILL_CHUNK_WEEKS:
+            self._table_fill_job = self.master.after(
+                1,
+                self._fill_table_chunk,
+                generation,
+                newest_first,
+                weeks,
+                done,
+                known_parents,
+                focus_item,
+                focus_pending,
             )
-        table.update()
+            return
+        self._fill_progress.configure(maximum=max(done, 1), value=max(done, 1))
+        self._table_fill_job = None
+        self._table_fill_weeks = None
+        if focus_pending:
+            self.set_table_focus(table, focus_item)
+        pending_week_updates, self._pending_week_updates = self._pending_week_updates, []
+        for weeks_workdays, week_focus_item in pending_week_updates:
+            self.update_main_table_weeks(weeks_workdays, focus_item=week_focus_item)
+
+    def _cancel_table_fill(self) -> None:
+        """Stops the fill in progress. Its pending week updates are dropped, the next fill reads them anew"""
+        if self._table_fill_job is not None:
+            self.master.after_cancel(self._table_fill_job)
+            self._table_fill_job = None
+        if isinstance(self._table_fill_weeks, Generator):
+            self._table_fill_weeks.close()
+        self._table_fill_weeks = None
+        self._pending_week_updates.clear()
+
+    def prepend_to_main_table(self, weeks_workdays: List[List[WorkDay]]) -> None:
+        """Inserts weeks older than the shown ones above them, keeping the view on the previous top row"""
+        table = self._main_table
+        top_items = table.get_children()
+        # newest week first, each new parent goes to the top of its parent
+        items = prepare_table_items(
+            list(reversed(weeks_workdays)), self._main_table_columns, self._get_table_parents(table), parents_index=0
+        )
+        self._insert_items(table, items)
+        if top_items:
+            table.see(top_items[0])
+
+    @staticmethod
+    def _get_table_parents(table: ttk.Treeview) -> Set[str]:
+        """Months and weeks already in the table"""
+        months = table.get_children()
+        parents = set(months)
+        for month in months:
+            parents.update(table.get_children(month))
+        return parents
+
+    def _insert_items(self, table: ttk.Treeview, items: List[TableItem]) -> None:
+        self._tk_insert_items(table, items)
+        self._table_model.insert(items)
+
+    @staticmethod
+    def _tk_insert_items(table: ttk.Treeview, items: List[TableItem]) -> None:
+        """Inserts all items with a single Tcl call, the table is redrawn once when Tk gets idle"""
+        if items:
+            table.tk.call(TABLE_INSERT_PROC_NAME, str(table), tuple(value for item in items for value in item))
 
     def set_table_focus(self, table: ttk.Treeview, focus_item: Optional[str] = None) -> None:
         if focus_item is None:
             focus_item = self._get_table_data_item(table)
         elif not table.exists(focus_item):
             _log.warning(f"Focusing on a non-existing table item: {focus_item}")
-            focus_item = table.get_children()[-1]
+            focus_item = self._get_table_data_item(table)
+        if not focus_item:
+            # the table is empty
+            return
         self._main_table.selection_set(focus_item)
         self._main_table.see(focus_item)
 
@@ -221,9 +538,7 @@ class Window(UserInterface):
     @staticmethod
     def clear_table(table: ttk.Treeview) -> None:
         """Clear Treeview table"""
-        for i in table.get_children():
-            table.delete(i)
-        table.update()
+        table.delete(*table.get_children())
 
     def _init_ui(self) -> None:
         _log.debug("Building UI")
@@ -294,23 +609,63 @@ class Window(UserInterface):
             style="Treeview",
             show=["tree", "headings"],
         )
-        y = ttk.Scrollbar(master, orient="vertical", command=self._main_table.yview)
+        y = ttk.Scrollbar(master, orient="vertical", command=self._scroll_table)
         y.pack(side="right", fill="y")
         self._main_table.configure(yscrollcommand=y.set)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Prior>", "<Up>"):
+            self._main_table.bind(sequence, self._on_table_scroll_up, add="+")
 
         self._main_table.tag_configure("default", background="white")
         self._main_table.tag_configure("green", background="honeydew")
         self._main_table.tag_configure("red", background="mistyrose")
         self._config_table(self._main_table)
+        self._main_table_columns = tuple(columns)
+        self.master.tk.eval(TABLE_INSERT_PROC)
         self._main_table.pack(fill="both", expand=True)
-        y.config(command=self._main_table.yview)
+
+    def _scroll_table(self, *args: str) -> None:
+        self._main_table.yview(*args)
+        self._request_older_rows_at_top()
+
+    def _on_table_scroll_up(self, event: tk.Event[ttk.Treeview]) -> None:
+        if event.delta >= 0:
+            # the class binding moves the view after this one
+            self.master.after_idle(self._request_older_rows_at_top)
+
+    def _request_older_rows_at_top(self) -> None:
+        """Older rows are requested when the user scrolls to the top, once per shown oldest row"""
+        if self._table_fill_job is not None:
+            # older weeks of the current fill are still to come
+            return
+        table = self._main_table
+        oldest_item = ""
+        while table.get_children(oldest_item):
+            oldest_item = table.get_children(oldest_item)[0]
+        if not oldest_item or float(table.yview()[0]) > 0 or self._older_rows_requested_at == oldest_item:
+            return
+        self._older_rows_requested_at = oldest_item
+        self._put_command(LoadOlder())
 
     def _init_table_stuff(self, master: ttk.LabelFrame) -> None:
         _log.debug("Initialize main table")
         frame = ttk.Frame(master)
         frame.grid(row=1, column=0, sticky="nsew")
+        self._init_filter_stuff(frame)
+        self._fill_progress = ttk.Progressbar(frame, orient="horizontal", mode="determinate")
+        self._fill_progress.pack(side="bottom", fill="x", pady=2)
         self._init_main_table(frame)
 
+    def _init_filter_stuff(self, master: ttk.Frame) -> None:
+        _log.debug("Initialize filter bar")
+        frame = ttk.Frame(master)
+        frame.pack(side="top", fill="x", pady=5)
+        ttk.Label(frame, text="Filter (e.g. 'sick 2022', 'overtime>1h'):", font="Arial 11").pack(side="left", padx=10)
+        self.filter_input = ttk.Entry(frame, font="Arial 12")
+        self.filter_input.pack(side="left", fill="x", expand=True, padx=10)
+        self.filter_input.bind("<Return>", self._submit_filter_query)
+        self.filter_input.bind("<KP_Enter>", self._submit_filter_query)
+        self.filter_input.bind("<Escape>", self._reset_filter_query)
+
     def _toggle_table_data_view(self, table: ttk.Treeview) -> None:
         state = None
         for item in table.get_children():
@@ -356,23 +711,55 @@ class Window(UserInterface):
         edit_window.insert_to_entry(value_to_edit)
         self.master.wait_window(edit_window.top_level)
         if edit_window.returned_value is not None and not value_to_edit == edit_window.returned_value:
-            self.get_variable("edited_table_row").set(edit_window.returned_value["value"])
+            self._put_command(EditRow((edit_window.returned_value["value"],)))
             return
         _log.debug(f"Values have not been changed: {value_to_edit}")
         # self.master.wait_visibility(self.master)
 
     def _delete_selected_table_rows(self, table: ttk.Treeview) -> None:
+        groups = [iid for iid in table.selection() if table.get_children(iid)]
+        if groups:
+            self._delete_selected_table_groups(table, groups)
+            return
         selected = self._get_selected(table, data_rows_only=True)
         if selected is not None:
             # message = f"[{utils.datetime_to_str(found_in_db[0].date)}, {utils.time_to_str(found_in_db[0].times)}]"
             values = [f"\n{val}" for val in list(selected.values())]
             if not self.ask_delete("".join(values)):
                 return
-            keys_to_be_deleted = ",".join(selected.keys())
-            self.get_variable("rows_to_be_deleted").set(keys_to_be_deleted)
+            dates = tuple(datetime.strptime(iid, DATE_STRING_MASK).date() for iid in selected)
+            self._put_command(DeleteRows(dates))
             # _log.debug(f"Db rows deleted successfully:{''.join(values)}")
             # self._fill_table(table)
 
+    def _delete_selected_table_groups(self, table: ttk.Treeview, groups: List[str]) -> None:
+        """A month or week row deletes the whole calendar month or week, shown rows or not"""
+        ranges = []
+        lines = []
+        for iid in groups:
+            first_day = self._first_table_date(table, iid)
+            if table.get_children(table.get_children(iid)[0]):
+                start = first_day.replace(day=1)
+                end = (start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+            else:
+                start = first_day - timedelta(days=first_day.weekday())
+                end = start + timedelta(days=6)
+            ranges.append((start, end))
+            lines.append(f"\n{iid}: {start.strftime(DATE_STRING_MASK)} - {end.strftime(DATE_STRING_MASK)}")
+        if not self.ask_delete("".join(lines)):
+            return
+        for start, end in ranges:
+            self._put_command(DeleteRange(start, end))
+
+    @staticmethod
+    def _first_table_date(table: ttk.Treeview, iid: str) -> date:
+        """Date of the first data row under a month or week row, data rows come before the week summary"""
+        children = table.get_children(iid)
+        while children:
+            iid = children[0]
+            children = table.get_children(iid)
+        return datetime.strptime(iid, DATE_STRING_MASK).date()
+
     def _init_buttons_stuff(self, master: ttk.LabelFrame) -> None:
         _log.debug("Initialize buttons panel")
         frame = ttk.Frame(master)
@@ -399,6 +786,18 @@ class Window(UserInterface):
         )
         self.delete_button.grid(row=0, column=4, padx=10)
 
+        self.undo_button = ttk.Button(frame, text="UNDO", width=15, command=self._undo)
+        self.undo_button.grid(row=0, column=5, padx=10)
+
+        self.redo_button = ttk.Button(frame, text="REDO", width=15, command=self._redo)
+        self.redo_button.grid(row=0, column=6, padx=10)
+        self.master.bind("<Control-z>", self._undo)
+        self.master.bind("<Control-y>", self._redo)
+
+        self.punch_button = ttk.Button(frame, text="PUNCH", width=15, command=self._punch)
+        self.punch_button.grid(row=0, column=7, padx=10)
+        self.master.bind("<Control-p>", self._punch)
+
     def _init_log_stuff(self, master: ttk.LabelFrame) -> None:
         _log.debug("Initialize log panel")
         frame = ttk.Frame(master)
@@ -415,10 +814,27 @@ class Window(UserInterface):
 
     def _submit_input_value(self, event: Optional[tk.Event[tk.Entry]] = None) -> None:
         value = self._get_input_value()
-        self.get_variable("input_value").set(value)
+        self._put_command(AddMarks((value,)))
+
+    def _submit_filter_query(self, event: Optional[tk.Event[tk.Entry]] = None) -> None:
+        self._put_command(ApplyFilter(self.filter_input.get()))
+
+    def _reset_filter_query(self, event: Optional[tk.Event[tk.Entry]] = None) -> None:
+        self.filter_input.delete(0, tk.END)
+        self._submit_filter_query()
 
     def _fill_table_with_all_db_data(self) -> None:
-        self.get_variable("fill_table_with_all_data").set(True)
+        self._put_command(LoadAll())
+
+    def _undo(self, event: Optional[tk.Event[tk.Misc]] = None) -> None:
+        self._put_command(ReplayJournal(redo=False))
+
+    def _redo(self, event: Optional[tk.Event[tk.Misc]] = None) -> None:
+        self._put_command(ReplayJournal(redo=True))
+
+    def _punch(self, event: Optional[tk.Event[tk.Misc]] = None) -> None:
+        """Appends the current time to today's row, no typing needed"""
+        self._put_command(Punch(datetime.now().replace(second=0, microsecond=0)))
 
 
 class ModalWindow:
@@ -1,9 +1,11 @@
 import datetime as dt
 import logging
-from typing import List, Union
+from typing import Iterator, List, Sequence, TypeVar, Union
 
 _log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 def date_to_str(date_instance: Union[dt.date, str], date_mask: str, braces: bool = False) -> str:
     try:
@@ -21,5 +23,10 @@ def time_to_str(time_instances: List[dt.time], time_mask: str, braces: bool = Fa
     return f'[{" ".join(marks)}]' if braces else " ".join(marks)
 
 
+def chunked(items: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    for i in range(0, len(items), size):
+        yield items[i: i + size]
+
+
 if __name__ == "__main__":
     pass
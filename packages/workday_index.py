@@ -0,0 +1,163 @@
+import datetime as dt
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dataclasses import dataclass
+
+from packages.constants import WorkDay, DayType, DATE_STRING_MASK
+
+_log = logging.getLogger(__name__)
+
+# filter bar words for day types, the normal day has no value of its own
+DAY_TYPE_WORDS = {**{day_type.value: day_type for day_type in DayType if day_type.value}, "normal": DayType.NORMAL}
+METRICS = ("worktime", "overtime")
+
+_DAY_TYPE_PATTERN = "|".join(sorted(DAY_TYPE_WORDS, key=len, reverse=True))
+_DURATION_PATTERN = r"(?:(?P<hours>\d+)h)?(?:(?P<minutes>\d+)m)?"
+_FILTER_TOKEN_PATTERN = re.compile(
+    rf"(?P<day_type>{_DAY_TYPE_PATTERN})"
+    rf"|(?P<metric>{'|'.join(METRICS)})(?P<operator>[<>]=?){_DURATION_PATTERN}"
+    r"|(?P<date_range>\d\d\.\d\d\.\d{4}-\d\d\.\d\d\.\d{4})"
+    r"|(?P<date>\d\d\.\d\d\.\d{4})"
+    r"|(?P<month>\d\d\.\d{4})"
+    r"|(?P<year>\d{4})"
+    r"|(?P<space>\s+)"
+)
+
+_TOKENS = ("day_type", "metric", "date_range", "date", "month", "year", "space")
+
+MetricBounds = Tuple[Optional[dt.timedelta], Optional[dt.timedelta]]
+
+
+@dataclass(frozen=True)
+class WorkDayFilter:
+    """Conditions of a filter query, all of them must hold. 'None' means no condition, bounds are inclusive"""
+
+    start: Optional[dt.date] = None
+    end: Optional[dt.date] = None
+    day_types: Optional[Tuple[DayType, ...]] = None
+    worktime: MetricBounds = (None, None)
+    overtime: MetricBounds = (None, None)
+
+    @classmethod
+    def from_string(cls, query: str) -> "WorkDayFilter":
+        """Parses filter bar input, e.g. 'sick 2022', 'overtime>1h', '06.2023 worktime<7h30m vacation holiday'"""
+        start: Optional[dt.date] = None
+        end: Optional[dt.date] = None
+        day_types: List[DayType] = []
+        bounds: Dict[str, MetricBounds] = {metric: (None, None) for metric in METRICS}
+        position = 0
+        query = query.strip().lower()
+        while position < len(query):
+            match = _FILTER_TOKEN_PATTERN.match(query, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Filter not recognized at '{query[position:]}'")
+            position = match.end()
+            token = next(name for name in _TOKENS if match.group(name) is not None)
+            if token == "day_type":
+                day_types.append(DAY_TYPE_WORDS[match.group("day_type")])
+            elif token == "metric":
+                bounds[match.group("metric")] = cls._metric_bounds(match, bounds[match.group("metric")])
+            elif token != "space":
+                if start is not None:
+                    raise ValueError(f"Filter must contain one date range only: '{query}'")
+                start, end = cls._date_bounds(token, match.group(token))
+        return WorkDayFilter(
+            start, end, tuple(day_types) or None, worktime=bounds["worktime"], overtime=bounds["overtime"]
+        )
+
+    @staticmethod
+    def _metric_bounds(match: "re.Match[str]", bounds: MetricBounds) -> MetricBounds:
+        if match.group("hours") is None and match.group("minutes") is None:
+            raise ValueError(f"Duration must be given in hours and/or minutes, e.g. 1h30m: '{match.group()}'")
+        value = dt.timedelta(hours=int(match.group("hours") or 0), minutes=int(match.group("minutes") or 0))
+        strict = dt.timedelta(minutes=1) if "=" not in match.group("operator") else dt.timedelta(0)
+        low, high = bounds
+        if match.group("operator").startswith(">"):
+            return value + strict, high
+        return low, value - strict
+
+    @staticmethod
+    def _date_bounds(token: str, value: str) -> Tuple[dt.date, dt.date]:
+        if token == "year":
+            return dt.date(int(value), 1, 1), dt.date(int(value), 12, 31)
+        if token == "month":
+            first = dt.datetime.strptime(f"01.{value}", DATE_STRING_MASK).date()
+            next_month = (first + dt.timedelta(days=31)).replace(day=1)
+            return first, next_month - dt.timedelta(days=1)
+        first_value, _, last_value = value.partition("-")
+        first = dt.datetime.strptime(first_value, DATE_STRING_MASK).date()
+        return first, dt.datetime.strptime(last_value, DATE_STRING_MASK).date() if last_value else first
+
+
+class WorkDayIndex:
+    """Read-only indexes over a set of WorkDays for filter queries.
+
+    Dates are a sorted ordinal array searched with bisect, day types are bitmaps (python ints, bit i is the
+    i-th WorkDay by date) and the time metrics are sorted arrays of (minutes, position). A query intersects
+    the bitmaps of its conditions, so it costs a few bisects plus work linear in the matched metric ranges"""
+
+    def __init__(self, workdays: Iterable[WorkDay]) -> None:
+        self._workdays = sorted(workdays)
+        self._ordinals = [workday.date.toordinal() for workday in self._workdays]
+        day_type_positions: Dict[DayType, List[int]] = {day_type: [] for day_type in DayType}
+        for position, workday in enumerate(self._workdays):
+            day_type_positions[workday.day_type].append(position)
+        self._day_types = {
+            day_type: self._positions_mask(positions) for day_type, positions in day_type_positions.items()
+        }
+        self._metrics: Dict[str, Tuple[List[int], List[int]]] = {}
+        for metric in METRICS:
+            pairs = sorted(
+                (int(getattr(workday, metric).total_seconds()) // 60, position)
+                for position, workday in enumerate(self._workdays)
+            )
+            self._metrics[metric] = ([minutes for minutes, _ in pairs], [position for _, position in pairs])
+
+    def __len__(self) -> int:
+        return len(self._workdays)
+
+    def _positions_mask(self, positions: Iterable[int]) -> int:
+        bits = bytearray((len(self._workdays) + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, "little")
+
+    def _date_mask(self, start: Optional[dt.date], end: Optional[dt.date]) -> int:
+        low = bisect_left(self._ordinals, start.toordinal()) if start is not None else 0
+        high = bisect_right(self._ordinals, end.toordinal()) if end is not None else len(self._ordinals)
+        return ((1 << high) - 1) ^ ((1 << low) - 1) if high > low else 0
+
+    def _metric_mask(self, metric: str, bounds: MetricBounds) -> Optional[int]:
+        low_bound, high_bound = bounds
+        if low_bound is None and high_bound is None:
+            return None
+        minutes, positions = self._metrics[metric]
+        low = bisect_left(minutes, int(low_bound.total_seconds()) // 60) if low_bound is not None else 0
+        high = len(minutes)
+        if high_bound is not None:
+            high = bisect_right(minutes, int(high_bound.total_seconds()) // 60)
+        return self._positions_mask(positions[low:high])
+
+    def query(self, workday_filter: WorkDayFilter) -> List[WorkDay]:
+        """Matching WorkDays in date order"""
+        mask = self._date_mask(workday_filter.start, workday_filter.end)
+        if workday_filter.day_types is not None:
+            day_types_mask = 0
+            for day_type in workday_filter.day_types:
+                day_types_mask |= self._day_types[day_type]
+            mask &= day_types_mask
+        for metric in METRICS:
+            metric_mask = self._metric_mask(metric, getattr(workday_filter, metric))
+            if metric_mask is not None:
+                mask &= metric_mask
+        # set bits are found on the reversed binary string, which is much faster than shifting a long int
+        bits = format(mask, "b")[::-1]
+        matches: List[WorkDay] = []
+        position = bits.find("1")
+        while position != -1:
+            matches.append(self._workdays[position])
+            position = bits.find("1", position + 1)
+        return matches
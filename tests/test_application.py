@@ -0,0 +1,279 @@
+import logging
+import multiprocessing
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from packages.application import App, WorkDayCache
+from packages.commands import (
+    AddMarks, EditRow, DeleteRows, DeleteRange, LoadAll, ReplayJournal, ApplyFilter, Punch, coalesce
+)
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import DbInterface, WorktimeSqliteDbInterface
+from packages.db.models import Worktime, create_sqlite_engine
+from packages.ui.null_ui import NullUserInterface
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+TIMES_1 = [time(8), time(16)]
+WORKDAYS = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(10)]
+WRITERS = 4
+WRITES_PER_WRITER = 25
+
+
+def _key(workday: WorkDay) -> str:
+    return workday.as_db()["date"]
+
+
+class TestWorkDayCache:
+    def test_should_serve_newest_rows_after_load(self) -> None:
+        cache = WorkDayCache()
+        cache.load(WORKDAYS[-5:], limit=5)
+        assert cache.newest(3) == WORKDAYS[-1:-4:-1]
+        assert cache.newest(6) is None
+        assert cache.is_known_missing(str(int(_key(WORKDAYS[-1])) + 1)) is True
+        assert cache.is_known_missing(_key(WORKDAYS[0])) is False
+
+    def test_should_know_whole_table_when_fewer_rows_than_limit(self) -> None:
+        cache = WorkDayCache()
+        cache.load(WORKDAYS, limit=100)
+        assert cache.newest(100) == list(reversed(WORKDAYS))
+        assert cache.is_known_missing(str(DATE_1.toordinal() - 1)) is True
+
+    def test_should_keep_coherent_on_write_and_delete(self) -> None:
+        cache = WorkDayCache()
+        cache.load(WORKDAYS, limit=100)
+        new_workday = WorkDay(DATE_1 + timedelta(days=20), TIMES_1)
+        cache.put(new_workday)
+        cache.remove(_key(WORKDAYS[-1]))
+        assert cache.newest(2) == [new_workday, WORKDAYS[-2]]
+        assert cache.is_known_missing(_key(WORKDAYS[-1])) is True
+
+    def test_should_narrow_complete_range_on_eviction_and_invalidation(self) -> None:
+        cache = WorkDayCache(max_size=4)
+        cache.load(WORKDAYS, limit=100)
+        assert len(cache) == 4
+        assert cache.newest(4) == list(reversed(WORKDAYS[-4:]))
+        assert cache.newest(5) is None
+        assert cache.is_known_missing(_key(WORKDAYS[0])) is False
+
+        cache.invalidate(_key(WORKDAYS[-2]))
+        assert cache.get(_key(WORKDAYS[-2])) is None
+        assert cache.is_known_missing(_key(WORKDAYS[-2])) is False
+        assert cache.newest(1) == [WORKDAYS[-1]]
+
+
+    def test_should_serve_rows_since_key_only_within_complete_range(self) -> None:
+        cache = WorkDayCache()
+        cache.load(WORKDAYS[-5:], limit=5)
+        assert sorted(cache.since(_key(WORKDAYS[-3])) or []) == WORKDAYS[-3:]
+        assert cache.since(_key(WORKDAYS[0])) is None
+
+
+@pytest.fixture
+def ui() -> NullUserInterface:
+    return NullUserInterface()
+
+
+@pytest.fixture
+def db_if(tmp_path: Path) -> WorktimeSqliteDbInterface:
+    return WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / 'worktime.db'}"))
+
+
+@pytest.fixture
+def app(ui: NullUserInterface, db_if: WorktimeSqliteDbInterface) -> App:
+    return App(app_config={"max_rows": 1000, "page_size": 7}, user_interface=ui, db_if=db_if)
+
+
+class TestApp:
+    def test_should_write_and_show_submitted_input(self, app: App, ui: NullUserInterface) -> None:
+        assert ui.type_input("11.09.2023 08:00 12:00") is True
+        assert ui.type_input("11.09.2023 8:") is False
+        ui.put_command(AddMarks(("11.09.2023 08:00 12:00",)))
+        ui.put_command(AddMarks(("11.09.2023 13:00 17:00",)))
+        ui.dispatch_commands()
+        assert ui.data_rows() == ["11.09.2023"]
+        assert ui.row_values("11.09.2023")["time_marks"] == "08:00 12:00 13:00 17:00"
+        assert ui.focused == "11.09.2023"
+        assert ui.calls.count("fill_main_table") == 2
+
+    def test_should_write_input_in_one_transaction(self, tmp_path: Path) -> None:
+        engine = create_engine(f"sqlite:///{tmp_path / 'worktime.db'}")
+        app = App(app_config={}, user_interface=NullUserInterface(), db_if=WorktimeSqliteDbInterface(engine))
+        app.add_to_db("11.09.2023 08:00")
+        transactions: List[object] = []
+        event.listen(engine, "begin", transactions.append)
+        assert app._write_input_values(["11.09.2023 12:00", "12.09.2023 08:00"], force_update=False) is True
+        assert len(transactions) == 1
+        assert app._find_workdays([_key(WORKDAYS[0])]) == {_key(WORKDAYS[0]): WorkDay(DATE_1, [time(8), time(12)])}
+        assert len(transactions) == 1
+
+    def test_should_store_coalesced_marks_like_sequential_ones(self, tmp_path: Path) -> None:
+        commands = [
+            AddMarks(("14.07.2023 08:00",)),
+            AddMarks(("14.07.2023 vacation",)),
+            AddMarks(("14.07.2023 08:00",)),
+            AddMarks(("14.07.2023 08:00",)),
+            AddMarks(("14.07.2023 12:00",)),
+        ]
+        stored = []
+        for name, batches in (("sequential", [[command] for command in commands]), ("coalesced", [coalesce(commands)])):
+            db_if = WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / name}.db"))
+            app = App(app_config={}, user_interface=NullUserInterface(), db_if=db_if)
+            for batch in batches:
+                app.handle_commands(batch)
+            stored.append([row.as_workday() for row in db_if.read(table=Worktime)])
+        assert len(coalesce(commands)) == 1
+        assert stored[0] == stored[1]
+
+    def test_should_edit_delete_and_undo(self, app: App, ui: NullUserInterface) -> None:
+        app.add_to_db("11.09.2023-13.09.2023 08:00 16:00")
+        app.handle_commands([EditRow(("12.09.2023 sick",))])
+        assert ui.row_values("12.09.2023")["day_type"] == DayType.SICK.value
+        assert ui.last_diff is not None and len(ui.last_diff) == 1
+        app.handle_commands([DeleteRows((DATE_1 + timedelta(days=2),))])
+        assert ui.data_rows() == ["11.09.2023", "12.09.2023"]
+        app.handle_commands([ReplayJournal(), ReplayJournal()])
+        assert ui.data_rows() == ["11.09.2023", "12.09.2023", "13.09.2023"]
+        assert ui.row_values("12.09.2023")["day_type"] == DayType.NORMAL.value
+
+    def test_should_delete_range_of_day_type(self, app: App, ui: NullUserInterface) -> None:
+        app.add_to_db("11.09.2023-17.09.2023 08:00 16:00")
+        app.add_to_db("13.09.2023,14.09.2023 sick")
+        app.handle_commands([DeleteRange(DATE_1, DATE_1 + timedelta(days=3), (DayType.SICK,))])
+        assert ui.data_rows() == ["11.09.2023", "12.09.2023", "15.09.2023", "16.09.2023", "17.09.2023"]
+        app.handle_commands([DeleteRange(DATE_1, DATE_1 + timedelta(days=6))])
+        assert ui.data_rows() == []
+        app.handle_commands([ReplayJournal()])
+        assert len(ui.data_rows()) == 5
+
+    def test_should_punch_and_refresh_only_its_week(self, app: App, ui: NullUserInterface) -> None:
+        app.add_to_db("11.09.2023-13.09.2023 08:00 12:00")
+        fills = ui.calls.count("fill_main_table")
+        ui.put_command(Punch(datetime(2023, 9, 13, 16)))
+        ui.put_command(Punch(datetime(2023, 9, 13, 16)))
+        ui.dispatch_commands()
+        assert ui.row_values("13.09.2023")["time_marks"] == "08:00 12:00 16:00"
+        assert ui.last_diff is not None
+        assert [item[2] for item in ui.last_diff.updated] == ["13.09.2023", "summary_week 37 2023"]
+        assert ui.focused == "13.09.2023"
+
+        app.punch(datetime(2023, 9, 14, 8, 5, 30))
+        assert ui.data_rows() == ["11.09.2023", "12.09.2023", "13.09.2023", "14.09.2023"]
+        assert ui.row_values("14.09.2023")["time_marks"] == "08:05"
+        assert ui.calls.count("fill_main_table") == fills
+        app.handle_commands([ReplayJournal()])
+        assert ui.data_rows() == ["11.09.2023", "12.09.2023", "13.09.2023"]
+
+    def test_should_keep_filter_view_on_punch(self, app: App, ui: NullUserInterface) -> None:
+        app.add_to_db("11.09.2023-13.09.2023 08:00 12:00")
+        app.add_to_db("14.09.2023 vacation")
+        app.handle_commands([ApplyFilter("vacation")])
+        app.punch(datetime(2023, 9, 13, 16))
+        assert ui.data_rows() == ["14.09.2023"]
+        app.punch(datetime(2023, 9, 14, 16))
+        assert ui.data_rows() == []
+        app.handle_commands([ApplyFilter("")])
+        assert ui.row_values("13.09.2023")["time_marks"] == "08:00 12:00 16:00"
+
+    def test_should_page_load_all_and_filter(self, app: App, ui: NullUserInterface) -> None:
+        app.handle_commands([AddMarks(("11.09.2023-09.11.2023 08:00 16:00",)), EditRow(("21.09.2023 vacation",))])
+        app.fill_ui_with_workdays(limit=10)
+        shown = len(ui.data_rows())
+        app.load_older_workdays()
+        assert len(ui.data_rows()) > shown
+        assert ui.data_rows() == sorted(ui.data_rows(), key=lambda iid: iid[6:] + iid[3:5] + iid[:2])
+
+        app.handle_commands([LoadAll()])
+        assert len(ui.data_rows()) == 60
+        app.handle_commands([ApplyFilter("vacation")])
+        assert ui.data_rows() == ["21.09.2023"]
+
+    def test_should_load_all_in_whole_weeks_up_to_max_rows(self, ui: NullUserInterface, db_if: DbInterface) -> None:
+        app = App(app_config={"max_rows": 10, "page_size": 7}, user_interface=ui, db_if=db_if)
+        app.add_to_db("11.09.2023-09.11.2023 08:00 16:00")
+        app.handle_commands([LoadAll()])
+        # four days of the newest week and the whole week before it
+        assert ui.data_rows()[0] == "30.10.2023" and len(ui.data_rows()) == 11
+        assert ui.data_rows() == sorted(ui.data_rows(), key=lambda iid: iid[6:] + iid[3:5] + iid[:2])
+        app.load_older_workdays()
+        assert ui.data_rows()[0] == "23.10.2023"
+
+
+class TestLoadAllMemory:
+    def test_should_hold_about_a_week_besides_the_table(self, ui: NullUserInterface, db_if: DbInterface) -> None:
+        first = date(1973, 1, 1)
+        days = 50 * 365 + 12
+        marks = [[time(8, i % 60), time(12), time(13), time(17, i % 59)] for i in range(days)]
+        db_if.upsert([WorkDay(first + timedelta(days=i), marks[i]).as_db() for i in range(days)], table=Worktime)
+        app = App(app_config={"max_rows": days}, user_interface=ui, db_if=db_if)
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            app.handle_commands([LoadAll()])
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(ui.data_rows()) == days
+        # the table and the formatted row cache stay, everything else is a week or a cursor batch at a time
+        _log.debug(f"retained: {after - before} B, peak above it: {peak - after} B")
+        assert peak - after < 1024 * 1024
+        assert peak - after < (after - before) // 20
+
+
+def _submit_time_marks(db_path: str, writer: int) -> None:
+    """Submits a time mark of its own to DATE_1 per write through App, a lost update would drop some of them"""
+    db_if = WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+    app = App(app_config={}, user_interface=NullUserInterface(), db_if=db_if)
+    for i in range(WRITES_PER_WRITER):
+        minute = writer * WRITES_PER_WRITER + i
+        app.add_to_db(f"11.09.2023 {minute // 60:02}:{minute % 60:02}")
+
+
+class TestConcurrentAccess:
+    def test_should_keep_marks_written_by_another_process(self, tmp_path: Path) -> None:
+        db_path = str(tmp_path / "worktime.db")
+        ui = NullUserInterface()
+        app = App(app_config={}, user_interface=ui, db_if=WorktimeSqliteDbInterface(create_sqlite_engine(db_path)))
+        app.add_to_db("11.09.2023 08:00")
+        cli = WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+        cli.punch(str(DATE_1.toordinal()), "12:00", table=Worktime)
+        app.add_to_db("11.09.2023 13:00")
+
+        found = cli.find_in_db(table=Worktime, key=str(DATE_1.toordinal()))
+        assert found is not None and found[0].times == "08:00 12:00 13:00"
+        assert ui.row_values("11.09.2023")["time_marks"] == "08:00 12:00 13:00"
+
+    def test_should_show_rows_changed_by_another_process(self, tmp_path: Path) -> None:
+        db_path = str(tmp_path / "worktime.db")
+        ui = NullUserInterface()
+        app = App(app_config={}, user_interface=ui, db_if=WorktimeSqliteDbInterface(create_sqlite_engine(db_path)))
+        app.add_to_db("11.09.2023 08:00")
+        WorktimeSqliteDbInterface(create_sqlite_engine(db_path)).punch(str(DATE_1.toordinal()), "12:00", table=Worktime)
+        app.fill_ui_with_workdays(limit=10)
+        assert ui.row_values("11.09.2023")["time_marks"] == "08:00 12:00"
+
+    @pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs forked processes")
+    def test_should_not_lose_marks_submitted_by_concurrent_apps(self, tmp_path: Path) -> None:
+        db_path = str(tmp_path / "worktime.db")
+        WorktimeSqliteDbInterface(create_sqlite_engine(db_path)).upsert(
+            [WorkDay(DATE_1, [time(23, 59)]).as_db()], table=Worktime
+        )
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=_submit_time_marks, args=(db_path, writer)) for writer in range(WRITERS)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+        assert [process.exitcode for process in processes] == [0] * WRITERS
+
+        found = WorktimeSqliteDbInterface(create_sqlite_engine(db_path)).find_in_db(
+            table=Worktime, key=str(DATE_1.toordinal())
+        )
+        assert found is not None
+        assert len(found[0].as_workday().times) == WRITERS * WRITES_PER_WRITER + 1
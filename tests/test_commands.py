@@ -0,0 +1,72 @@
+import logging
+from datetime import date, datetime
+
+from packages.commands import (
+    CommandQueue, AddMarks, EditRow, DeleteRows, LoadAll, LoadOlder, ReplayJournal, ApplyFilter, Punch, coalesce
+)
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+DATE_2 = date(2023, 9, 12)
+
+
+class TestCoalesce:
+    def test_should_merge_runs_of_one_kind(self) -> None:
+        commands = [
+            AddMarks(("11.09.2023 08:00",)),
+            AddMarks(("11.09.2023 08:00",)),
+            AddMarks(("11.09.2023 16:00",)),
+            LoadAll(),
+            LoadAll(),
+            DeleteRows((DATE_1,)),
+            DeleteRows((DATE_1, DATE_2)),
+            EditRow(("11.09.2023 vacation",)),
+            EditRow(("11.09.2023 sick",)),
+            ApplyFilter("sick"),
+            ApplyFilter("sick 2023"),
+            LoadOlder(),
+            LoadOlder(),
+        ]
+        assert coalesce(commands) == [
+            AddMarks(("11.09.2023 08:00", "11.09.2023 16:00")),
+            LoadAll(),
+            DeleteRows((DATE_1, DATE_2)),
+            EditRow(("11.09.2023 vacation", "11.09.2023 sick")),
+            ApplyFilter("sick 2023"),
+            LoadOlder(),
+        ]
+
+    def test_should_keep_order_and_every_undo(self) -> None:
+        commands = [
+            AddMarks(("11.09.2023 08:00",)),
+            ReplayJournal(),
+            ReplayJournal(),
+            AddMarks(("11.09.2023 16:00",)),
+            ReplayJournal(redo=True),
+        ]
+        assert coalesce(commands) == commands
+
+    def test_should_keep_repeated_marks_apart_from_each_other(self) -> None:
+        commands = [
+            AddMarks(("14.07.2023 08:00",)),
+            AddMarks(("14.07.2023 vacation",)),
+            AddMarks(("14.07.2023 08:00",)),
+        ]
+        assert coalesce(commands) == [AddMarks(("14.07.2023 08:00", "14.07.2023 vacation", "14.07.2023 08:00"))]
+
+    def test_should_drop_repeated_punches_of_one_minute(self) -> None:
+        commands = [
+            Punch(datetime(2023, 9, 11, 8)),
+            Punch(datetime(2023, 9, 11, 8)),
+            Punch(datetime(2023, 9, 11, 8, 1)),
+        ]
+        assert coalesce(commands) == [Punch(datetime(2023, 9, 11, 8)), Punch(datetime(2023, 9, 11, 8, 1))]
+
+    def test_should_drain_queue_coalesced(self) -> None:
+        queue = CommandQueue()
+        for _ in range(3):
+            queue.put(LoadAll())
+        assert len(queue) == 3
+        assert queue.drain() == [LoadAll()]
+        assert len(queue) == 0
@@ -0,0 +1,366 @@
+import logging
+import multiprocessing
+from datetime import date, time, timedelta
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+import pytest
+from sqlalchemy import Engine, create_engine, event, text
+
+from packages.constants import WorkDay, DayType, DEFAULT_USER_ID
+from packages.db import database_interface
+from packages.db.database_interface import (
+    DbInterface, DbInsertError, WorktimeSqliteDbInterface, JOURNAL_KEEP_TXNS, JOURNAL_COMPACT_EVERY, query_cache,
+    worktime_statements,
+)
+from packages.db.log_store import LogStore, WorktimeLogDbInterface
+from packages.db.models import Worktime, create_sqlite_engine
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+DATE_2 = date(2023, 9, 12)
+WRITERS = 4
+WRITES_PER_WRITER = 25
+TIMES_1 = [time(8), time(12), time(13), time(18)]
+TIMES_2 = [time(8), time(16)]
+
+# interface of one storage scoped to the given user
+DbFactory = Callable[[str], DbInterface]
+
+
+def _key(workday: WorkDay) -> str:
+    return str(workday.date.toordinal())
+
+
+@pytest.fixture
+def engine(tmp_path: Path) -> Engine:
+    return create_engine(f"sqlite:///{tmp_path / 'worktime.db'}")
+
+
+@pytest.fixture(params=["sqlite", "log"])
+def open_db(request: pytest.FixtureRequest, tmp_path: Path) -> Iterator[DbFactory]:
+    """Every storage backend has to pass the tests using this fixture"""
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'worktime.db'}")
+        yield lambda user_id: WorktimeSqliteDbInterface(engine, user_id=user_id)
+        return
+    store = LogStore(str(tmp_path / "worktime_store"))
+    yield lambda user_id: WorktimeLogDbInterface(store, user_id=user_id)
+    store.close()
+
+
+class TestUserPartitioning:
+    def test_should_scope_rows_per_user(self, open_db: DbFactory) -> None:
+        alice = open_db("alice")
+        bob = open_db("bob")
+        alice.write_to_db([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        bob.write_to_db([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        bob.write_to_db([WorkDay(DATE_2, TIMES_2, DayType.VACATION).as_db()], table=Worktime)
+
+        assert [row.as_workday() for row in alice.read(table=Worktime)] == [WorkDay(DATE_1, TIMES_1)]
+        assert len(bob.read(table=Worktime)) == 2
+        found = alice.find_in_db(table=Worktime, key=str(DATE_1.toordinal()))
+        assert found is not None and found[0].as_workday() == WorkDay(DATE_1, TIMES_1)
+
+        bob.delete([str(DATE_1.toordinal())], table=Worktime)
+        assert alice.find_in_db(table=Worktime, key=str(DATE_1.toordinal())) is not None
+        assert alice.users(table=Worktime) == ["alice", "bob"]
+
+    def test_should_aggregate_team_totals_in_one_pass(self, open_db: DbFactory) -> None:
+        for user_id in ("alice", "bob"):
+            db_if = open_db(user_id)
+            db_if.write_to_db([WorkDay(DATE_1, TIMES_1).as_db(), WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        db_if = open_db(DEFAULT_USER_ID)
+        totals = db_if.team_totals(table=Worktime)
+        assert set(totals) == {"alice", "bob"}
+        assert totals["alice"]["worktime"] == timedelta(hours=16)
+        assert totals["alice"]["overtime"] == timedelta(hours=1)
+        assert totals["bob"]["whole_time"] == timedelta(hours=18)
+
+        only_second_day = db_if.team_totals(table=Worktime, start=str(DATE_2.toordinal()))
+        assert only_second_day["bob"]["whole_time"] == timedelta(hours=8)
+
+    def test_should_migrate_single_user_table(self, engine: Engine) -> None:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE worktime (date TEXT PRIMARY KEY, times TEXT, day_type TEXT)"))
+            connection.execute(text(f"INSERT INTO worktime VALUES ('{DATE_1.toordinal()}', '08:00 16:00', '')"))
+        db_if = WorktimeSqliteDbInterface(engine)
+        rows = db_if.read(table=Worktime)
+        assert len(rows) == 1
+        assert rows[0].user_id == DEFAULT_USER_ID
+        assert rows[0].as_workday() == WorkDay(DATE_1, TIMES_2)
+
+
+class TestJournal:
+    @staticmethod
+    def _workdays(db_if: DbInterface) -> List[WorkDay]:
+        return sorted(row.as_workday() for row in db_if.read(table=Worktime))
+
+    def test_should_undo_and_redo_changes(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        key = str(DATE_1.toordinal())
+        db_if.add([WorkDay(DATE_1, TIMES_1).as_db(), WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        db_if.update([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        db_if.delete([key], table=Worktime)
+        assert self._workdays(db_if) == [WorkDay(DATE_2, TIMES_2)]
+
+        assert db_if.undo(table=Worktime) == [key]
+        assert self._workdays(db_if) == [WorkDay(DATE_1, TIMES_2), WorkDay(DATE_2, TIMES_2)]
+        assert db_if.undo(table=Worktime) == [key]
+        assert self._workdays(db_if) == [WorkDay(DATE_1, TIMES_1), WorkDay(DATE_2, TIMES_2)]
+        assert db_if.undo(table=Worktime) is not None
+        assert self._workdays(db_if) == []
+        assert db_if.undo(table=Worktime) is None
+
+        assert db_if.redo(table=Worktime) is not None
+        assert db_if.redo(table=Worktime) == [key]
+        assert self._workdays(db_if) == [WorkDay(DATE_1, TIMES_2), WorkDay(DATE_2, TIMES_2)]
+
+    def test_should_drop_redo_history_on_new_change(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        db_if.add([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        db_if.undo(table=Worktime)
+        db_if.upsert([WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        assert db_if.redo(table=Worktime) is None
+        assert self._workdays(db_if) == [WorkDay(DATE_2, TIMES_2)]
+
+    def test_should_keep_journals_per_user(self, open_db: DbFactory) -> None:
+        alice = open_db("alice")
+        bob = open_db("bob")
+        alice.add([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        bob.add([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        alice.undo(table=Worktime)
+        assert self._workdays(alice) == []
+        assert self._workdays(bob) == [WorkDay(DATE_1, TIMES_2)]
+
+    def test_should_delete_range_and_day_type_as_one_transaction(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        other = db_if.for_user("bob")
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_2) for i in range(1500)]
+        workdays[3] = WorkDay(workdays[3].date, TIMES_2, DayType.VACATION)
+        db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+        other.upsert([workday.as_db() for workday in workdays[:10]], table=Worktime)
+
+        deleted = db_if.delete_where(table=Worktime, start=str(workdays[2].date.toordinal()), day_types=[""])
+        assert len(deleted) == 1497
+        assert self._workdays(db_if) == workdays[:2] + [workdays[3]]
+        assert db_if.delete_where(table=Worktime, day_types=["vacation"]) == [_key(workdays[3])]
+        assert len(self._workdays(other)) == 10
+
+        db_if.undo(table=Worktime)
+        db_if.undo(table=Worktime)
+        assert self._workdays(db_if) == workdays
+        db_if.delete([_key(workday) for workday in workdays], table=Worktime)
+        assert self._workdays(db_if) == []
+
+    def test_should_compact_journal(self, engine: Engine) -> None:
+        db_if = WorktimeSqliteDbInterface(engine)
+        for i in range(JOURNAL_KEEP_TXNS + JOURNAL_COMPACT_EVERY):
+            db_if.upsert([WorkDay(DATE_1 + timedelta(days=i), TIMES_2).as_db()], table=Worktime)
+        with engine.connect() as connection:
+            entries = connection.execute(text("SELECT count(*) FROM journal")).scalar()
+        assert entries == JOURNAL_KEEP_TXNS
+
+
+class TestPaging:
+    def test_should_page_back_in_whole_weeks(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        # 2023-09-11 is a monday, 40 consecutive days with the weekends skipped
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_2) for i in range(40) if i % 7 < 5]
+        db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+
+        pages: List[List[WorkDay]] = []
+        before = None
+        while True:
+            page = [row.as_workday() for row in db_if.read_page(table=Worktime, before=before, limit=7)]
+            if not page:
+                break
+            assert page == sorted(page, reverse=True)
+            assert page[-1].date.weekday() == 0 or page[-1] == workdays[0]
+            pages.append(page)
+            before = page[-1].as_db()["date"]
+
+        assert [len(page) for page in pages] == [10, 10, 10]
+        assert sorted(workday for page in pages for workday in page) == workdays
+
+
+class TestQueryCache:
+    def test_should_read_once_between_writes(self, engine: Engine) -> None:
+        db_if = WorktimeSqliteDbInterface(engine)
+        db_if.upsert([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        statements: List[str] = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        key = str(DATE_1.toordinal())
+
+        for _ in range(3):
+            assert [row.as_workday() for row in db_if.read(table=Worktime, limit=10)] == [WorkDay(DATE_1, TIMES_1)]
+            assert db_if.find_in_db(table=Worktime, key=key) is not None
+            assert len(db_if.read_page(table=Worktime, limit=7)) == 1
+        # read, find and the two queries of a page
+        assert len(statements) == 4
+
+        db_if.for_user("bob").upsert([WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        statements.clear()
+        db_if.read(table=Worktime, limit=10)
+        assert len(statements) == 1
+
+    def test_should_not_serve_results_read_before_a_write(self, engine: Engine) -> None:
+        db_if = WorktimeSqliteDbInterface(engine)
+        other = WorktimeSqliteDbInterface(engine)
+        key = str(DATE_1.toordinal())
+        assert db_if.find_in_db(table=Worktime, key=key) is None
+        other.upsert([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        found = db_if.find_in_db(table=Worktime, key=key)
+        assert found is not None and found[0].as_workday() == WorkDay(DATE_1, TIMES_2)
+
+        db_if.read(table=Worktime).clear()
+        assert len(db_if.read(table=Worktime)) == 1
+        db_if.undo(table=Worktime)
+        assert db_if.read(table=Worktime) == []
+        assert db_if.existing_keys([key], table=Worktime) == []
+
+
+    def test_should_not_serve_results_read_before_a_commit_of_another_engine(self, tmp_path: Path) -> None:
+        db_path = str(tmp_path / "worktime.db")
+        engine = create_sqlite_engine(db_path)
+        db_if = WorktimeSqliteDbInterface(engine)
+        other = WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+        key = str(DATE_1.toordinal())
+        db_if.upsert([WorkDay(DATE_1, [time(8)]).as_db()], table=Worktime)
+        assert db_if.find_in_db(table=Worktime, key=key) is not None
+        changes = db_if.external_changes()
+
+        statements: List[str] = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        db_if.find_in_db(table=Worktime, key=key)
+        assert statements == []
+        assert db_if.external_changes() == changes
+
+        other.punch(key, "12:00", table=Worktime)
+        # the next operation starts with the check
+        assert db_if.external_changes() == changes + 1
+        found = db_if.find_in_db(table=Worktime, key=key)
+        assert found is not None and found[0].times == "08:00 12:00"
+        db_if.punch(key, "16:00", table=Worktime)
+        assert db_if.external_changes() == changes + 1
+
+    def test_should_not_take_a_rolled_back_write_for_another_process(
+            self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        db_if = WorktimeSqliteDbInterface(create_sqlite_engine(str(tmp_path / "worktime.db")))
+        db_if.upsert([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        changes = db_if.external_changes()
+
+        def fail(*args: object) -> None:
+            raise RuntimeError("stats are not written")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(db_if, "_refresh_stats", fail)
+            with pytest.raises(DbInsertError):
+                db_if.upsert([WorkDay(DATE_2, TIMES_1).as_db()], table=Worktime)
+        db_if.upsert([WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        assert db_if.external_changes() == changes
+
+    def test_should_close_the_watch_connection_on_dispose(self, tmp_path: Path) -> None:
+        engine = create_sqlite_engine(str(tmp_path / "worktime.db"))
+        db_if = WorktimeSqliteDbInterface(engine)
+        db_if.external_changes()
+        cache = query_cache(engine)
+        assert cache._watch is not None
+        engine.dispose()
+        assert cache._watch is None
+
+
+class TestStatements:
+    def test_should_build_statements_once_per_table(self) -> None:
+        assert worktime_statements(Worktime) is worktime_statements(Worktime)
+
+    def test_should_update_only_stored_rows(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        db_if.upsert([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        db_if.update([WorkDay(DATE_1, TIMES_2).as_db(), WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+
+        assert [row.as_workday() for row in db_if.read(table=Worktime)] == [WorkDay(DATE_1, TIMES_2)]
+        found = db_if.find_many_in_db(table=Worktime, keys=[str(DATE_1.toordinal()), str(DATE_2.toordinal())])
+        assert [row.as_workday() for row in found] == [WorkDay(DATE_1, TIMES_2)]
+        assert db_if.undo(table=Worktime) == [str(DATE_1.toordinal())]
+        assert [row.as_workday() for row in db_if.read(table=Worktime)] == [WorkDay(DATE_1, TIMES_1)]
+
+
+class TestPunch:
+    @staticmethod
+    def _workdays(db_if: DbInterface) -> List[WorkDay]:
+        return sorted(row.as_workday() for row in db_if.read(table=Worktime))
+
+    def test_should_append_marks_and_undo_them_one_by_one(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        key = str(DATE_1.toordinal())
+        assert db_if.punch(key, "08:00", table=Worktime) == dict(date=key, times="08:00", day_type="")
+        assert db_if.punch(key, "12:00", table=Worktime) == dict(date=key, times="08:00 12:00", day_type="")
+        assert self._workdays(db_if) == [WorkDay(DATE_1, [time(8), time(12)])]
+
+        assert db_if.undo(table=Worktime) == [key]
+        assert self._workdays(db_if) == [WorkDay(DATE_1, [time(8)])]
+        assert db_if.undo(table=Worktime) == [key]
+        assert self._workdays(db_if) == []
+
+    def test_should_combine_marks_out_of_order_like_upsert(self, open_db: DbFactory) -> None:
+        db_if = open_db(DEFAULT_USER_ID)
+        key_1, key_2 = str(DATE_1.toordinal()), str(DATE_2.toordinal())
+        db_if.upsert([WorkDay(DATE_1, TIMES_2).as_db(), WorkDay(DATE_2, [], DayType.VACATION).as_db()], table=Worktime)
+
+        assert db_if.punch(key_1, "12:00", table=Worktime)["times"] == "08:00 12:00 16:00"
+        assert db_if.punch(key_1, "16:00", table=Worktime)["times"] == "08:00 12:00 16:00"
+        assert db_if.punch(key_2, "09:00", table=Worktime) == dict(date=key_2, times="09:00", day_type="")
+        assert self._workdays(db_if) == [WorkDay(DATE_1, [time(8), time(12), time(16)]), WorkDay(DATE_2, [time(9)])]
+
+    def test_should_punch_through_upsert_without_returning(
+            self, engine: Engine, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(database_interface, "SQLITE_RETURNING", False)
+        db_if = WorktimeSqliteDbInterface(engine)
+        key = str(DATE_1.toordinal())
+        assert db_if.punch(key, "08:00", table=Worktime) == dict(date=key, times="08:00", day_type="")
+        assert db_if.punch(key, "12:00", table=Worktime) == dict(date=key, times="08:00 12:00", day_type="")
+        assert db_if.undo(table=Worktime) == [key]
+        assert self._workdays(db_if) == [WorkDay(DATE_1, [time(8)])]
+
+    def test_should_stamp_version_and_statistics(self, engine: Engine) -> None:
+        db_if = WorktimeSqliteDbInterface(engine)
+        key = str(DATE_1.toordinal())
+        db_if.punch(key, "08:00", table=Worktime)
+        db_if.punch(key, "17:00", table=Worktime)
+
+        changes = db_if.changes_since(0, table=Worktime)
+        assert changes == {(DEFAULT_USER_ID, key): dict(date=key, times="08:00 17:00", day_type="")}
+        assert db_if.month_stats()
+        found = db_if.find_in_db(table=Worktime, key=key)
+        assert found is not None and found[0].version == db_if.clock()
+
+
+def _write_time_marks(db_path: str, writer: int) -> None:
+    """Adds a time mark of its own to DATE_1 per write, a lost update would drop some of them"""
+    db_if = WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+    for i in range(WRITES_PER_WRITER):
+        minute = writer * WRITES_PER_WRITER + i
+        db_if.upsert([WorkDay(DATE_1, [time(minute // 60, minute % 60)]).as_db()], table=Worktime)
+
+
+class TestConcurrentAccess:
+    @pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs forked processes")
+    def test_should_not_lose_updates_of_concurrent_processes(self, tmp_path: Path) -> None:
+        db_path = str(tmp_path / "worktime.db")
+        WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=_write_time_marks, args=(db_path, writer)) for writer in range(WRITERS)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+        assert [process.exitcode for process in processes] == [0] * WRITERS
+
+        db_if = WorktimeSqliteDbInterface(create_sqlite_engine(db_path))
+        found = db_if.find_in_db(table=Worktime, key=str(DATE_1.toordinal()))
+        assert found is not None
+        assert len(found[0].as_workday().times) == WRITERS * WRITES_PER_WRITER
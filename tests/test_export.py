@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+import logging
+from datetime import date, time
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.export import ExportFormat, export_worktime, read_binary
+from packages.db.models import Worktime
+
+_log = logging.getLogger(__name__)
+
+WORKDAYS = [
+    WorkDay(date(2023, 9, 11), [time(8), time(12), time(13), time(18)]),
+    WorkDay(date(2023, 9, 12), [time(8), time(16)], DayType.VACATION),
+    WorkDay(date(2023, 9, 13)),
+]
+
+
+@pytest.fixture
+def db_if(tmp_path: Path) -> WorktimeSqliteDbInterface:
+    db_if = WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / 'worktime.db'}"), user_id="alice")
+    db_if.add([workday.as_db() for workday in WORKDAYS], table=Worktime)
+    return db_if
+
+
+class TestExport:
+    def test_should_export_csv_with_derived_columns(self, db_if: WorktimeSqliteDbInterface) -> None:
+        stream = io.BytesIO()
+        assert export_worktime(db_if, stream, ExportFormat.CSV, derived=True, batch_size=2) == 3
+        rows = list(csv.DictReader(io.StringIO(stream.getvalue().decode("utf-8"))))
+        assert [row["date"] for row in rows] == [str(workday.date.toordinal()) for workday in WORKDAYS]
+        assert rows[0]["user_id"] == "alice"
+        assert rows[0]["worktime"] == "8:00:00"
+        assert rows[0]["overtime"] == "1:00:00"
+        assert rows[1]["day_type"] == "vacation"
+        assert [row["worktime"] for row in rows] == [str(workday.worktime) for workday in WORKDAYS]
+
+    def test_should_export_ndjson_in_as_json_shape(self, db_if: WorktimeSqliteDbInterface) -> None:
+        stream = io.BytesIO()
+        export_worktime(db_if, stream, ExportFormat.NDJSON, batch_size=2)
+        lines = stream.getvalue().decode("utf-8").splitlines()
+        assert lines == [row.as_json() for row in reversed(db_if.read(table=Worktime))]
+
+        stream = io.BytesIO()
+        export_worktime(db_if, stream, ExportFormat.NDJSON, derived=True)
+        record = json.loads(stream.getvalue().decode("utf-8").splitlines()[0])
+        assert record["derived"] == {"worktime": "8:00:00", "overtime": "1:00:00"}
+
+    @pytest.mark.parametrize("derived", [False, True])
+    def test_should_read_back_binary_export(self, db_if: WorktimeSqliteDbInterface, derived: bool) -> None:
+        stream = io.BytesIO()
+        export_worktime(db_if, stream, ExportFormat.BINARY, derived=derived)
+        stream.seek(0)
+        assert list(read_binary(stream)) == [(workday, "alice") for workday in WORKDAYS]
@@ -0,0 +1,68 @@
+import io
+import logging
+from datetime import date, time
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import create_engine
+
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.export import ExportFormat, export_worktime
+from packages.db.importer import ConflictPolicy, import_worktime
+from packages.db.models import Worktime
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+DATE_2 = date(2023, 9, 12)
+WORKDAYS = [
+    WorkDay(DATE_1, [time(8), time(12)]),
+    WorkDay(DATE_2, [time(8), time(16)], DayType.VACATION),
+]
+
+
+def _db_if(path: Path, user_id: str = "alice") -> WorktimeSqliteDbInterface:
+    return WorktimeSqliteDbInterface(create_engine(f"sqlite:///{path}"), user_id=user_id)
+
+
+def _export(db_if: WorktimeSqliteDbInterface, export_format: ExportFormat) -> io.StringIO:
+    stream = io.BytesIO()
+    export_worktime(db_if, stream, export_format, all_users=True)
+    return io.StringIO(stream.getvalue().decode("utf-8"))
+
+
+class TestImport:
+    @pytest.mark.parametrize("export_format", [ExportFormat.CSV, ExportFormat.NDJSON])
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_should_restore_export(self, tmp_path: Path, export_format: ExportFormat, workers: int) -> None:
+        source = _db_if(tmp_path / "source.db")
+        source.add([workday.as_db() for workday in WORKDAYS], table=Worktime)
+        source.for_user("bob").add([WORKDAYS[0].as_db()], table=Worktime)
+
+        target = _db_if(tmp_path / "target.db")
+        result = import_worktime(target, _export(source, export_format), export_format, workers=workers, chunk_size=1)
+        assert (result.read, result.written, result.rejected) == (3, 3, [])
+        assert sorted(row.as_workday() for row in target.read(table=Worktime)) == WORKDAYS
+        assert [row.as_workday() for row in target.for_user("bob").read(table=Worktime)] == [WORKDAYS[0]]
+
+    @pytest.mark.parametrize(
+        "policy, times", [(ConflictPolicy.MERGE, [time(8), time(12), time(18)]), (ConflictPolicy.REPLACE, [time(18)])]
+    )
+    def test_should_resolve_conflicts_by_policy(
+            self, tmp_path: Path, policy: ConflictPolicy, times: List[time]
+    ) -> None:
+        db_if = _db_if(tmp_path / "worktime.db")
+        db_if.add([WORKDAYS[0].as_db()], table=Worktime)
+        stream = io.StringIO(f"date,times,day_type\n{DATE_1.toordinal()},18:00,\n")
+        result = import_worktime(db_if, stream, ExportFormat.CSV, policy=policy, workers=1)
+        assert result.written == 1
+        assert [row.as_workday() for row in db_if.read(table=Worktime)] == [WorkDay(DATE_1, times)]
+
+    def test_should_reject_invalid_rows(self, tmp_path: Path) -> None:
+        db_if = _db_if(tmp_path / "worktime.db")
+        stream = io.StringIO(f"date,times,day_type\n{DATE_1.toordinal()},25:00,\n{DATE_2.toordinal()},08:00,\n")
+        result = import_worktime(db_if, stream, ExportFormat.CSV, workers=1)
+        assert (result.read, result.written) == (2, 1)
+        assert len(result.rejected) == 1 and result.rejected[0].startswith("line 2:")
@@ -0,0 +1,51 @@
+import logging
+
+import pytest
+
+from packages.constants import DayType
+from packages.input_validator import InputValidator
+
+_log = logging.getLogger(__name__)
+
+
+def _type(validator: InputValidator, value: str) -> bool:
+    """Validates the value the way the entry does while it is being typed, one keystroke at a time"""
+    return all(validator.validate(value[: i + 1], value[i], "1", str(i)) for i in range(len(value)))
+
+
+class TestInputValidator:
+    @pytest.mark.parametrize(
+        "value, valid",
+        [
+            ("04.12.2022 08:00 12:00 13:00 18:00", True),
+            ("04.12.2022 08:00 12:00 13:00 18:00 19:00 20:00", False),
+            ("04.12.2022 day off", True),
+            ("04.12.2022 d", True),
+            ("04.12.2022 vacation ", False),
+            ("01.07.2023-14.07.2023 vac", True),
+            ("01.07.2023,03.07.2023-0", True),
+            ("01.07.2023- 08:00", False),
+            ("01.07.2023-14.07.2023-", False),
+            ("01.07.20231", False),
+            ("01.07.2023 08:0a", False),
+        ],
+    )
+    def test_should_validate_typed_input(self, value: str, valid: bool) -> None:
+        assert _type(InputValidator(), value) is valid
+        assert InputValidator().is_valid_prefix(value) is valid
+
+    def test_should_continue_from_common_prefix_after_edit(self) -> None:
+        validator = InputValidator()
+        assert validator.is_valid_prefix("04.12.2022 sick") is True
+        assert validator.is_valid_prefix("04.12.2022 sx") is False
+        assert validator.is_valid_prefix("04.12.2022 holiday") is True
+        assert validator.is_valid_prefix("04.12.2022 08:00") is True
+        assert validator.is_valid_prefix("04.12") is True
+
+    def test_should_take_day_types_from_enum(self) -> None:
+        validator = InputValidator(day_types=[DayType.NORMAL, DayType.SICK])
+        assert validator.is_valid_prefix("04.12.2022 sick") is True
+        assert validator.is_valid_prefix("04.12.2022 vacation") is False
+
+    def test_should_pass_deletions(self) -> None:
+        assert InputValidator().validate("04.12.2022 x", "x", "0", "11") is True
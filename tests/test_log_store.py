@@ -0,0 +1,187 @@
+import logging
+import os
+import random
+from datetime import date, time, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import pytest
+from sqlalchemy import create_engine
+
+from packages import statistics
+from packages.constants import WorkDay
+from packages.db.database_interface import DbInterface, WorktimeSqliteDbInterface
+from packages.db.log_store import (
+    LogStore, LogStoreLockedError, WorktimeLogDbInterface, LOG_FILE_NAME, SNAPSHOT_FILE_NAME
+)
+from packages.db.models import Worktime
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+TIMES_1 = [time(8), time(12), time(13), time(18)]
+TIMES_2 = [time(8), time(16)]
+
+
+def _workdays(db_if: DbInterface) -> List[WorkDay]:
+    return sorted(row.as_workday() for row in db_if.read(table=Worktime))
+
+
+class TestLogStore:
+    def test_should_recover_rows_and_undo_history_on_reopen(self, tmp_path: Path) -> None:
+        store = LogStore(str(tmp_path))
+        db_if = WorktimeLogDbInterface(store)
+        workdays = [WorkDay(DATE_1, TIMES_1), WorkDay(DATE_1 + timedelta(days=1), TIMES_2)]
+        db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+        db_if.delete([str(DATE_1.toordinal())], table=Worktime)
+        db_if.for_user("bob").upsert([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        store.close()
+
+        reopened = WorktimeLogDbInterface(LogStore(str(tmp_path)))
+        assert _workdays(reopened) == [WorkDay(DATE_1 + timedelta(days=1), TIMES_2)]
+        assert reopened.users(table=Worktime) == ["bob", "default"]
+        assert reopened.undo(table=Worktime) == [str(DATE_1.toordinal())]
+        assert WorkDay(DATE_1, TIMES_1) in _workdays(reopened)
+
+    def test_should_drop_a_torn_record_at_the_end_of_the_log(self, tmp_path: Path) -> None:
+        store = LogStore(str(tmp_path))
+        WorktimeLogDbInterface(store).upsert([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        store.close()
+        log_path = tmp_path / LOG_FILE_NAME
+        size = log_path.stat().st_size
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write('{"user_id":"default","op":"wri')
+
+        store = LogStore(str(tmp_path))
+        assert _workdays(WorktimeLogDbInterface(store)) == [WorkDay(DATE_1, TIMES_2)]
+        assert log_path.stat().st_size == size
+        WorktimeLogDbInterface(store).upsert([WorkDay(DATE_1, [time(17)]).as_db()], table=Worktime)
+        store.close()
+        assert _workdays(WorktimeLogDbInterface(LogStore(str(tmp_path)))) == [WorkDay(DATE_1, [*TIMES_2, time(17)])]
+
+    def test_should_fold_the_log_into_a_snapshot(self, tmp_path: Path) -> None:
+        store = LogStore(str(tmp_path), compact_every=10)
+        db_if = WorktimeLogDbInterface(store)
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_2) for i in range(25)]
+        for workday in workdays:
+            db_if.upsert([workday.as_db()], table=Worktime)
+        store.close()
+        log_lines = (tmp_path / LOG_FILE_NAME).read_text(encoding="utf-8").splitlines()
+        assert len(log_lines) == 5
+        assert (tmp_path / SNAPSHOT_FILE_NAME).exists()
+        assert _workdays(WorktimeLogDbInterface(LogStore(str(tmp_path)))) == workdays
+
+    def test_should_skip_log_records_already_in_the_snapshot(self, tmp_path: Path) -> None:
+        store = LogStore(str(tmp_path))
+        db_if = WorktimeLogDbInterface(store)
+        db_if.upsert([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        db_if.upsert([WorkDay(DATE_1, [time(17)]).as_db()], table=Worktime)
+        log = (tmp_path / LOG_FILE_NAME).read_bytes()
+        # a crash after the snapshot replaced the old one, but before the log was emptied
+        store.compact()
+        store.close()
+        (tmp_path / LOG_FILE_NAME).write_bytes(log)
+
+        reopened = WorktimeLogDbInterface(LogStore(str(tmp_path)))
+        assert _workdays(reopened) == [WorkDay(DATE_1, [*TIMES_2, time(17)])]
+        assert reopened.undo(table=Worktime) is not None
+        assert reopened.undo(table=Worktime) is not None
+        assert reopened.undo(table=Worktime) is None
+
+    def test_should_fsync_once_per_batch_of_commits(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        synced: List[int] = []
+        fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+        store = LogStore(str(tmp_path), fsync_batch=4)
+        db_if = WorktimeLogDbInterface(store)
+        for i in range(10):
+            db_if.upsert([WorkDay(DATE_1 + timedelta(days=i), TIMES_2).as_db()], table=Worktime)
+        assert len(synced) == 2
+        store.close()
+        assert len(synced) == 3
+
+    def test_should_refuse_a_store_open_elsewhere(self, tmp_path: Path) -> None:
+        store = LogStore(str(tmp_path))
+        with pytest.raises(LogStoreLockedError):
+            LogStore(str(tmp_path))
+        store.close()
+        LogStore(str(tmp_path)).close()
+
+    def test_should_keep_month_stats_up_to_date_on_commit(
+            self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        store = LogStore(str(tmp_path))
+        db_if = WorktimeLogDbInterface(store)
+        workdays = [WorkDay(date(2023, 1, 2) + timedelta(days=i), TIMES_1) for i in range(300)]
+        db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+        assert sum(len(digests["arrival"]) for digests in db_if.month_stats().values()) == 300
+
+        sketched: List[int] = []
+        build_digests = statistics.build_digests
+
+        def counting_build_digests(days: Iterable[WorkDay]) -> Dict[str, statistics.TDigest]:
+            days = list(days)
+            sketched.append(len(days))
+            return build_digests(days)
+
+        monkeypatch.setattr(statistics, "build_digests", counting_build_digests)
+        db_if.delete([str(DATE_1.toordinal())], table=Worktime)
+        db_if.undo(table=Worktime)
+        db_if.redo(table=Worktime)
+        stats = db_if.month_stats(start=statistics.month_index(DATE_1), end=statistics.month_index(DATE_1))
+        assert sketched == [29, 30, 29]
+        assert {month: len(digests["arrival"]) for month, digests in stats.items()} == {
+            statistics.month_index(DATE_1): 29
+        }
+        store.close()
+
+
+class TestBackendContract:
+    def test_should_match_sqlite_on_random_operations(self, tmp_path: Path) -> None:
+        rnd = random.Random(7)
+        store = LogStore(str(tmp_path / "worktime_store"), compact_every=50)
+        backends: List[DbInterface] = [
+            WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / 'worktime.db'}")),
+            WorktimeLogDbInterface(store),
+        ]
+        for step in range(300):
+            operation = rnd.choice(["upsert", "replace", "delete", "delete_where", "undo", "redo"])
+            day = DATE_1 + timedelta(days=rnd.randrange(60))
+            marks = sorted({time(rnd.randrange(6, 20), rnd.randrange(60)) for _ in range(rnd.choice([2, 4]))})
+            workday = WorkDay(day, marks) if rnd.random() < 0.9 else WorkDay.from_values(f"{day:%d.%m.%Y} sick")
+            user_id = rnd.choice(["default", "bob"])
+            start = workday.as_db()["date"]
+            end = str(int(start) + rnd.randrange(5))
+            results = []
+            for backend in backends:
+                db_if = backend.for_user(user_id)
+                if operation == "upsert":
+                    results.append(db_if.upsert([workday.as_db()], table=Worktime))
+                elif operation == "replace":
+                    results.append(db_if.upsert([workday.as_db()], table=Worktime, replace=True))
+                elif operation == "delete":
+                    keys = db_if.existing_keys([workday.as_db()["date"]], table=Worktime)
+                    results.append(db_if.delete(keys, table=Worktime) if keys else None)
+                elif operation == "delete_where":
+                    results.append(db_if.delete_where(table=Worktime, start=start, end=end, day_types=["sick"]))
+                else:
+                    results.append(db_if.undo(table=Worktime) if operation == "undo" else db_if.redo(table=Worktime))
+            assert results[0] == results[1], f"step {step}: {operation}"
+            if step % 10 == 0:
+                store.close()
+                store = LogStore(store.path, compact_every=50)
+                backends[1] = WorktimeLogDbInterface(store)
+
+        sqlite_if, log_if = backends
+        assert _workdays(sqlite_if) == _workdays(log_if)
+        assert list(sqlite_if.iter_rows(table=Worktime, all_users=True)) == list(
+            log_if.iter_rows(table=Worktime, all_users=True)
+        )
+        sqlite_stats, log_stats = (db_if.month_stats(all_users=True) for db_if in backends)
+        assert list(sqlite_stats) == list(log_stats)
+        for month, digests in sqlite_stats.items():
+            assert {metric: len(digest) for metric, digest in digests.items()} == {
+                metric: len(digest) for metric, digest in log_stats[month].items()
+            }
+        assert sqlite_if.team_totals(table=Worktime) == log_if.team_totals(table=Worktime)
+        store.close()
@@ -0,0 +1,92 @@
+import logging
+from datetime import date, time, timedelta
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime
+from packages.db.rollup import rollup_directory
+
+_log = logging.getLogger(__name__)
+
+# a monday, the week runs into november
+DATE_1 = date(2023, 10, 30)
+TIMES_1 = [time(8), time(12), time(13), time(18)]
+TIMES_2 = [time(8), time(16)]
+
+
+def _write(db_path: Path, user_id: str, workdays: List[WorkDay]) -> None:
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f"sqlite:///{db_path}")
+    WorktimeSqliteDbInterface(engine, user_id=user_id).upsert([day.as_db() for day in workdays], table=Worktime)
+    engine.dispose()
+
+
+@pytest.fixture
+def team_dir(tmp_path: Path) -> Path:
+    team = tmp_path / "team"
+    week = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(5)]
+    _write(team / "alice.db", "default", week)
+    _write(team / "bob" / "worktime.db", "default", [WorkDay(DATE_1, [], DayType.SICK)])
+    _write(team / "shared.db", "carol", [WorkDay(DATE_1 + timedelta(days=7), TIMES_2)])
+    (team / "notes.db").write_text("not a database", encoding="utf-8")
+    return team
+
+
+class TestRollup:
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_should_merge_week_and_month_totals_of_every_database(self, team_dir: Path, workers: int) -> None:
+        report = rollup_directory(str(team_dir), workers=workers)
+        assert report["databases"] == 4
+        assert report["rows"] == 7
+        errors = report["errors"]
+        assert isinstance(errors, dict) and list(errors) == [str(team_dir / "notes.db")]
+
+        members = report["members"]
+        assert isinstance(members, dict)
+        assert sorted(members) == ["alice", "bob/worktime", "carol"]
+        alice_week = members["alice"]["weeks"]["2023-W44"]
+        assert alice_week == dict(days=5, worktime=5 * 8 * 60, pauses=5 * 60, overtime=5 * 60, whole_time=5 * 10 * 60)
+        assert members["alice"]["months"] == {
+            "2023-10": dict(days=2, worktime=2 * 8 * 60, pauses=2 * 60, overtime=2 * 60, whole_time=2 * 10 * 60),
+            "2023-11": dict(days=3, worktime=3 * 8 * 60, pauses=3 * 60, overtime=3 * 60, whole_time=3 * 10 * 60),
+        }
+
+        team = report["team"]
+        assert isinstance(team, dict)
+        assert list(team["weeks"]) == ["2023-W44", "2023-W45"]
+        assert team["weeks"]["2023-W44"]["days"] == 6
+        assert team["weeks"]["2023-W44"]["worktime"] == 5 * 8 * 60
+        assert team["weeks"]["2023-W45"] == dict(days=1, worktime=8 * 60, pauses=0, overtime=0, whole_time=8 * 60)
+        assert team["months"]["2023-11"]["days"] == 4
+
+    def test_should_leave_database_files_unchanged(self, team_dir: Path) -> None:
+        files = {path: path.read_bytes() for path in team_dir.rglob("*") if path.is_file()}
+        rollup_directory(str(team_dir), workers=1)
+        assert {path: path.read_bytes() for path in team_dir.rglob("*") if path.is_file()} == files
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_should_read_single_user_layout_without_migrating(self, team_dir: Path, workers: int) -> None:
+        engine = create_engine(f"sqlite:///{team_dir / 'old.db'}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE worktime (date TEXT PRIMARY KEY, times TEXT, day_type TEXT)"))
+            for i in range(2):
+                ordinal = (DATE_1 + timedelta(days=i)).toordinal()
+                connection.execute(text(f"INSERT INTO worktime VALUES ('{ordinal}', '08:00 16:00', NULL)"))
+        engine.dispose()
+        old_db = (team_dir / "old.db").read_bytes()
+
+        report = rollup_directory(str(team_dir), workers=workers)
+        assert report["rows"] == 9
+        errors = report["errors"]
+        assert isinstance(errors, dict) and list(errors) == [str(team_dir / "notes.db")]
+        members = report["members"]
+        assert isinstance(members, dict)
+        assert members["old"]["weeks"]["2023-W44"] == dict(
+            days=2, worktime=2 * 8 * 60, pauses=0, overtime=0, whole_time=2 * 8 * 60
+        )
+        assert (team_dir / "old.db").read_bytes() == old_db
@@ -0,0 +1,94 @@
+import logging
+import random
+from datetime import date, time, timedelta
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import Engine, create_engine, text
+
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime
+from packages.statistics import TDigest, month_index, merge_digests
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+
+
+def _exact_quantile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@pytest.fixture
+def engine(tmp_path: Path) -> Engine:
+    return create_engine(f"sqlite:///{tmp_path / 'worktime.db'}")
+
+
+class TestTDigest:
+    def test_should_estimate_quantiles_of_a_long_stream(self) -> None:
+        rnd = random.Random(0)
+        values = [rnd.gauss(480, 30) for _ in range(20000)]
+        digest = TDigest()
+        for value in values:
+            digest.add(value)
+        for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+            estimate = digest.quantile(q)
+            assert estimate is not None and abs(estimate - _exact_quantile(values, q)) < 2
+        assert digest.quantile(0) == min(values) and digest.quantile(1) == max(values)
+        assert len(TDigest.from_json(digest.to_json())._centroids) <= 2 * digest.compression
+
+    def test_should_merge_into_digest_of_the_whole_stream(self) -> None:
+        rnd = random.Random(1)
+        parts = [[rnd.uniform(420, 600) for _ in range(rnd.randrange(5, 30))] for _ in range(24)]
+        digests = []
+        for part in parts:
+            digest = TDigest()
+            for value in part:
+                digest.add(value)
+            digests.append(TDigest.from_json(digest.to_json()))
+        merged = TDigest()
+        for digest in digests:
+            merged.merge(digest)
+        values = [value for part in parts for value in part]
+        assert len(merged) == len(values)
+        median = merged.quantile(0.5)
+        assert median is not None and abs(median - _exact_quantile(values, 0.5)) < 3
+
+    def test_should_have_no_quantile_when_empty(self) -> None:
+        assert TDigest().quantile(0.5) is None
+
+
+class TestStoredStatistics:
+    def test_should_keep_month_sketches_up_to_date_on_writes(self, engine: Engine) -> None:
+        db_if = WorktimeSqliteDbInterface(engine)
+        workdays = [
+            WorkDay(DATE_1 + timedelta(days=i), [time(8, i % 30), time(12), time(12, 30), time(17)]) for i in range(40)
+        ]
+        db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+        months = db_if.month_stats()
+        assert list(months) == [month_index(date(2023, 9, 1)), month_index(date(2023, 10, 1))]
+        assert len(months[month_index(DATE_1)]["arrival"]) == 20
+        assert months[month_index(DATE_1)]["pauses"].quantile(0.5) == 30
+
+        db_if.upsert([WorkDay(DATE_1, [], DayType.VACATION).as_db()], table=Worktime, replace=True)
+        db_if.delete([str(workdays[-1].date.toordinal())], table=Worktime)
+        months = db_if.month_stats()
+        assert len(months[month_index(DATE_1)]["arrival"]) == 19
+        assert len(merge_digests(months.values())["departure"]) == 38
+        db_if.undo(table=Worktime)
+        assert len(merge_digests(db_if.month_stats().values())["departure"]) == 39
+
+    def test_should_merge_users_and_build_sketches_of_an_old_database(self, engine: Engine) -> None:
+        for user_id in ("alice", "bob"):
+            WorktimeSqliteDbInterface(engine, user_id=user_id).upsert(
+                [WorkDay(DATE_1, [time(8), time(16)]).as_db()], table=Worktime
+            )
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE worktime_stats"))
+        db_if = WorktimeSqliteDbInterface(engine, user_id="alice")
+        assert len(db_if.month_stats()[month_index(DATE_1)]["arrival"]) == 1
+        assert len(db_if.month_stats(all_users=True)[month_index(DATE_1)]["arrival"]) == 2
+        assert db_if.month_stats(start=month_index(DATE_1) + 1) == {}
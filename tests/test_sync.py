@@ -0,0 +1,90 @@
+import logging
+from datetime import date, time
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import create_engine
+
+from packages.constants import WorkDay, DayType
+from packages.db import database_interface
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime
+from packages.db.sync import sync_databases
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+DATE_2 = date(2023, 9, 12)
+DATE_3 = date(2023, 9, 13)
+TIMES_1 = [time(8), time(12)]
+TIMES_2 = [time(13), time(17)]
+TIMES_VACATION = [time(8), time(16)]
+
+
+@pytest.fixture
+def laptop(tmp_path: Path) -> WorktimeSqliteDbInterface:
+    return WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / 'laptop.db'}"))
+
+
+@pytest.fixture
+def desktop(tmp_path: Path) -> WorktimeSqliteDbInterface:
+    return WorktimeSqliteDbInterface(create_engine(f"sqlite:///{tmp_path / 'desktop.db'}"))
+
+
+def _workdays(db_if: WorktimeSqliteDbInterface) -> List[WorkDay]:
+    return sorted(row.as_workday() for row in db_if.read(table=Worktime))
+
+
+class TestSync:
+    @pytest.mark.parametrize("returning", [True, False])
+    def test_should_exchange_only_changed_rows(
+            self,
+            laptop: WorktimeSqliteDbInterface,
+            desktop: WorktimeSqliteDbInterface,
+            returning: bool,
+            monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        # SQLite before 3.35 bumps the clock without RETURNING
+        monkeypatch.setattr(database_interface, "SQLITE_RETURNING", returning)
+        laptop.upsert([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        desktop.upsert([WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        result = sync_databases(laptop, desktop)
+        assert (result.sent, result.received, result.conflicts) == (1, 1, 0)
+        assert _workdays(laptop) == _workdays(desktop) == [WorkDay(DATE_1, TIMES_1), WorkDay(DATE_2, TIMES_2)]
+
+        result = sync_databases(laptop, desktop)
+        assert (result.sent, result.received) == (0, 0)
+
+        desktop.upsert([WorkDay(DATE_3, TIMES_1).as_db()], table=Worktime)
+        result = sync_databases(desktop, laptop)
+        assert (result.sent, result.received) == (1, 0)
+        assert _workdays(laptop) == _workdays(desktop)
+        assert desktop.clock() == 3
+
+    def test_should_pass_deletes_on(
+            self, laptop: WorktimeSqliteDbInterface, desktop: WorktimeSqliteDbInterface
+    ) -> None:
+        laptop.upsert([WorkDay(DATE_1, TIMES_1).as_db(), WorkDay(DATE_2, TIMES_2).as_db()], table=Worktime)
+        sync_databases(laptop, desktop)
+        desktop.delete([str(DATE_1.toordinal())], table=Worktime)
+        sync_databases(laptop, desktop)
+        assert _workdays(laptop) == _workdays(desktop) == [WorkDay(DATE_2, TIMES_2)]
+
+    def test_should_merge_normal_days_changed_on_both_sides(
+            self, laptop: WorktimeSqliteDbInterface, desktop: WorktimeSqliteDbInterface
+    ) -> None:
+        laptop.upsert([WorkDay(DATE_1, TIMES_1).as_db()], table=Worktime)
+        desktop.upsert([WorkDay(DATE_1, TIMES_2).as_db()], table=Worktime)
+        result = sync_databases(laptop, desktop)
+        assert result.conflicts == 1
+        assert _workdays(laptop) == _workdays(desktop) == [WorkDay(DATE_1, TIMES_1 + TIMES_2)]
+
+    @pytest.mark.parametrize("reverse", [False, True])
+    def test_should_resolve_day_type_conflicts_deterministically(
+            self, laptop: WorktimeSqliteDbInterface, desktop: WorktimeSqliteDbInterface, reverse: bool
+    ) -> None:
+        laptop.upsert([WorkDay(DATE_1, TIMES_VACATION, DayType.VACATION).as_db()], table=Worktime)
+        desktop.upsert([WorkDay(DATE_1, TIMES_VACATION, DayType.SICK).as_db()], table=Worktime)
+        sync_databases(*((desktop, laptop) if reverse else (laptop, desktop)))
+        assert _workdays(laptop) == _workdays(desktop) == [WorkDay(DATE_1, TIMES_VACATION, DayType.SICK)]
@@ -0,0 +1,122 @@
+import logging
+from datetime import date, time, timedelta
+from typing import Dict, List, Set
+
+from packages.application import App
+from packages.constants import WorkDay
+from packages.ui.ui import prepare_table_items, TableItem, TableModel, TABLE_FILL_CHUNK_WEEKS
+
+_log = logging.getLogger(__name__)
+
+COLUMNS = ("date", "worktime", "time_marks", "day_type")
+# thursday of week 39, the week runs into October
+DATE_1 = date(2023, 9, 28)
+TIMES_1 = [time(8), time(16, 30)]
+
+
+class TestPrepareTableItems:
+    def test_should_create_each_parent_once_before_its_children(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(5)]
+        items = prepare_table_items(App._group_by_weeks(workdays), COLUMNS, set())
+        iids = [iid for _, _, iid, _, _, _ in items]
+        assert len(iids) == len(set(iids))
+        for parent, _, iid, _, _, _ in items:
+            assert parent == "" or iids.index(parent) < iids.index(iid)
+        assert [iid for parent, _, iid, _, _, _ in items if parent == "week 39 2023"] == [
+            "28.09.2023", "29.09.2023", "30.09.2023", "01.10.2023", "summary_week 39 2023"
+        ]
+        assert items[2][4] == ("28.09.2023", "8:00:00", "08:00 16:30", "")
+        assert items[2][5] == "green"
+
+    def test_should_skip_known_parents_and_place_new_ones_at_index(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(5)]
+        known_parents = {"September 2023", "week 39 2023"}
+        items = prepare_table_items(App._group_by_weeks(workdays), COLUMNS, known_parents, parents_index=0)
+        parents = [(parent, index, iid) for parent, index, iid, _, values, _ in items if not values]
+        assert parents == [("", 0, "October 2023"), ("October 2023", 0, "week 40 2023")]
+        assert known_parents == {"September 2023", "week 39 2023", "October 2023", "week 40 2023"}
+
+    def test_should_keep_date_order_when_rendered_newest_first_in_chunks(self) -> None:
+        # more than one chunk within one year, from the monday of week 1 2023
+        first_day = date(2023, 1, 2)
+        workdays = [WorkDay(first_day + timedelta(days=i), TIMES_1) for i in range(TABLE_FILL_CHUNK_WEEKS * 7 + 30)]
+        newest_first = list(reversed(App._group_by_weeks(workdays)))
+        # the way Treeview places items: parent -> children in display order
+        tree: Dict[str, List[str]] = {"": []}
+        known_parents: Set[str] = set()
+        for i in range(0, len(newest_first), TABLE_FILL_CHUNK_WEEKS):
+            chunk = newest_first[i: i + TABLE_FILL_CHUNK_WEEKS]
+            for parent, index, iid, _, _, _ in prepare_table_items(chunk, COLUMNS, known_parents, parents_index=0):
+                tree[iid] = []
+                tree[parent].insert(0 if index == 0 else len(tree[parent]), iid)
+
+        def walk(item: str) -> List[str]:
+            return [leaf for child in tree[item] for leaf in (walk(child) if tree[child] else [child])]
+
+        data_rows = [iid for iid in walk("") if not iid.startswith("summary")]
+        assert data_rows == [workday.as_dict()["iid"] for workday in workdays]
+
+
+class TestTableModel:
+    @staticmethod
+    def _items(workdays: List[WorkDay]) -> List[TableItem]:
+        return prepare_table_items(App._group_by_weeks(sorted(workdays)), COLUMNS, set())
+
+    def test_should_update_only_changed_rows_and_summary(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(14)]
+        model = TableModel()
+        model.insert(self._items(workdays))
+        workdays[3] = WorkDay(workdays[3].date, [time(8), time(12)])
+        table_diff = model.diff(self._items(workdays))
+        assert [item[2] for item in table_diff.updated] == ["01.10.2023", "summary_week 39 2023"]
+        assert not table_diff.inserted and not table_diff.deleted and not table_diff.reordered
+        model.apply(table_diff)
+        assert model.diff(self._items(workdays)).updated == []
+
+    def test_should_insert_delete_and_reorder_to_target_order(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(14)]
+        model = TableModel()
+        model.insert(self._items(workdays[5:]))
+        target = workdays[:4] + workdays[6:]
+        table_diff = model.diff(self._items(target))
+        # the deleted day's week goes on, only the day itself is deleted
+        assert table_diff.deleted == ["03.10.2023"]
+        assert "September 2023" in [item[2] for item in table_diff.inserted]
+        assert table_diff.reordered[""] == ["September 2023", "October 2023"]
+        model.apply(table_diff)
+        assert model.data_rows() == [workday.date.strftime("%d.%m.%Y") for workday in target]
+        fresh = TableModel()
+        fresh.insert(self._items(target))
+        assert model.items.keys() == fresh.items.keys() and model.children == fresh.children
+
+    def test_should_patch_one_week_in_place(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(14)]
+        model = TableModel()
+        model.insert(self._items(workdays))
+        week = workdays[11:] + [WorkDay(DATE_1 + timedelta(days=14), TIMES_1)]
+        table_diff = model.patch(prepare_table_items([week], COLUMNS, model.parents()))
+        assert [item[2] for item in table_diff.inserted] == ["12.10.2023"]
+        assert [item[2] for item in table_diff.updated] == ["summary_week 41 2023"]
+        children = model.children["week 41 2023"]
+        assert table_diff.reordered == {"week 41 2023": [*children[:-1], "12.10.2023", children[-1]]}
+        assert not table_diff.deleted
+        model.apply(table_diff)
+        fresh = TableModel()
+        fresh.insert(self._items(workdays + week[-1:]))
+        assert model.items == fresh.items and model.children == fresh.children
+
+        new_week = [WorkDay(DATE_1 + timedelta(days=18), TIMES_1)]
+        table_diff = model.patch(prepare_table_items([new_week], COLUMNS, model.parents()))
+        assert [item[2] for item in table_diff.inserted] == ["week 42 2023", "16.10.2023", "summary_week 42 2023"]
+        assert not table_diff.updated and not table_diff.reordered
+        model.apply(table_diff)
+        assert model.data_rows()[-1] == "16.10.2023"
+
+    def test_should_delete_parents_with_their_children(self) -> None:
+        workdays = [WorkDay(DATE_1 + timedelta(days=i), TIMES_1) for i in range(14)]
+        model = TableModel()
+        model.insert(self._items(workdays))
+        table_diff = model.diff(self._items(workdays[4:]))
+        assert table_diff.deleted == ["September 2023"]
+        model.apply(table_diff)
+        assert model.data_rows()[0] == "02.10.2023"
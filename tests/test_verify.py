@@ -0,0 +1,86 @@
+import logging
+from datetime import date, time, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from packages.constants import WorkDay, DayType
+from packages.db.database_interface import WorktimeSqliteDbInterface
+from packages.db.models import Worktime
+from packages.db.verify import check_row, verify_databases
+
+_log = logging.getLogger(__name__)
+
+DATE_1 = date(2023, 9, 11)
+KEY_1 = str(DATE_1.toordinal())
+
+BROKEN_ROWS = [
+    ("1", "08:00 16:00", "", "bad_date"),
+    ("2", "08:00 25:10", "", "bad_time_mark"),
+    ("3", "16:00 08:00", "", "unsorted_time_marks"),
+    ("4", "08:00 12:00 13:00", "", "odd_time_marks"),
+    ("5", "", "", "no_time_marks"),
+    ("6", "09:00 17:00", "vacation", "day_type_time_marks"),
+    ("7", "08:00 16:00", "remote", "unknown_day_type"),
+]
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> str:
+    path = str(tmp_path / "worktime.db")
+    engine = create_engine(f"sqlite:///{path}")
+    db_if = WorktimeSqliteDbInterface(engine)
+    workdays = [WorkDay(DATE_1 + timedelta(days=i), [time(8), time(12), time(13), time(17)]) for i in range(500)]
+    workdays[1] = WorkDay(workdays[1].date, [time(8), time(16)], DayType.VACATION)
+    db_if.upsert([workday.as_db() for workday in workdays], table=Worktime)
+    with engine.begin() as connection:
+        for offset, times, day_type, _ in BROKEN_ROWS:
+            date_key = str(DATE_1.toordinal() + 1000 + int(offset)) if offset != "1" else "7x"
+            connection.execute(
+                text("INSERT INTO worktime (user_id, date, times, day_type) VALUES ('bob', :date, :times, :day_type)"),
+                dict(date=date_key, times=times, day_type=day_type),
+            )
+    engine.dispose()
+    return path
+
+
+class TestVerify:
+    def test_should_pass_rows_as_the_app_stores_them(self) -> None:
+        for workday in (WorkDay(DATE_1, [time(8), time(16)]), WorkDay.from_values("11.09.2023 sick")):
+            row = workday.as_db()
+            assert check_row(row["date"], row["times"], row["day_type"]) == []
+        assert check_row(KEY_1, "08:00 16:00", None) == []
+        assert check_row(KEY_1, "08:00 1600", "") == [("bad_time_mark", "08:00 1600")]
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_should_report_every_broken_row_of_many_databases(self, db_path: str, tmp_path: Path, workers: int) -> None:
+        missing = str(tmp_path / "missing.db")
+        report = verify_databases([db_path, missing], workers=workers)
+        assert report["rows"] == 500 + len(BROKEN_ROWS)
+        databases = report["databases"]
+        assert isinstance(databases, list)
+        assert databases[0]["issues"] == {kind: 1 for _, _, _, kind in BROKEN_ROWS}
+        assert {sample["kind"] for sample in databases[0]["samples"]} == {kind for _, _, _, kind in BROKEN_ROWS}
+        assert databases[1]["issues"] == {"unreadable": 1}
+        assert report["issues"] == len(BROKEN_ROWS) + 1
+        assert not Path(missing).exists()
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_should_verify_single_user_layout_without_migrating(self, tmp_path: Path, workers: int) -> None:
+        path = tmp_path / "old.db"
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE worktime (date TEXT PRIMARY KEY, times TEXT, day_type TEXT)"))
+            connection.execute(text(f"INSERT INTO worktime VALUES ('{KEY_1}', '08:00 16:00', '')"))
+            connection.execute(text(f"INSERT INTO worktime VALUES ('{int(KEY_1) + 1}', '08:00 12:00 13:00', '')"))
+        engine.dispose()
+        content = path.read_bytes()
+
+        report = verify_databases([str(path)], workers=workers)
+        assert report["rows"] == 2
+        databases = report["databases"]
+        assert isinstance(databases, list)
+        assert databases[0]["issues"] == {"odd_time_marks": 1}
+        assert databases[0]["samples"][0]["user_id"] == "default"
+        assert path.read_bytes() == content
@@ -88,6 +88,32 @@ class TestCreateWorkday:
         with pytest.raises(ValueError):
             WorkDay.from_values(input_string)
 
+    @pytest.mark.parametrize(
+        "input_string, skip_weekends, dates",
+        [
+            ("01.12.2022-04.12.2022 vacation", False, [date(2022, 12, day) for day in range(1, 5)]),
+            ("01.12.2022-04.12.2022 vacation", True, [date(2022, 12, 1), date(2022, 12, 2)]),
+            ("04.12.2022,01.12.2022-02.12.2022 vacation", True, [DATE_1, date(2022, 12, 1), date(2022, 12, 2)]),
+            ("04.12.2022 vacation", True, [DATE_1]),
+        ],
+    )
+    def test_should_create_many_workdays_from_date_range_and_list(
+        self, input_string: str, skip_weekends: bool, dates: List[date]
+    ) -> None:
+        workdays = WorkDay.from_values_many(input_string, skip_weekends=skip_weekends)
+        assert workdays == [WorkDay(d, TIMES_5, DayType.VACATION) for d in dates]
+
+    @pytest.mark.parametrize(
+        "input_string", ["04.12.2022-01.12.2022 vacation", "01.12.2022-04.12.2022 08:00 vacation", "01.12.2022-"]
+    )
+    def test_should_raise_value_error_when_wrong_date_range(self, input_string: str) -> None:
+        with pytest.raises(ValueError):
+            WorkDay.from_values_many(input_string)
+
+    def test_should_not_take_date_range_as_single_date(self) -> None:
+        with pytest.raises(ValueError):
+            WorkDay.from_values("01.12.2022-04.12.2022 vacation")
+
 
 class TestAddWorkdays:
     @pytest.mark.parametrize(
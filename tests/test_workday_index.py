@@ -0,0 +1,77 @@
+import logging
+from datetime import date, time, timedelta
+from typing import List
+
+import pytest
+
+from packages.constants import WorkDay, DayType
+from packages.workday_index import WorkDayIndex, WorkDayFilter
+
+_log = logging.getLogger(__name__)
+
+FIRST_DATE = date(2021, 12, 27)
+TIMES_NORMAL = [time(8), time(16)]
+TIMES_OVERTIME = [time(8), time(12), time(13), time(19)]
+TIMES_SHORT = [time(8), time(14)]
+TIMES_TYPED = [time(8), time(16)]
+
+
+def _workdays() -> List[WorkDay]:
+    workdays = []
+    for i in range(800):
+        day = FIRST_DATE + timedelta(days=i)
+        if i % 10 == 3:
+            workdays.append(WorkDay(day, TIMES_TYPED, DayType.SICK))
+        elif i % 10 == 7:
+            workdays.append(WorkDay(day, TIMES_TYPED, DayType.VACATION))
+        else:
+            workdays.append(WorkDay(day, [TIMES_NORMAL, TIMES_OVERTIME, TIMES_SHORT][i % 3]))
+    return workdays
+
+
+class TestWorkDayIndex:
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "sick 2022",
+            "vacation holiday 06.2023",
+            "overtime>1h",
+            "overtime>=1h",
+            "worktime<7h30m normal",
+            "01.03.2022-15.04.2022 overtime>0m",
+            "day off",
+            "15.02.2023",
+        ],
+    )
+    def test_should_match_linear_scan(self, query: str) -> None:
+        workdays = _workdays()
+        workday_filter = WorkDayFilter.from_string(query)
+
+        def matches(workday: WorkDay) -> bool:
+            if workday_filter.start is not None and workday_filter.end is not None:
+                if not workday_filter.start <= workday.date <= workday_filter.end:
+                    return False
+            if workday_filter.day_types is not None and workday.day_type not in workday_filter.day_types:
+                return False
+            for metric in ("worktime", "overtime"):
+                low, high = getattr(workday_filter, metric)
+                value = getattr(workday, metric)
+                if (low is not None and value < low) or (high is not None and value > high):
+                    return False
+            return True
+
+        assert WorkDayIndex(reversed(workdays)).query(workday_filter) == [w for w in workdays if matches(w)]
+
+    def test_should_parse_filter_query(self) -> None:
+        workday_filter = WorkDayFilter.from_string("Sick 2022 overtime>1h worktime<=7h")
+        assert workday_filter.start == date(2022, 1, 1)
+        assert workday_filter.end == date(2022, 12, 31)
+        assert workday_filter.day_types == (DayType.SICK,)
+        assert workday_filter.overtime == (timedelta(hours=1, minutes=1), None)
+        assert workday_filter.worktime == (None, timedelta(hours=7))
+        assert WorkDayFilter.from_string("02.2024").end == date(2024, 2, 29)
+
+    @pytest.mark.parametrize("query", ["sickness", "overtime>", "2022 2023", "worktime=1h"])
+    def test_should_raise_value_error_when_wrong_query(self, query: str) -> None:
+        with pytest.raises(ValueError):
+            WorkDayFilter.from_string(query)